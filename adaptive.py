@@ -0,0 +1,73 @@
+import math
+from statistics import NormalDist
+
+import numpy as np
+
+from batch_simulation import HOLD_ITERATIONS, simulate_batch
+from streaming_stats import RunningStats
+
+# Trials inside a block of 30 share held runway surface, gross weight and gradient draws, but no draw is held
+# across two blocks. The block means are therefore independent and give an honest standard error, where the
+# per-trial variance would understate it.
+BLOCK_SIZE = math.lcm(*HOLD_ITERATIONS.values())
+DEFAULT_BATCH_SIZE = 30000
+STATISTICS = ['landing_distance', 'percent']
+
+
+def block_means(values, block_size=BLOCK_SIZE):
+    """
+    Averages consecutive blocks of trials, a trailing partial block is left out
+    >>> block_means(np.arange(7.0), 3).tolist()
+    [1.0, 4.0]
+    """
+    n_blocks = len(values) // block_size
+    return np.asarray(values[:n_blocks * block_size]).reshape(n_blocks, block_size).mean(axis=1)
+
+
+def run_until_converged(airport_table, target_half_width, statistic='landing_distance', confidence=0.95,
+                        batch_size=DEFAULT_BATCH_SIZE, min_trials=None, max_trials=10 ** 7, seed=None,
+                        hypo_type='1'):
+    """
+    This function keeps running batches of trials until the confidence interval of the mean landing distance
+    or of the mean % of accommodating airports is narrow enough, or until the trial budget is used up
+    :param airport_table: the parsed airport dataset
+    :param target_half_width: the half-width of the confidence interval to reach, in the unit of the statistic
+    :param statistic: 'landing_distance' in feet or 'percent' of accommodating airports
+    :param confidence: confidence level of the interval
+    :param batch_size: trials per batch, rounded up to a multiple of the 30 trial block
+    :param min_trials: trials to run before the interval is trusted, defaults to one batch
+    :param max_trials: the trial budget
+    :param seed: seed of the random generator
+    :param hypo_type: the hypothesis the landing distance is calculated for
+    :return: a dictionary with the estimate, its standard error and half-width, the number of trials, whether
+             the target was reached and the convergence trace with one row per batch
+    """
+    if statistic not in STATISTICS:
+        raise ValueError('statistic must be one of {}'.format(STATISTICS))
+    from runway_index import RunwayIndex
+
+    runway_index = RunwayIndex.from_table(airport_table)
+    batch_size = -(-batch_size // BLOCK_SIZE) * BLOCK_SIZE
+    min_trials = batch_size if min_trials is None else min_trials
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    rng = np.random.default_rng(seed)
+    blocks = RunningStats()
+    trace = []
+    trials = 0
+    standard_error = half_width = math.inf
+    while trials < max_trials:
+        ld = simulate_batch(min(batch_size, max_trials - trials), hypo_type, rng=rng)['landing_distance']
+        values = ld if statistic == 'landing_distance' else runway_index.percent(ld)
+        blocks.update(block_means(values))
+        trials += len(ld)
+        if blocks.count > 1:
+            standard_error = blocks.std / math.sqrt(blocks.count)
+            half_width = z * standard_error
+        trace.append({'trials': trials, 'mean': blocks.mean, 'standard_error': standard_error,
+                      'half_width': half_width})
+        if trials >= min_trials and half_width <= target_half_width:
+            break
+
+    return {'statistic': statistic, 'mean': blocks.mean, 'standard_error': standard_error,
+            'half_width': half_width, 'confidence': confidence, 'trials': trials,
+            'converged': half_width <= target_half_width, 'trace': trace}
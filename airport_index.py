@@ -0,0 +1,230 @@
+import heapq
+import math
+
+import numpy as np
+from geographiclib.geodesic import Geodesic
+
+from instrumentation import instrumented
+
+geod = Geodesic.WGS84
+
+# A geodesic on the ellipsoid is never shorter than the straight line between its end points, so the
+# Earth-centered 3D distance is a lower bound of the WGS84 distance. It is off by less than 0.1% below 1000 km,
+# which is what lets us prune candidates cheaply without losing the exact answer. The slack covers rounding.
+CHORD_SLACK_KM = 1e-6
+
+
+def to_ecef(lat, long):
+    """
+    Converts geodetic latitudes and longitudes in degrees to Earth-centered 3D points on the WGS84 ellipsoid
+    :param lat: array of latitudes
+    :param long: array of longitudes
+    :return: an (n, 3) array of coordinates in kilometers
+    """
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    long = np.radians(np.asarray(long, dtype=np.float64))
+    e2 = geod.f * (2 - geod.f)
+    n = geod.a / 1000 / np.sqrt(1 - e2 * np.sin(lat) ** 2)
+    return np.stack([n * np.cos(lat) * np.cos(long), n * np.cos(lat) * np.sin(long), n * (1 - e2) * np.sin(lat)],
+                    axis=-1)
+
+
+@instrumented('geod_inverse')
+def geodesic_km(lat1, long1, lat2, long2):
+    """
+    Exact WGS84 distance in kilometers, computed the same way get_nearest_accommodating_airport does
+    """
+    return float(geod.Inverse(lat1, long1, lat2, long2)['s12']) / 1000
+
+
+class AirportIndex:
+
+    def __init__(self, lat, long, capacity, leaf_size=16):
+        """
+        This builds a k-d tree over the 3D positions of the airports. Every node keeps the largest capacity
+        found beneath it, so branches with no airport that can take the flight are skipped entirely.
+        :param lat: array of airport latitudes in degrees
+        :param long: array of airport longitudes in degrees
+        :param capacity: array with the largest landing distance every airport can accommodate
+        :param leaf_size: maximum number of airports stored in a leaf
+        """
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.long = np.asarray(long, dtype=np.float64)
+        self.points = to_ecef(self.lat, self.long)
+        self.leaf_size = leaf_size
+        self.order = np.arange(len(self.lat))
+        self.node_lower = []
+        self.node_upper = []
+        self.node_start = []
+        self.node_end = []
+        self.node_children = []
+        if len(self.lat):
+            self._build(0, len(self.lat))
+        self.node_lower = np.array(self.node_lower).reshape(-1, 3)
+        self.node_upper = np.array(self.node_upper).reshape(-1, 3)
+        self.set_capacity(capacity)
+
+    def _build(self, start, end):
+        node = len(self.node_start)
+        points = self.points[self.order[start:end]]
+        self.node_lower.append(points.min(axis=0))
+        self.node_upper.append(points.max(axis=0))
+        self.node_start.append(start)
+        self.node_end.append(end)
+        self.node_children.append(None)
+        if end - start > self.leaf_size:
+            axis = int(np.argmax(self.node_upper[node] - self.node_lower[node]))
+            middle = (end - start) // 2
+            split = np.argpartition(points[:, axis], middle)
+            self.order[start:end] = self.order[start:end][split]
+            left = self._build(start, start + middle)
+            right = self._build(start + middle, end)
+            self.node_children[node] = (left, right)
+        return node
+
+    def set_capacity(self, capacity):
+        """
+        Replaces the per-airport capacities without rebuilding the tree geometry
+        :param capacity: array with the largest landing distance every airport can accommodate
+        """
+        self.capacity = np.asarray(capacity, dtype=np.float64)
+        self.node_capacity = np.empty(len(self.node_start))
+        # children are always created after their parent, so walking backwards fills them in first
+        for node in range(len(self.node_start) - 1, -1, -1):
+            children = self.node_children[node]
+            if children is None:
+                self.node_capacity[node] = self.capacity[self.order[self.node_start[node]:self.node_end[node]]].max()
+            else:
+                self.node_capacity[node] = max(self.node_capacity[children[0]], self.node_capacity[children[1]])
+
+    def _box_distance(self, node, point):
+        gap = np.maximum(self.node_lower[node] - point, 0) + np.maximum(point - self.node_upper[node], 0)
+        return math.sqrt(float(gap @ gap))
+
+    def candidates(self, lat, long, min_capacity):
+        """
+        This generator yields the airports whose capacity exceeds min_capacity in increasing order of
+        their straight-line distance to the given position
+        :param lat: latitude of the current position
+        :param long: longitude of the current position
+        :param min_capacity: the landing distance the airport has to accommodate
+        :return: yields (straight-line distance in kilometers, airport position) pairs
+        """
+        if not len(self.node_start):
+            return
+        point = to_ecef(lat, long)
+        heap = [(self._box_distance(0, point), 0, 0)]
+        while heap:
+            distance, is_airport, item = heapq.heappop(heap)
+            if is_airport:
+                yield distance, item
+            elif self.node_capacity[item] > min_capacity:
+                children = self.node_children[item]
+                if children is None:
+                    airports = self.order[self.node_start[item]:self.node_end[item]]
+                    airports = airports[self.capacity[airports] > min_capacity]
+                    chords = np.linalg.norm(self.points[airports] - point, axis=1)
+                    for chord, airport in zip(chords.tolist(), airports.tolist()):
+                        heapq.heappush(heap, (chord, 1, airport))
+                else:
+                    for child in children:
+                        if self.node_capacity[child] > min_capacity:
+                            heapq.heappush(heap, (self._box_distance(child, point), 0, child))
+
+    @instrumented('nearest_airport')
+    def nearest(self, lat, long, min_capacity):
+        """
+        This function finds the nearest airport by WGS84 distance whose capacity exceeds min_capacity.
+        Candidates come off the tree in straight-line order and are refined with geod.Inverse until the
+        straight-line distance of the next candidate is farther than the best exact distance found so far.
+        :param lat: latitude of the current position
+        :param long: longitude of the current position
+        :param min_capacity: the landing distance the airport has to accommodate
+        :return: the distance in kilometers and the position of the airport, or (inf, -1) when none qualifies
+        """
+        nearest_airport = float('inf')
+        nearest_position = -1
+        for chord, airport in self.candidates(lat, long, min_capacity):
+            if chord - CHORD_SLACK_KM >= nearest_airport:
+                break
+            distance = geodesic_km(self.lat[airport], self.long[airport], lat, long)
+            if distance < nearest_airport:
+                nearest_airport = distance
+                nearest_position = airport
+        return nearest_airport, nearest_position
+
+    def nearest_many(self, lats, longs, min_capacity):
+        """
+        Runs nearest for every position, min_capacity can be a scalar or one value per position
+        :return: an array of distances in kilometers and an array of airport positions
+        """
+        min_capacity = np.broadcast_to(np.asarray(min_capacity, dtype=np.float64), np.shape(lats))
+        distances = np.empty(len(lats))
+        positions = np.empty(len(lats), dtype=np.intp)
+        for i, (lat, long, capacity) in enumerate(zip(lats, longs, min_capacity)):
+            distances[i], positions[i] = self.nearest(lat, long, capacity)
+        return distances, positions
+
+    @instrumented('nearest_airport')
+    def nearest_bulk(self, lats, longs, min_capacity, block_elements=4000000):
+        """
+        Answers nearest for many positions with the same min_capacity at once. The straight-line distances to
+        every accommodating airport are computed for a block of positions in one go, geod.Inverse runs for the
+        closest one and then only for the airports whose straight-line distance beats that exact distance.
+        :param lats: array of latitudes
+        :param longs: array of longitudes
+        :param min_capacity: the landing distance the airports have to accommodate
+        :param block_elements: limits the size of the position x airport matrix computed at once
+        :return: an array of distances in kilometers and an array of airport positions
+        """
+        eligible = np.flatnonzero(self.capacity > min_capacity)
+        distances = np.full(len(lats), np.inf)
+        positions = np.full(len(lats), -1, dtype=np.intp)
+        if not len(eligible) or not len(lats):
+            return distances, positions
+        points = to_ecef(lats, longs)
+        airports = self.points[eligible]
+        block = max(1, block_elements // len(eligible))
+        for start in range(0, len(points), block):
+            block_points = points[start:start + block]
+            squared = ((block_points ** 2).sum(axis=1)[:, None] + (airports ** 2).sum(axis=1)[None, :]
+                       - 2 * block_points @ airports.T)
+            chords = np.sqrt(np.maximum(squared, 0))
+            closest = chords.argmin(axis=1)
+            for row, column in enumerate(closest.tolist()):
+                airport = eligible[column]
+                distances[start + row] = geodesic_km(self.lat[airport], self.long[airport], lats[start + row],
+                                                     longs[start + row])
+                positions[start + row] = airport
+            # squaring loses precision for nearby points, so the slack here is a meter instead of a millimeter
+            rows, columns = np.nonzero(chords < distances[start:start + block, None] + 1e-3)
+            for row, column in zip((rows + start).tolist(), eligible[columns].tolist()):
+                if column == positions[row]:
+                    continue
+                distance = geodesic_km(self.lat[column], self.long[column], lats[row], longs[row])
+                if distance < distances[row]:
+                    distances[row] = distance
+                    positions[row] = column
+        return distances, positions
+
+
+def brute_force_nearest(lat, long, airport_lat, airport_long, capacity, min_capacity):
+    """
+    The reference answer the index has to reproduce: a full scan with geod.Inverse over every airport
+    :return: the distance in kilometers and the position of the airport, or (inf, -1) when none qualifies
+    >>> rng = np.random.default_rng(3)
+    >>> airport_lat, airport_long = rng.uniform(-90, 90, 500), rng.uniform(-180, 180, 500)
+    >>> capacity = rng.uniform(2000, 9000, 500)
+    >>> index = AirportIndex(airport_lat, airport_long, capacity, leaf_size=8)
+    >>> all(index.nearest(lat, long, x) == brute_force_nearest(lat, long, airport_lat, airport_long, capacity, x)
+    ...     for lat, long, x in zip(rng.uniform(-90, 90, 50), rng.uniform(-180, 180, 50), rng.uniform(0, 9500, 50)))
+    True
+    """
+    nearest_airport = float('inf')
+    nearest_position = -1
+    for airport in np.flatnonzero(np.asarray(capacity) > min_capacity):
+        distance = geodesic_km(airport_lat[airport], airport_long[airport], lat, long)
+        if distance < nearest_airport:
+            nearest_airport = distance
+            nearest_position = int(airport)
+    return nearest_airport, nearest_position
@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import uuid
+
+import numpy as np
+
+from instrumentation import instrumented, stage
+
+DEFAULT_CACHE_DIR = '.airport_cache'
+CACHE_VERSION = 2
+
+# column name in the airport sheet -> (attribute name, dtype)
+SHEET_COLUMNS = {'City Name': ('city', np.str_), 'Airport Name': ('name', np.str_), 'Country': ('country', np.str_),
+                 'Length (ft)': ('length', np.int64), 'Elevation (ft)': ('elevation', np.int64)}
+COLUMNS = ['lat', 'long', 'elevation', 'length', 'city', 'name', 'country']
+
+
+def get_sign(direction):
+    """
+    A simple functions that returns a boolean based on the direction
+    :param direction: a symbol for the direction
+    :return: returns a boolean based on the direction
+    >>> get_sign('N')
+    1
+    """
+    if direction == 'W' or direction == 'S':
+        return -1
+    return 1
+
+
+def create_lat_long(lat_long):
+    lat_long = lat_long.split(' ')
+    direction_lat = lat_long[0][-1]
+    direction_long = lat_long[1][-1]
+    lat = lat_long[0][:-1]
+    long = lat_long[1][:-1]
+    float_lat = float(lat[:2] + '.' + lat[2:])
+    float_long = float(long[:2] + '.' + long[2:])
+    return float_lat * get_sign(direction_lat), float_long * get_sign(direction_long)
+
+
+class AirportTable:
+
+    def __init__(self, lat, long, elevation, length, city, name, country):
+        """
+        Columnar view of the airport dataset with the geographic location already parsed into degrees
+        """
+        self.lat = lat
+        self.long = long
+        self.elevation = elevation
+        self.length = length
+        self.city = city
+        self.name = name
+        self.country = country
+
+    def __len__(self):
+        return len(self.lat)
+
+    @property
+    def usable_length(self):
+        """
+        The part of the runway a flight may use for landing, which is 60% of its length
+        """
+        return self.length * 0.6
+
+    def to_frame(self):
+        """
+        Builds a DataFrame with the original sheet column names plus the parsed lat and long
+        """
+        import pandas as pd
+
+        return pd.DataFrame({'City Name': self.city, 'Airport Name': self.name, 'Country': self.country,
+                             'Length (ft)': self.length, 'Elevation (ft)': self.elevation,
+                             'lat': self.lat, 'long': self.long})
+
+    @classmethod
+    def from_frame(cls, airport_df):
+        """
+        Parses an airport DataFrame as read from the spreadsheet into contiguous arrays
+        :param airport_df: the airport information dataset
+        :return: an AirportTable
+        """
+        columns = {attribute: np.ascontiguousarray(airport_df[column].to_numpy(), dtype=dtype)
+                   for column, (attribute, dtype) in SHEET_COLUMNS.items()}
+        lat_long = np.array([create_lat_long(airport_loc) for airport_loc in airport_df['Geographic Location']],
+                            dtype=np.float64).reshape(-1, 2)
+        columns['lat'] = np.ascontiguousarray(lat_long[:, 0])
+        columns['long'] = np.ascontiguousarray(lat_long[:, 1])
+        return cls(**columns)
+
+
+def file_fingerprint(path):
+    """
+    Returns the modification time, size and sha256 of a file, used to key the cache on its source
+    """
+    stat = os.stat(path)
+    with open(path, 'rb') as source:
+        digest = hashlib.sha256(source.read()).hexdigest()
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': digest}
+
+
+def cache_directory(path, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), DEFAULT_CACHE_DIR)
+    return os.path.join(cache_dir, os.path.basename(path))
+
+
+def column_path(directory, column, generation):
+    return os.path.join(directory, '{}-{}.npy'.format(column, generation))
+
+
+def read_meta(directory):
+    """
+    :return: the meta file of a cache directory, or None when it is missing or of another version
+    """
+    try:
+        with open(os.path.join(directory, 'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get('version') == CACHE_VERSION else None
+
+
+def read_cache(directory, path):
+    """
+    Memory-maps a cached table if it is still valid for the source file, the sha256 is only recomputed
+    when the modification time or size changed
+    :return: an AirportTable or None when the cache is missing or stale
+    """
+    meta = read_meta(directory)
+    if meta is None:
+        return None
+
+    stat = os.stat(path)
+    if (meta['mtime_ns'], meta['size']) != (stat.st_mtime_ns, stat.st_size):
+        fingerprint = file_fingerprint(path)
+        if fingerprint['sha256'] != meta['sha256']:
+            return None
+        write_meta(directory, fingerprint, meta['generation'])
+
+    try:
+        return AirportTable(**{column: np.load(column_path(directory, column, meta['generation']), mmap_mode='r')
+                               for column in COLUMNS})
+    except (OSError, ValueError):
+        return None
+
+
+def write_meta(directory, fingerprint, generation):
+    meta = dict(fingerprint, version=CACHE_VERSION, generation=generation)
+    temp_path = os.path.join(directory, 'meta.json.{}.tmp'.format(uuid.uuid4().hex))
+    with open(temp_path, 'w') as meta_file:
+        json.dump(meta, meta_file)
+    os.replace(temp_path, os.path.join(directory, 'meta.json'))
+
+
+def write_cache(directory, table, fingerprint):
+    """
+    Stores every column as its own .npy file so later runs can memory-map them. Every write gets its own
+    generation of column files, each written through a temporary file, and the meta file naming the
+    generation replaces the old one last. Files another process has memory-mapped are never written over,
+    a reader never sees an interrupted write as a valid cache, and two writers never mix their columns.
+    """
+    os.makedirs(directory, exist_ok=True)
+    previous = read_meta(directory)
+    generation = uuid.uuid4().hex
+    for column in COLUMNS:
+        path = column_path(directory, column, generation)
+        with open(path + '.tmp', 'wb') as target:
+            np.save(target, getattr(table, column))
+        os.replace(path + '.tmp', path)
+    write_meta(directory, fingerprint, generation)
+    # mappings of the previous generation stay valid after the unlink, version 1 caches had unversioned names
+    stale = [os.path.join(directory, column + '.npy') for column in COLUMNS]
+    if previous is not None:
+        stale += [column_path(directory, column, previous['generation']) for column in COLUMNS]
+    for path in stale:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+@instrumented('load_airport_table')
+def load_airport_table(path='airport_info.xlsx', cache_dir=None, use_cache=True):
+    """
+    This function loads the airport dataset. The spreadsheet is only read and parsed when there is no valid
+    cache for it, otherwise the cached columns are memory-mapped.
+    :param path: path of the airport spreadsheet
+    :param cache_dir: directory for the cache, defaults to .airport_cache next to the spreadsheet
+    :param use_cache: set to False to always parse the spreadsheet
+    :return: an AirportTable
+    """
+    directory = cache_directory(path, cache_dir)
+    if use_cache:
+        table = read_cache(directory, path)
+        if table is not None:
+            return table
+
+    import pandas as pd
+
+    fingerprint = file_fingerprint(path)
+    with stage('read_excel'):
+        airport_df = pd.read_excel(path)
+    table = AirportTable.from_frame(airport_df)
+    if use_cache:
+        try:
+            write_cache(directory, table, fingerprint)
+        except OSError:
+            # a read-only location only costs us the speed-up
+            pass
+    return table
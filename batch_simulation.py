@@ -0,0 +1,274 @@
+import numpy as np
+
+from instrumentation import instrumented
+
+# Category tables shared by the *Predictor classes in main.py and the batch engine below, so that both
+# paths always sample from the same distributions.
+TEMPERATURE_CATEGORIES = ['freezing', 'cold', 'pleasant', 'hot', 'extreme']
+TEMPERATURE_WEIGHTS = (5, 60, 120, 60, 20)
+TEMPERATURE_RANGES = [(-50, -20), (-20, 10), (10, 30), (30, 40), (40, 50)]
+ISA_BASE = 15
+
+RUNWAY_SURFACE_CATEGORIES = ['normal', 'wet', 'standing_water', 'snow', 'icy']
+RUNWAY_SURFACE_WEIGHTS = (80, 60, 40, 30, 22)
+# effect_by_runway_surface only has a branch for 'snowy', so a 'snow' draw falls through to the icy range
+RUNWAY_SURFACE_RANGES = [(1, 1), (1.3, 1.4), (2, 2.3), (3.5, 4.5), (3.5, 4.5)]
+
+GROSS_WEIGHT_CATEGORIES = ['light', 'medium', 'heavy', 'super']
+GROSS_WEIGHT_WEIGHTS = (40, 50, 30, 20)
+# (min weight, max weight, min runway) for the Boeing 737-700, -800, -900 and -900ER
+GROSS_WEIGHT_RANGES = [(83000, 129200, 4800), (91300, 146300, 5800), (93680, 147300, 5800),
+                       (98495, 138450, 5800)]
+
+ALTITUDE_CATEGORIES = ['low', 'normal', 'high']
+ALTITUDE_WEIGHTS = (7, 100, 5)
+ALTITUDE_RANGES = [(-14, 0), (0, 1000), (1000, 8355)]
+
+WIND_CATEGORIES = ['headwind', 'tailwind', 'crosswind']
+WIND_WEIGHTS = (80, 40, 10)
+WIND_MAX_SPEED = [20, 10, 35]
+CROSSWIND_ANGLES = np.array([0.17, 0.25, 0.34, 0.5, 0.75, 1])
+
+GRADIENT_RANGE = (50, 100)
+
+# Number of iterations a predictor holds on to its draw before sampling again
+HOLD_ITERATIONS = {'temp': 1, 'runway_surface': 10, 'gross_weight': 3, 'altitude': 1, 'wind': 1, 'gradient': 10}
+
+CATEGORIES = {'temp': TEMPERATURE_CATEGORIES, 'runway_surface': RUNWAY_SURFACE_CATEGORIES,
+              'gross_weight': GROSS_WEIGHT_CATEGORIES, 'altitude': ALTITUDE_CATEGORIES, 'wind': WIND_CATEGORIES}
+DEFAULT_WEIGHTS = {'temp': TEMPERATURE_WEIGHTS, 'runway_surface': RUNWAY_SURFACE_WEIGHTS,
+                   'gross_weight': GROSS_WEIGHT_WEIGHTS, 'altitude': ALTITUDE_WEIGHTS, 'wind': WIND_WEIGHTS}
+# per-category value ranges of every factor, the wind has a maximum speed per category
+DEFAULT_RANGES = {'temp': TEMPERATURE_RANGES, 'runway_surface': RUNWAY_SURFACE_RANGES,
+                  'gross_weight': GROSS_WEIGHT_RANGES, 'altitude': ALTITUDE_RANGES, 'wind': WIND_MAX_SPEED,
+                  'gradient': GRADIENT_RANGE}
+
+# The attribute map get_nearest_accommodating_airport simulates every airport with. It passes an integer
+# temperature and the airport elevation, which effect_by_temp and effect_by_altitude treat as 'extreme' and 'high'.
+DIVERSION_ATTRIBUTES = {'temp': 15, 'runway_surface': 'normal', 'gross_weight': 'medium', 'altitude': 0,
+                        'wind': 'headwind', 'gradient': 75}
+# The altitude category of an airport whose conditions leave it open. The elevation the original scan passes
+# matches no category and always gets the 'high' effect, so every per-airport result keeps that and the exact
+# elevation does not enter it.
+AIRPORT_ALTITUDE = 'high'
+
+# Uniform streams consumed by simulate_from_uniforms, one column per trial
+UNIFORM_STREAMS = ['temp', 'runway_surface', 'gross_weight', 'altitude', 'wind', 'gradient',
+                   'temp_value', 'runway_surface_value', 'gross_weight_value', 'altitude_value', 'wind_value',
+                   'crosswind_angle']
+
+
+def category_probabilities(weights):
+    """
+    Normalizes the relative weights used with random.choices into probabilities
+    :param weights: relative weights of the categories
+    :return: an array of probabilities that sums up to one
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    return weights / weights.sum()
+
+
+def categories_from_uniforms(u, weights):
+    """
+    Maps uniform draws on [0, 1) to category indices by inverting the cumulative weights, which is the same
+    rule random.choices uses
+    :param u: array of uniform draws
+    :param weights: relative weights of the categories
+    :return: an array of category indices
+    """
+    cum_weights = np.cumsum(np.asarray(weights, dtype=np.float64))
+    return np.searchsorted(cum_weights, u * cum_weights[-1], side='right').astype(np.intp)
+
+
+def randint_from_uniforms(u, low, high):
+    """
+    Vectorized equivalent of random.randint(low, high), both ends included
+    >>> randint_from_uniforms(np.array([0.0, 0.5, 0.999]), 50, 100).tolist()
+    [50, 75, 100]
+    """
+    return np.floor(low + u * (np.asarray(high) - low + 1)).astype(np.int64)
+
+
+def hold_uniforms(u_blocks, hold, n_trials):
+    """
+    Repeats every draw for `hold` consecutive trials, which is what the change_count counters of the predictor
+    classes do
+    :param u_blocks: one draw per block of `hold` trials
+    :param hold: number of iterations every draw is held for
+    :param n_trials: number of trials to return
+    :return: an array of n_trials draws
+    """
+    return np.repeat(u_blocks, hold)[:n_trials]
+
+
+def sample_uniforms(n_trials, rng):
+    """
+    This function draws every uniform stream the batch engine consumes. The category and gradient streams
+    are drawn once per hold block and repeated, while the within-category values are drawn per trial just
+    like the effect_by_* functions do.
+    :param n_trials: number of trials
+    :param rng: a numpy.random.Generator
+    :return: a dictionary of uniform arrays keyed by stream name
+    """
+    uniforms = {}
+    for stream in UNIFORM_STREAMS:
+        hold = HOLD_ITERATIONS.get(stream, 1)
+        n_blocks = -(-n_trials // hold)
+        uniforms[stream] = hold_uniforms(rng.random(n_blocks), hold, n_trials)
+    return uniforms
+
+
+def temp_effect(temp, u, ranges=TEMPERATURE_RANGES):
+    """
+    Vectorized effect_by_temp for arrays of temperature category indices
+    """
+    ranges = np.asarray(ranges)
+    temperature = randint_from_uniforms(u, ranges[temp, 0], ranges[temp, 1])
+    # 1 - 0.05 * |t - isa| / 10 below ISA and 1 + 0.05 * (t - isa) / 10 above it are the same line
+    return 1 + 0.05 * (temperature - ISA_BASE) / 10
+
+
+def runway_surface_effect(runway_surface, u, ranges=RUNWAY_SURFACE_RANGES):
+    """
+    Vectorized effect_by_runway_surface for arrays of runway surface category indices
+    """
+    ranges = np.asarray(ranges, dtype=np.float64)
+    low = ranges[runway_surface, 0]
+    return low + (ranges[runway_surface, 1] - low) * u
+
+
+def gross_weight_effect(gross_weight, u, ranges=GROSS_WEIGHT_RANGES):
+    """
+    Vectorized effect_by_gross_weight for arrays of weight category indices
+    """
+    ranges = np.asarray(ranges)
+    min_weight = ranges[gross_weight, 0]
+    flight_weight = randint_from_uniforms(u, min_weight, ranges[gross_weight, 1])
+    return (flight_weight - min_weight) / min_weight * ranges[gross_weight, 2]
+
+
+def altitude_effect(altitude, u, ranges=ALTITUDE_RANGES):
+    """
+    Vectorized effect_by_altitude for arrays of altitude category indices
+    """
+    ranges = np.asarray(ranges)
+    alt = randint_from_uniforms(u, ranges[altitude, 0], ranges[altitude, 1])
+    return (0.035 * (alt / 1000)) + 1
+
+
+def wind_effect(wind, u, u_angle, max_speed=WIND_MAX_SPEED):
+    """
+    Vectorized effect_by_wind for arrays of wind category indices
+    """
+    wind_speed = randint_from_uniforms(u, 0, np.asarray(max_speed)[wind])
+    headwind = (100 - 1.5 * wind_speed) / 100
+    tailwind = np.where(wind_speed <= 5, 1.25, 1.55)
+    crosswind_angle = CROSSWIND_ANGLES[np.floor(u_angle * len(CROSSWIND_ANGLES)).astype(np.intp)]
+    crosswind = np.where(wind_speed * crosswind_angle > 0, 0.85, 0)
+    return np.choose(wind, [headwind, tailwind, crosswind])
+
+
+def landing_distance(gross_weight, effects, hypo_type):
+    """
+    Combines the per-factor effects the same way mc_simulation does
+    :param gross_weight: array of weight category indices
+    :param effects: dictionary of effect arrays keyed by factor name
+    :param hypo_type: '1' adds the gradient effect, '2' leaves it out
+    :return: an array of landing distances
+    """
+    min_distance = np.where(gross_weight == GROSS_WEIGHT_CATEGORIES.index('light'), 4800, 5800)
+    ld = (min_distance * effects['temp_effect'] * effects['runway_surface_effect'] * effects['wind_effect']
+          * effects['altitude_effect']) + effects['gross_weight_effect']
+    if hypo_type == '1':
+        ld = ld + effects['gradient_effect']
+    return ld
+
+
+def category_index(factor, value):
+    """
+    Converts a category name to its index. Values the effect_by_* functions do not know, such as the
+    integer temperature and elevation get_nearest_accommodating_airport passes, end up in their final else
+    branch, which is the last category.
+    >>> category_index('altitude', 144)
+    2
+    """
+    categories = CATEGORIES[factor]
+    if value in categories:
+        return categories.index(value)
+    return len(categories) - 1
+
+
+@instrumented('batch_simulation')
+def simulate_from_uniforms(uniforms, hypo_type='1', weights=None, fixed=None, categories=None, ranges=None):
+    """
+    This function turns a dictionary of uniform streams into sampled categories, per-factor effects and
+    landing distances. Keeping the randomness in the uniforms lets other samplers reuse the same engine.
+    :param uniforms: dictionary of uniform arrays keyed by the names in UNIFORM_STREAMS
+    :param hypo_type: the hypothesis the landing distance is calculated for
+    :param weights: optional dictionary overriding the category weights of some factors
+    :param fixed: optional attribute map like the one mc_simulation takes, its factors are not sampled
+    :param categories: optional dictionary of category index arrays for factors that were sampled elsewhere
+    :param ranges: optional dictionary overriding the per-category value ranges of some factors
+    :return: a dictionary of arrays with the category indices, the effects and the landing distance
+    """
+    weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+    ranges = dict(DEFAULT_RANGES, **(ranges or {}))
+    fixed = fixed or {}
+    categories = categories or {}
+    n_trials = len(uniforms['temp'])
+    result = {}
+    for factor in CATEGORIES:
+        if factor in categories:
+            result[factor] = np.asarray(categories[factor], dtype=np.intp)
+        elif factor in fixed:
+            result[factor] = np.full(n_trials, category_index(factor, fixed[factor]), dtype=np.intp)
+        else:
+            result[factor] = categories_from_uniforms(uniforms[factor], weights[factor])
+    if 'gradient' in fixed:
+        result['gradient'] = np.full(n_trials, fixed['gradient'], dtype=np.int64)
+    else:
+        result['gradient'] = randint_from_uniforms(uniforms['gradient'], *ranges['gradient'])
+
+    result['temp_effect'] = temp_effect(result['temp'], uniforms['temp_value'], ranges['temp'])
+    result['runway_surface_effect'] = runway_surface_effect(result['runway_surface'],
+                                                            uniforms['runway_surface_value'], ranges['runway_surface'])
+    result['gross_weight_effect'] = gross_weight_effect(result['gross_weight'], uniforms['gross_weight_value'],
+                                                        ranges['gross_weight'])
+    result['altitude_effect'] = altitude_effect(result['altitude'], uniforms['altitude_value'], ranges['altitude'])
+    result['wind_effect'] = wind_effect(result['wind'], uniforms['wind_value'], uniforms['crosswind_angle'],
+                                        ranges['wind'])
+    result['gradient_effect'] = result['gradient'] * 10
+    result['landing_distance'] = landing_distance(result['gross_weight'], result, hypo_type)
+    return result
+
+
+def simulate_batch(n_trials, hypo_type='1', rng=None, seed=None, weights=None, fixed=None):
+    """
+    This function runs n_trials of the landing distance simulation at once. It samples the same category
+    distributions as RandomAttributeSelector and computes the same landing distance as mc_simulation,
+    including the runway surface, gross weight and gradient predictors holding on to their draws.
+    :param n_trials: number of trials to run
+    :param hypo_type: the hypothesis the landing distance is calculated for
+    :param rng: a numpy.random.Generator, created from seed when not given
+    :param seed: seed for a new generator when rng is not given
+    :param weights: optional dictionary overriding the category weights of some factors
+    :param fixed: optional attribute map like the one mc_simulation takes, its factors are not sampled
+    :return: a dictionary of arrays with the category indices, the effects and the landing distance
+    >>> result = simulate_batch(1000, seed=7)
+    >>> result['landing_distance'].shape
+    (1000,)
+    >>> bool((result['runway_surface'][:10] == result['runway_surface'][0]).all())
+    True
+    """
+    if rng is None:
+        rng = np.random.default_rng(seed)
+    return simulate_from_uniforms(sample_uniforms(n_trials, rng), hypo_type, weights, fixed)
+
+
+def category_names(factor, indices):
+    """
+    Converts an array of category indices back to the category names used by the scalar path
+    >>> category_names('wind', np.array([0, 2])).tolist()
+    ['headwind', 'crosswind']
+    """
+    return np.asarray(CATEGORIES[factor])[indices]
@@ -0,0 +1,308 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from airport_table import AirportTable
+
+SIZES = [1000, 10000, 100000]
+DEFAULT_SEED = 597
+DEFAULT_THRESHOLD = 0.25
+MIN_TIME = 0.5
+DEFAULT_OUTPUT = 'benchmark_results.json'
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+
+# name -> (function, unit, table sizes it runs for or None when it does not use an airport table)
+BENCHMARKS = {}
+# id of a synthetic table -> (table, PairSampler with its degrees computed), shared by the benchmarks sampling pairs
+PAIR_SAMPLERS = {}
+
+
+def benchmark(unit, max_size=None, uses_table=True):
+    """
+    Registers a benchmark. The decorated function gets the synthetic airport table (or None) and a seeded
+    generator and returns a function that runs the hot path once and returns the number of units it processed.
+    Benchmarks whose reference implementation scans every airport per call only run up to max_size airports.
+    """
+    def register(function):
+        sizes = [size for size in SIZES if max_size is None or size <= max_size] if uses_table else None
+        BENCHMARKS[function.__name__] = (function, unit, sizes)
+        return function
+    return register
+
+
+def synthetic_airport_table(n_airports, seed=DEFAULT_SEED):
+    """
+    A random airport table of n_airports rows with the shape of the real one: airports cluster around a few
+    hundred cities between 55S and 70N, runway lengths and elevations follow the spread of the spreadsheet
+    >>> table = synthetic_airport_table(100)
+    >>> len(table), bool((table.length >= 2000).all())
+    (100, True)
+    """
+    rng = np.random.default_rng(seed)
+    n_cities = max(1, min(400, n_airports // 10))
+    city_lat, city_long = rng.uniform(-55, 70, n_cities), rng.uniform(-180, 180, n_cities)
+    city = rng.integers(0, n_cities, n_airports)
+    lat = np.clip(city_lat[city] + rng.normal(0, 3, n_airports), -89, 89)
+    long = (city_long[city] + rng.normal(0, 3, n_airports) + 180) % 360 - 180
+    elevation = np.round(rng.gamma(1.2, 900, n_airports)).astype(np.int64)
+    length = np.round(np.clip(rng.normal(9500, 2500, n_airports), 2000, 16000)).astype(np.int64)
+    names = np.array(['Airport {}'.format(i) for i in range(n_airports)])
+    cities = np.array(['City {}'.format(i) for i in city])
+    return AirportTable(lat, long, elevation, length, cities, names, np.full(n_airports, 'SYNTHETIA'))
+
+
+def pair_sampler(table):
+    """
+    The PairSampler of a synthetic table with the valid degrees already computed, built once per table
+    """
+    from pair_sampler import PairSampler
+
+    if id(table) not in PAIR_SAMPLERS:
+        sampler = PairSampler.from_table(table)
+        sampler.valid_degrees()
+        PAIR_SAMPLERS[id(table)] = (table, sampler)
+    return PAIR_SAMPLERS[id(table)][1]
+
+
+def synthetic_routes(table, n_routes, rng):
+    """
+    Origin and destination positions of n_routes routes within the default aircraft range
+    """
+    from pair_sampler import PairSampler
+
+    return PairSampler.from_table(table).sample(n_routes, rng)
+
+
+@benchmark('trials', uses_table=False)
+def mc_simulation(table, rng):
+    import main
+
+    predictors = (main.TemperaturePredictor(), main.RunwaySurfacePredictor(), main.GrossWeightPredictor(),
+                  main.AltitudePredictor(), main.WindPredictor(), main.GradientPredictor())
+
+    def run(n_trials=2000):
+        for _ in range(n_trials):
+            main.mc_simulation(main.RandomAttributeSelector(*predictors).__dict__, '1')
+        return n_trials
+    return run
+
+
+@benchmark('calls', uses_table=False)
+def effect_by(table, rng):
+    import main
+
+    def run(n_calls=2000):
+        for _ in range(n_calls // 5):
+            main.effect_by_temp(random.choice(main.TEMPERATURE_CATEGORIES))
+            main.effect_by_runway_surface(random.choice(main.RUNWAY_SURFACE_CATEGORIES))
+            main.effect_by_gross_weight(random.choice(main.GROSS_WEIGHT_CATEGORIES))
+            main.effect_by_altitude(random.choice(main.ALTITUDE_CATEGORIES))
+            main.effect_by_wind(random.choice(main.WIND_CATEGORIES))
+        return n_calls // 5 * 5
+    return run
+
+
+@benchmark('trials', uses_table=False)
+def simulate_batch(table, rng):
+    from batch_simulation import simulate_batch
+
+    def run(n_trials=300000):
+        simulate_batch(n_trials, '1', rng=rng)
+        return n_trials
+    return run
+
+
+@benchmark('rows')
+def create_lat_long(table, rng):
+    from airport_table import create_lat_long
+
+    locations = ['{:04d}{} {:05d}{}'.format(int(abs(lat) * 100), 'N' if lat >= 0 else 'S', int(abs(long) * 100),
+                                            'E' if long >= 0 else 'W') for lat, long in zip(table.lat, table.long)]
+
+    def run():
+        for location in locations:
+            create_lat_long(location)
+        return len(locations)
+    return run
+
+
+@benchmark('route points', max_size=10000)
+def get_nearest_accommodating_airport(table, rng):
+    import main
+
+    main.airport_table = table
+    lats, longs = rng.uniform(-55, 70, 100), rng.uniform(-180, 180, 100)
+    position = iter(range(10 ** 9))
+
+    def run():
+        i = next(position) % len(lats)
+        main.get_nearest_accommodating_airport(lats[i], longs[i])
+        return 1
+    return run
+
+
+@benchmark('route points')
+def nearest_bulk(table, rng):
+    from airport_index import AirportIndex
+
+    index = AirportIndex(table.lat, table.long, table.usable_length)
+    lats, longs = rng.uniform(-55, 70, 2000), rng.uniform(-180, 180, 2000)
+
+    def run():
+        index.nearest_bulk(lats, longs, 6000)
+        return len(lats)
+    return run
+
+
+@benchmark('route points')
+def evaluate_routes(table, rng):
+    from airport_index import AirportIndex
+    from route_corridor import evaluate_routes
+
+    index = AirportIndex(table.lat, table.long, table.usable_length)
+    origin, destination = synthetic_routes(table, 20, rng)
+    lat, long = np.asarray(table.lat), np.asarray(table.long)
+
+    def run():
+        result = evaluate_routes(index, lat[origin], long[origin], lat[destination], long[destination], 6000)
+        return len(result['route'])
+    return run
+
+
+@benchmark('pairs')
+def get_flight_path(table, rng):
+    import main
+
+    sampler = pair_sampler(table)
+
+    def run(n_pairs=1000):
+        for _ in range(n_pairs):
+            main.get_flight_path(sampler)
+        return n_pairs
+    return run
+
+
+@benchmark('pairs')
+def pair_sampler_sample(table, rng):
+    sampler = pair_sampler(table)
+
+    def run(n_pairs=10000):
+        sampler.sample(n_pairs, rng)
+        return n_pairs
+    return run
+
+
+def measure(run, min_time=MIN_TIME):
+    """
+    Calls run until min_time seconds have passed, then once more under tracemalloc for the peak memory
+    :return: units per second, seconds spent and the peak traced memory in MB
+    """
+    units, start = 0, time.perf_counter()
+    while True:
+        units += run()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'rate': units / elapsed, 'seconds': elapsed, 'peak_memory_mb': peak / 2 ** 20}
+
+
+def run_benchmarks(names=None, sizes=None, seed=DEFAULT_SEED, min_time=MIN_TIME, verbose=True):
+    """
+    This function runs the registered benchmarks with fixed seeds
+    :param names: benchmarks to run, defaults to all of them
+    :param sizes: airport table sizes, defaults to SIZES
+    :param seed: seed of the synthetic tables and of every benchmark's generator
+    :param min_time: seconds every benchmark is repeated for
+    :return: a dictionary with the environment and the result of every benchmark keyed by 'name[size]'
+    """
+    results = {}
+    tables = {}
+    for offset, name in enumerate(names or BENCHMARKS):
+        function, unit, benchmark_sizes = BENCHMARKS[name]
+        for size in ([None] if benchmark_sizes is None else
+                     [size for size in benchmark_sizes if sizes is None or size in sizes]):
+            if size is not None and size not in tables:
+                tables[size] = synthetic_airport_table(size, seed)
+            random.seed(seed + offset)
+            run = function(tables.get(size), np.random.default_rng([seed, offset]))
+            key = name if size is None else '{}[{}]'.format(name, size)
+            results[key] = dict(measure(run, min_time), unit=unit)
+            if verbose:
+                print('{:45} {rate:14,.1f} {unit}/s  peak {peak_memory_mb:8.1f} MB'.format(key, **results[key]))
+    return {'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                            'machine': platform.machine(), 'seed': seed,
+                            'date': time.strftime('%Y-%m-%dT%H:%M:%S')},
+            'results': results}
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Lists the benchmarks whose rate dropped or whose peak memory grew by more than threshold, as a fraction of
+    the baseline. Benchmarks missing from either side are not compared.
+    >>> baseline = {'results': {'a': {'rate': 100.0, 'peak_memory_mb': 10.0}}}
+    >>> compare({'results': {'a': {'rate': 70.0, 'peak_memory_mb': 10.0}}}, baseline)
+    [('a', 'rate', 100.0, 70.0)]
+    >>> compare({'results': {'a': {'rate': 90.0, 'peak_memory_mb': 12.0}}}, baseline)
+    []
+    """
+    regressions = []
+    for key, result in results['results'].items():
+        reference = baseline['results'].get(key)
+        if reference is None:
+            continue
+        if result['rate'] < reference['rate'] * (1 - threshold):
+            regressions.append((key, 'rate', reference['rate'], result['rate']))
+        if result['peak_memory_mb'] > max(reference['peak_memory_mb'], 1) * (1 + threshold):
+            regressions.append((key, 'peak_memory_mb', reference['peak_memory_mb'], result['peak_memory_mb']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the simulation hot paths')
+    parser.add_argument('names', nargs='*', help='benchmarks to run, all of {} by default'.format(list(BENCHMARKS)))
+    parser.add_argument('--sizes', type=int, nargs='+', help='synthetic airport table sizes')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--min-time', type=float, default=MIN_TIME, help='seconds every benchmark runs for')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='JSON file the results are written to')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='JSON file with the baseline results')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='allowed relative slowdown or memory growth before failing')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    args = parser.parse_args(argv)
+
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error('unknown benchmarks {}'.format(sorted(unknown)))
+    results = run_benchmarks(args.names or None, args.sizes, args.seed, args.min_time)
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as output:
+            json.dump(results, output, indent=2)
+        return 0
+    try:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    except FileNotFoundError:
+        print('no baseline at {}, run with --save-baseline to store one'.format(args.baseline), file=sys.stderr)
+        return 2
+    regressions = compare(results, baseline, args.threshold)
+    for key, metric, reference, current in regressions:
+        print('REGRESSION {} {}: {:.1f} -> {:.1f}'.format(key, metric, reference, current))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,242 @@
+import json
+import os
+
+import numpy as np
+
+from batch_simulation import CATEGORIES, category_names
+from instrumentation import count, stage
+from parallel_runner import DEFAULT_CHUNK_SIZE, ROUTE_STEP_M, hypo1_rows, hypo2_rows, iter_chunks, split_trials
+from streaming_stats import StreamingAggregator
+
+CHECKPOINT_FILE = 'checkpoint.json'
+CHECKPOINT_VERSION = 1
+FORMATS = ['parquet', 'npz']
+DEFAULT_ROUTES_PER_CHUNK = 10
+
+# the columns every kind of run keeps running statistics of when its chunks are aggregated
+AGGREGATED_COLUMNS = {'hypo1': ['landing_distance', 'percent'], 'hypo2': ['nearest_airport_distance']}
+
+
+def default_format():
+    """
+    Parquet when pyarrow is installed, otherwise one uncompressed .npz archive per chunk
+    """
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        return 'npz'
+    return 'parquet'
+
+
+def write_chunk(path, columns):
+    """
+    Writes the columns of one chunk through a temporary file, so a run killed while writing never leaves a
+    truncated chunk behind
+    """
+    temp_path = path + '.tmp'
+    if path.endswith('.parquet'):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        pq.write_table(pa.table(columns), temp_path)
+    else:
+        with open(temp_path, 'wb') as target:
+            np.savez(target, **columns)
+    os.replace(temp_path, path)
+
+
+def read_chunk(path, columns=None):
+    """
+    Reads some or all columns of one chunk
+    :return: a dictionary of column name -> array
+    """
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(path, columns=columns)
+        return {name: table.column(name).to_numpy() for name in table.column_names}
+    with np.load(path) as stored:
+        return {name: stored[name] for name in (columns or stored.files)}
+
+
+def read_checkpoint(directory):
+    """
+    :return: the checkpoint of the run in directory, or None when there is none
+    """
+    try:
+        with open(os.path.join(directory, CHECKPOINT_FILE)) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+    except FileNotFoundError:
+        return None
+    if checkpoint.get('version') != CHECKPOINT_VERSION:
+        raise ValueError('{} holds a checkpoint of an unsupported version'.format(directory))
+    return checkpoint
+
+
+def write_checkpoint(directory, checkpoint):
+    temp_path = os.path.join(directory, CHECKPOINT_FILE + '.tmp')
+    with open(temp_path, 'w') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file, indent=2)
+    os.replace(temp_path, os.path.join(directory, CHECKPOINT_FILE))
+
+
+def open_checkpoint(directory, kind, parameters, n_chunks, seed=None, chunk_format=None):
+    """
+    Starts a run in directory, or picks up the one that is already there. A run is only resumed with the
+    parameters it was started with, and with its own seed when one is given.
+    :return: the checkpoint
+    """
+    checkpoint = read_checkpoint(directory)
+    if checkpoint is not None:
+        if checkpoint['kind'] != kind or checkpoint['parameters'] != parameters:
+            raise ValueError('{} holds a {} run with {}, not a {} run with {}'.format(
+                directory, checkpoint['kind'], checkpoint['parameters'], kind, parameters))
+        if seed is not None and np.random.SeedSequence(seed).entropy != checkpoint['entropy']:
+            raise ValueError('{} holds a run with another seed'.format(directory))
+        return checkpoint
+    chunk_format = chunk_format or default_format()
+    if chunk_format not in FORMATS:
+        raise ValueError('chunk_format must be one of {}'.format(FORMATS))
+    os.makedirs(directory, exist_ok=True)
+    # without a seed the fresh entropy is stored, so the run can still be resumed
+    checkpoint = {'version': CHECKPOINT_VERSION, 'kind': kind, 'parameters': parameters,
+                  'entropy': np.random.SeedSequence(seed).entropy, 'format': chunk_format, 'n_chunks': n_chunks,
+                  'chunks': [], 'rows': 0}
+    write_checkpoint(directory, checkpoint)
+    return checkpoint
+
+
+def write_chunks(directory, checkpoint, results):
+    """
+    Stores every chunk as it arrives and records it in the checkpoint right after, so the checkpoint only ever
+    lists complete chunks. A chunk written just before the run was killed is written again on resume.
+    """
+    for columns in results:
+        name = 'chunk-{:06d}.{}'.format(len(checkpoint['chunks']), checkpoint['format'])
+        with stage('write_chunk'):
+            write_chunk(os.path.join(directory, name), columns)
+            checkpoint['chunks'].append(name)
+            checkpoint['rows'] += len(next(iter(columns.values())))
+            write_checkpoint(directory, checkpoint)
+        count('chunks_written')
+
+
+def run_hypo1_checkpointed(airport_table, n_trials, directory, seed=None, workers=None,
+                           chunk_size=DEFAULT_CHUNK_SIZE, chunk_format=None):
+    """
+    This function runs hypothesis 1 like run_hypo1_parallel and writes every trial to chunk files in
+    directory. Every chunk has its own child of the master SeedSequence, so the checkpoint only has to hold
+    the master entropy and the completed chunks: calling it again on a killed run simulates the remaining
+    chunks, and the result is identical to a run that was never interrupted.
+    :param airport_table: the parsed airport dataset
+    :param n_trials: number of trials
+    :param directory: directory of the chunks and the checkpoint
+    :param seed: the master seed
+    :param workers: number of processes, defaults to the number of cores
+    :param chunk_size: number of trials per chunk
+    :param chunk_format: 'parquet' or 'npz', defaults to parquet when pyarrow is installed
+    :return: the ChunkedResults of the run
+    """
+    chunks = split_trials(n_trials, chunk_size)
+    checkpoint = open_checkpoint(directory, 'hypo1', {'n_trials': n_trials, 'chunk_size': chunk_size},
+                                 len(chunks), seed, chunk_format)
+    seeds = np.random.SeedSequence(checkpoint['entropy']).spawn(len(chunks))
+    tasks = list(zip(seeds, chunks))[len(checkpoint['chunks']):]
+    write_chunks(directory, checkpoint, iter_chunks(hypo1_rows, tasks, airport_table, workers))
+    return ChunkedResults(directory)
+
+
+def run_hypo2_checkpointed(airport_table, n_routes, directory, seed=None, workers=None, ds=ROUTE_STEP_M,
+                           routes_per_chunk=DEFAULT_ROUTES_PER_CHUNK, chunk_format=None):
+    """
+    This function walks n_routes routes of hypothesis 2 like run_hypo2_parallel and writes every route point
+    to chunk files of routes_per_chunk routes, resumable the same way as run_hypo1_checkpointed
+    :param airport_table: the parsed airport dataset
+    :param n_routes: number of routes
+    :param directory: directory of the chunks and the checkpoint
+    :param seed: the master seed
+    :param workers: number of processes, defaults to the number of cores
+    :param ds: step size along the route in meters
+    :param routes_per_chunk: number of routes per chunk
+    :param chunk_format: 'parquet' or 'npz', defaults to parquet when pyarrow is installed
+    :return: the ChunkedResults of the run
+    """
+    starts = range(0, n_routes, routes_per_chunk)
+    checkpoint = open_checkpoint(directory, 'hypo2', {'n_routes': n_routes, 'ds': ds,
+                                                      'routes_per_chunk': routes_per_chunk},
+                                 len(starts), seed, chunk_format)
+    seeds = np.random.SeedSequence(checkpoint['entropy']).spawn(n_routes)
+    tasks = [(start, seeds[start:start + routes_per_chunk], ds) for start in starts][len(checkpoint['chunks']):]
+    write_chunks(directory, checkpoint, iter_chunks(hypo2_rows, tasks, airport_table, workers))
+    return ChunkedResults(directory)
+
+
+class ChunkedResults:
+
+    def __init__(self, directory):
+        """
+        Reads the chunks of a checkpointed run one at a time, only the chunks the checkpoint lists are read
+        :param directory: directory of the chunks and the checkpoint
+        """
+        self.directory = directory
+        self.checkpoint = read_checkpoint(directory)
+        if self.checkpoint is None:
+            raise FileNotFoundError('no checkpointed run in {}'.format(directory))
+
+    @property
+    def kind(self):
+        return self.checkpoint['kind']
+
+    @property
+    def complete(self):
+        return len(self.checkpoint['chunks']) == self.checkpoint['n_chunks']
+
+    def __len__(self):
+        return self.checkpoint['rows']
+
+    def chunks(self, columns=None):
+        """
+        Yields the columns of every chunk in order
+        """
+        for name in self.checkpoint['chunks']:
+            yield read_chunk(os.path.join(self.directory, name), columns)
+
+    def column(self, name):
+        return np.concatenate([chunk[name] for chunk in self.chunks([name])])
+
+    def aggregate(self):
+        """
+        Folds the chunks into running statistics without holding more than one chunk in memory
+        :return: a StreamingAggregator, with category histograms for hypothesis 1
+        """
+        aggregator = StreamingAggregator()
+        for chunk in self.chunks():
+            for name in AGGREGATED_COLUMNS[self.kind]:
+                aggregator.update(name, chunk[name])
+            if self.kind == 'hypo1':
+                aggregator.update_histograms(chunk)
+        return aggregator
+
+    def summary(self):
+        """
+        The count, mean, standard deviation, range and quantiles of the aggregated columns
+        """
+        aggregator = self.aggregate()
+        return {name: dict(stats.as_dict(),
+                           **{'p{:g}'.format(q * 100): float(value) for q, value in
+                              zip(aggregator.quantiles, aggregator.digests[name].quantile(aggregator.quantiles))})
+                for name, stats in aggregator.stats.items()}
+
+    def to_frame(self):
+        """
+        All rows as one DataFrame with category names instead of indices, only for runs that fit in memory
+        """
+        import pandas as pd
+
+        frames = []
+        for chunk in self.chunks():
+            for factor in CATEGORIES:
+                if factor in chunk:
+                    chunk[factor] = category_names(factor, chunk[factor])
+            frames.append(pd.DataFrame(chunk))
+        return pd.concat(frames, ignore_index=True)
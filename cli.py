@@ -0,0 +1,242 @@
+import argparse
+import json
+import sys
+
+import numpy as np
+
+from instrumentation import PROFILERS, disable, enable, format_report, run_profiled, write_report
+
+# Only numpy, the instrumentation and the modules a subcommand needs are imported: geographiclib is loaded by the
+# subcommands that walk routes and matplotlib only when a plot is written, so a single query starts quickly.
+
+DEFAULT_AIRPORTS = 'airport_info.xlsx'
+DEFAULT_LANDING_DISTANCE = 6000
+
+
+def positive_int(text):
+    """
+    An argparse type for counts that have to be at least 1
+    """
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError('must be at least 1, not {}'.format(value))
+    return value
+
+
+def parse_conditions(pairs):
+    """
+    Turns factor=category arguments into the attribute map mc_simulation takes
+    >>> parse_conditions(['runway_surface=wet', 'wind=tailwind'])
+    {'runway_surface': 'wet', 'wind': 'tailwind'}
+    """
+    conditions = {}
+    for pair in pairs or []:
+        factor, _, category = pair.partition('=')
+        if not category:
+            raise SystemExit('conditions are given as factor=category, not {!r}'.format(pair))
+        conditions[factor] = category
+    return conditions
+
+
+def load_table(args):
+    from airport_table import load_airport_table
+
+    return load_airport_table(args.airports)
+
+
+def find_airport(airport_table, airport):
+    """
+    The position of an airport given by its position in the table or by its name
+    """
+    if airport.isdigit():
+        return int(airport)
+    matches = np.flatnonzero(np.char.lower(np.asarray(airport_table.name, dtype=str)) == airport.lower())
+    if not len(matches):
+        raise SystemExit('no airport named {!r}'.format(airport))
+    return int(matches[0])
+
+
+def print_json(result):
+    print(json.dumps(result, indent=2, default=float))
+
+
+def run_checkpointed(function, *args):
+    """
+    Runs or resumes a checkpointed run, a directory holding another run ends the command with its message
+    """
+    try:
+        return function(*args)
+    except ValueError as error:
+        raise SystemExit(str(error))
+
+
+def hypo1(args):
+    if args.output:
+        from checkpoint_runner import run_hypo1_checkpointed
+
+        results = run_checkpointed(run_hypo1_checkpointed, load_table(args), args.trials, args.output, args.seed,
+                                   args.workers)
+        print_json(results.summary())
+        return
+    from parallel_runner import run_hypo1_parallel
+
+    print_json(run_hypo1_parallel(load_table(args), args.trials, args.seed, args.workers))
+
+
+def hypo2(args):
+    if args.output:
+        from checkpoint_runner import run_hypo2_checkpointed
+
+        results = run_checkpointed(run_hypo2_checkpointed, load_table(args), args.routes, args.output, args.seed,
+                                   args.workers, args.step_km * 1000)
+        result = dict(results.summary(), routes=args.routes)
+    else:
+        from parallel_runner import run_hypo2_parallel
+
+        result = run_hypo2_parallel(load_table(args), args.routes, args.seed, args.workers, args.step_km * 1000)
+        result['routes'] = [[float(value) for value in route['route']] for route in result['routes']]
+    summary = result['nearest_airport_distance']
+    if args.plot:
+        from main import plot_hypo2
+
+        plot_hypo2(round(summary['min'], 2), round(summary['max'], 2), round(summary['mean'], 2), args.plot)
+    print_json({'routes': result['routes'], 'nearest_airport_distance': summary})
+
+
+def summary(args):
+    from checkpoint_runner import ChunkedResults
+
+    try:
+        results = ChunkedResults(args.directory)
+    except (OSError, ValueError) as error:
+        raise SystemExit(str(error))
+    print_json(dict(results.summary(), kind=results.kind, rows=len(results), complete=results.complete))
+
+
+def routes(args):
+    from pair_sampler import PairSampler
+    from route_corridor import evaluate_airport_pairs
+
+    airport_table = load_table(args)
+    origin, destination = PairSampler.from_table(airport_table).sample(args.routes, seed=args.seed)
+    result = evaluate_airport_pairs(airport_table, np.stack([origin, destination], axis=1), args.landing_distance,
+                                    args.step_km * 1000, args.gap_km)
+    print_json({'routes': [{'origin': str(airport_table.name[o]), 'destination': str(airport_table.name[d]),
+                            'length_km': length, 'min_distance': minimum, 'mean_distance': mean,
+                            'max_distance': maximum}
+                           for o, d, length, minimum, mean, maximum in
+                           zip(origin, destination, result['length_km'], result['min_distance'],
+                               result['mean_distance'], result['max_distance'])],
+                'gaps': result['gaps']})
+
+
+def airport(args):
+    from distribution_engine import airport_conditions, landing_distance_distribution
+
+    airport_table = load_table(args)
+    position = find_airport(airport_table, args.airport)
+    conditions = airport_conditions(parse_conditions(args.conditions))
+    distribution = landing_distance_distribution(conditions, hypo_type=args.hypo_type)
+    usable_length = float(airport_table.usable_length[position])
+    print_json({'position': position, 'name': str(airport_table.name[position]),
+                'city': str(airport_table.city[position]), 'country': str(airport_table.country[position]),
+                'lat': float(airport_table.lat[position]), 'long': float(airport_table.long[position]),
+                'elevation': float(airport_table.elevation[position]), 'usable_length': usable_length,
+                'conditions': conditions,
+                'accommodation_probability': float(distribution.cdf(np.nextafter(usable_length, 0))),
+                'landing_distance_quantiles': {str(q): float(distribution.quantile(q)) for q in args.quantiles}})
+
+
+def serve(args):
+    from diversion_service import DiversionService, serve as serve_forever
+    from eligibility import load_eligibility_table
+
+    airport_table = load_table(args)
+    service = DiversionService(airport_table, load_eligibility_table(airport_table, args.airports),
+                               args.batch_window_ms / 1000)
+    serve_forever(service, args.host, args.port, args.unix)
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Monte Carlo simulation of the landing distance of a flight')
+    parser.add_argument('--airports', default=DEFAULT_AIRPORTS, help='the airport spreadsheet')
+    parser.add_argument('--instrument', action='store_true',
+                        help='print per-stage timings of this process to stderr at the end of the command')
+    parser.add_argument('--memory', action='store_true', help='also track allocations per stage with tracemalloc')
+    parser.add_argument('--report', help='write the per-stage timings as JSON to this file')
+    parser.add_argument('--profile', help='profile the command and dump the profile to this file')
+    parser.add_argument('--profiler', choices=PROFILERS, default='cprofile')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+
+    def add_run_arguments(subcommand):
+        subcommand.add_argument('--seed', type=int, help='master seed, results are identical for any worker count')
+        subcommand.add_argument('--workers', type=positive_int,
+                                help='number of processes, defaults to the number of cores')
+        subcommand.add_argument('--output', metavar='DIRECTORY',
+                                help='write every result to chunk files in this directory, running the same '
+                                     'command again resumes an interrupted run')
+
+    command = subcommands.add_parser('hypo1', help='%% of airports that accommodate the landing distance')
+    command.add_argument('--trials', type=positive_int, default=1000000)
+    add_run_arguments(command)
+    command.set_defaults(function=hypo1)
+
+    command = subcommands.add_parser('hypo2', help='distance to the nearest accommodating airport along routes')
+    command.add_argument('--routes', type=positive_int, default=1)
+    command.add_argument('--step-km', type=float, default=100, help='distance between two route points')
+    command.add_argument('--plot', help='save the min/mean/max plot to this image file')
+    add_run_arguments(command)
+    command.set_defaults(function=hypo2)
+
+    command = subcommands.add_parser('routes', help='diversion coverage of a batch of sampled routes')
+    command.add_argument('--routes', type=positive_int, default=100)
+    command.add_argument('--landing-distance', type=float, default=DEFAULT_LANDING_DISTANCE,
+                         help='the landing distance a diversion airport has to accommodate')
+    command.add_argument('--step-km', type=float, default=100, help='distance between two route points')
+    command.add_argument('--gap-km', type=float, default=500, help='report stretches farther than this from any '
+                                                                   'accommodating airport')
+    command.add_argument('--seed', type=int)
+    command.set_defaults(function=routes)
+
+    command = subcommands.add_parser('airport', help='landing distance distribution at a single airport')
+    command.add_argument('airport', help='name or position of the airport')
+    command.add_argument('--conditions', nargs='*', metavar='FACTOR=CATEGORY',
+                         help='fixed categories, such as runway_surface=wet wind=tailwind')
+    command.add_argument('--quantiles', type=float, nargs='+', default=[0.5, 0.95, 0.99])
+    command.add_argument('--hypo-type', choices=['1', '2'], default='2')
+    command.set_defaults(function=airport)
+
+    command = subcommands.add_parser('serve', help='answer nearest diversion airport queries over local HTTP')
+    command.add_argument('--host', default='127.0.0.1')
+    command.add_argument('--port', type=int, default=8597)
+    command.add_argument('--unix', metavar='PATH', help='listen on this Unix socket instead of host and port')
+    command.add_argument('--batch-window-ms', type=float, default=0,
+                         help='how long the first query of a batch waits for concurrent ones')
+    command.set_defaults(function=serve)
+
+    command = subcommands.add_parser('summary', help='statistics of the chunks a run with --output wrote')
+    command.add_argument('directory')
+    command.set_defaults(function=summary)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    if args.instrument or args.memory or args.report:
+        enable(memory=args.memory)
+    if args.profile:
+        run_profiled(lambda: args.function(args), args.profile, args.profiler)
+    else:
+        args.function(args)
+    finished = disable()
+    if finished is not None:
+        report = finished.report()
+        # stdout carries the JSON result of the command
+        print(format_report(report), file=sys.stderr)
+        if args.report:
+            write_report(report, args.report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,242 @@
+import json
+import os
+import time
+
+import numpy as np
+
+from batch_simulation import CATEGORIES, DEFAULT_RANGES, DEFAULT_WEIGHTS, UNIFORM_STREAMS, categories_from_uniforms, \
+    simulate_from_uniforms
+from distribution_engine import airport_conditions
+
+# marks an airport without an override in the compiled override arrays
+NO_OVERRIDE = -1
+# largest number of trials network_feasibility simulates at once, it works through the airports in chunks
+DEFAULT_BATCH_TRIALS = 2 ** 20
+
+
+class ConditionProfile:
+
+    def __init__(self, weights=None, ranges=None, overrides=None, name='default'):
+        """
+        A declarative description of the conditions flights land in: the category weights and value ranges of
+        every factor, and per-airport overrides that fix the category of a factor at some airports, such as
+        {'runway_surface': {'wet': [3, 17, 41]}, 'wind': {'tailwind': [8]}}. Airports are evaluated under
+        airport_conditions, so their altitude is AIRPORT_ALTITUDE unless an override fixes another one.
+        :param weights: dictionary of factor -> relative category weights, defaults to DEFAULT_WEIGHTS
+        :param ranges: dictionary of factor -> per-category value ranges, defaults to DEFAULT_RANGES
+        :param overrides: dictionary of factor -> {category name: airport positions}
+        :param name: a label for the profile
+        """
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.ranges = dict(DEFAULT_RANGES, **(ranges or {}))
+        self.overrides = {factor: {category: list(airports) for category, airports in by_category.items()}
+                          for factor, by_category in (overrides or {}).items()}
+        self.name = name
+        for factor, by_category in self.overrides.items():
+            unknown = set(by_category) - set(CATEGORIES.get(factor, []))
+            if unknown:
+                raise ValueError('unknown {} categories {}'.format(factor, sorted(unknown)))
+        self.compiled = {}
+
+    def with_overrides(self, overrides, weights=None, name=None):
+        """
+        A new profile with the same ranges, the given overrides replacing the ones of the same factor
+        """
+        return ConditionProfile(dict(self.weights, **(weights or {})), self.ranges, dict(self.overrides, **overrides),
+                                name or self.name)
+
+    def compile(self, n_airports):
+        """
+        Turns the profile into the arrays the simulation consumes, once per number of airports
+        :return: a CompiledProfile
+        """
+        if n_airports not in self.compiled:
+            self.compiled[n_airports] = CompiledProfile(self, n_airports)
+        return self.compiled[n_airports]
+
+    def to_dict(self):
+        return {'name': self.name, 'weights': {factor: list(weights) for factor, weights in self.weights.items()},
+                'ranges': {factor: np.asarray(ranges).tolist() for factor, ranges in self.ranges.items()},
+                'overrides': self.overrides}
+
+    @classmethod
+    def from_dict(cls, profile):
+        return cls(profile.get('weights'), profile.get('ranges'), profile.get('overrides'),
+                   profile.get('name', 'default'))
+
+
+class CompiledProfile:
+
+    def __init__(self, profile, n_airports):
+        """
+        Lookup tables of a profile: the category weights and value ranges of every factor as arrays, and
+        for every factor an array with the overridden category index of every airport, the category
+        airport_conditions fixes or NO_OVERRIDE elsewhere
+        """
+        self.name = profile.name
+        self.n_airports = n_airports
+        self.weights = {factor: np.asarray(weights, dtype=np.float64) for factor, weights in profile.weights.items()}
+        self.ranges = {factor: np.asarray(ranges) for factor, ranges in profile.ranges.items()}
+        self.overrides = {}
+        fixed = airport_conditions()
+        for factor in CATEGORIES:
+            if factor not in fixed and factor not in profile.overrides:
+                continue
+            default = CATEGORIES[factor].index(fixed[factor]) if factor in fixed else NO_OVERRIDE
+            override = np.full(n_airports, default, dtype=np.int8)
+            for category, airports in profile.overrides.get(factor, {}).items():
+                override[np.asarray(airports, dtype=np.intp)] = CATEGORIES[factor].index(category)
+            self.overrides[factor] = override
+
+    def categories(self, uniforms, airports):
+        """
+        Samples the category of every factor for trials at the given airports, overridden airports keep their
+        category
+        """
+        categories = {}
+        for factor in CATEGORIES:
+            sampled = categories_from_uniforms(uniforms[factor], self.weights[factor])
+            if factor in self.overrides:
+                override = self.overrides[factor][airports]
+                sampled = np.where(override != NO_OVERRIDE, override, sampled).astype(np.intp)
+            categories[factor] = sampled
+        return categories
+
+    def simulate(self, uniforms, airports, hypo_type='2'):
+        """
+        Runs the batch engine for one trial per entry of airports
+        """
+        return simulate_from_uniforms(uniforms, hypo_type, categories=self.categories(uniforms, airports),
+                                      ranges=self.ranges)
+
+
+def trial_major_uniforms(n_trials, rng):
+    """
+    Every stream drawn independently for every trial, all streams of a trial next to each other in the draws of
+    rng, so the uniforms of consecutive calls are those of one call for all of their trials
+    >>> whole = trial_major_uniforms(6, np.random.default_rng(0))
+    >>> rng = np.random.default_rng(0)
+    >>> parts = [trial_major_uniforms(2, rng), trial_major_uniforms(4, rng)]
+    >>> bool(np.array_equal(whole['wind'], np.concatenate([part['wind'] for part in parts])))
+    True
+    """
+    draws = np.ascontiguousarray(rng.random((n_trials, len(UNIFORM_STREAMS))).T)
+    return dict(zip(UNIFORM_STREAMS, draws))
+
+
+def network_feasibility(airport_table, profile, n_trials=1000, rng=None, seed=None, hypo_type='2',
+                        batch_trials=DEFAULT_BATCH_TRIALS):
+    """
+    This function estimates for every airport the probability that its usable runway accommodates the landing
+    distance under a condition profile, with n_trials independent trials per airport. The airports are simulated
+    in chunks of at most batch_trials trials and only the accommodated counts are kept, so memory does not grow
+    with the size of the network. The chunks draw their uniforms trial by trial from rng, so the result does not
+    depend on batch_trials.
+    :param airport_table: the parsed airport dataset
+    :param profile: a ConditionProfile
+    :param n_trials: trials per airport
+    :param rng: a numpy.random.Generator, created from seed when not given
+    :param seed: seed for a new generator when rng is not given
+    :param hypo_type: the hypothesis the landing distance is calculated for
+    :param batch_trials: largest number of trials simulated at once, at least one airport is always simulated
+    :return: an array of probabilities
+    >>> from airport_table import AirportTable
+    >>> names = np.array(['a', 'b'])
+    >>> table = AirportTable(np.zeros(2), np.zeros(2), np.zeros(2), np.array([20000, 20000]), names, names, names)
+    >>> icy = ConditionProfile(overrides={'runway_surface': {'icy': [1]}})
+    >>> feasibility = network_feasibility(table, icy, seed=1)
+    >>> bool(feasibility[0] > feasibility[1])
+    True
+    """
+    if rng is None:
+        rng = np.random.default_rng(seed)
+    compiled = profile.compile(len(airport_table))
+    usable_length = np.asarray(airport_table.usable_length)
+    accommodated = np.zeros(len(airport_table), dtype=np.int64)
+    chunk = max(1, batch_trials // n_trials)
+    for start in range(0, len(airport_table), chunk):
+        stop = min(len(airport_table), start + chunk)
+        airports = np.repeat(np.arange(start, stop), n_trials)
+        ld = compiled.simulate(trial_major_uniforms(len(airports), rng), airports, hypo_type)['landing_distance']
+        accommodated[start:stop] = (usable_length[airports] > ld).reshape(stop - start, n_trials).sum(axis=1)
+    return accommodated / n_trials
+
+
+def airport_positions(airport_table, airports):
+    """
+    Converts airport positions or names, as a weather feed lists them, to positions
+    >>> from airport_table import AirportTable
+    >>> names = np.array(['a', 'b'])
+    >>> table = AirportTable(np.zeros(2), np.zeros(2), np.zeros(2), np.zeros(2), names, names, names)
+    >>> airport_positions(table, [1, 'a'])
+    [1, 0]
+    >>> airport_positions(table, ['c'])
+    Traceback (most recent call last):
+    ...
+    ValueError: unknown airport 'c'
+    """
+    names = {name: position for position, name in enumerate(airport_table.name)}
+    positions = []
+    for airport in airports:
+        if isinstance(airport, (int, np.integer)):
+            if not 0 <= airport < len(airport_table):
+                raise ValueError('airport position {} is outside the {} airports'.format(airport, len(airport_table)))
+            positions.append(int(airport))
+        elif airport in names:
+            positions.append(names[airport])
+        else:
+            raise ValueError('unknown airport {!r}'.format(airport))
+    return positions
+
+
+class WeatherFeed:
+
+    def __init__(self, path, airport_table, base_profile=None):
+        """
+        A local JSON file standing in for live weather updates. It holds optional weights and the overrides of
+        the current weather, airports given by position or by name, for example
+        {"overrides": {"runway_surface": {"wet": ["Toronto Pearson International"]}, "wind": {"tailwind": [3]}}}
+        :param path: path of the feed file
+        :param airport_table: the airport dataset the names are looked up in
+        :param base_profile: the profile the weather is applied to, defaults to ConditionProfile()
+        """
+        self.path = path
+        self.airport_table = airport_table
+        self.base_profile = base_profile or ConditionProfile()
+        self.modified = None
+
+    def poll(self):
+        """
+        Reads the feed when the file changed since the last poll
+        :return: a new ConditionProfile, or None when nothing changed
+        """
+        try:
+            modified = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if modified == self.modified:
+            return None
+        with open(self.path) as feed:
+            update = json.load(feed)
+        self.modified = modified
+        overrides = {factor: {category: airport_positions(self.airport_table, airports)
+                              for category, airports in by_category.items()}
+                     for factor, by_category in update.get('overrides', {}).items()}
+        return self.base_profile.with_overrides(overrides, update.get('weights'), update.get('name'))
+
+    def follow(self, interval=300, max_updates=None, n_trials=1000, seed=None, hypo_type='2'):
+        """
+        This generator re-runs network_feasibility every time the feed changes, checking it every interval
+        seconds. Every update gets its own child of the master seed.
+        :return: yields (profile, feasibility) pairs
+        """
+        seeds = np.random.SeedSequence(seed)
+        updates = 0
+        while max_updates is None or updates < max_updates:
+            profile = self.poll()
+            if profile is None:
+                time.sleep(interval)
+                continue
+            updates += 1
+            yield profile, network_feasibility(self.airport_table, profile, n_trials,
+                                               rng=np.random.default_rng(seeds.spawn(1)[0]), hypo_type=hypo_type)
@@ -0,0 +1,274 @@
+import math
+from functools import lru_cache
+
+import numpy as np
+
+from batch_simulation import (AIRPORT_ALTITUDE, ALTITUDE_RANGES, CATEGORIES, CROSSWIND_ANGLES, DEFAULT_WEIGHTS,
+                              GRADIENT_RANGE, GROSS_WEIGHT_CATEGORIES, GROSS_WEIGHT_RANGES, ISA_BASE,
+                              RUNWAY_SURFACE_RANGES, TEMPERATURE_RANGES, WIND_MAX_SPEED, category_index,
+                              category_probabilities)
+
+# Resolution of the grids the densities are convolved on: the multiplicative factors on a grid of log landing
+# distance and the additive ones on a grid of feet. The discretization error is a few feet at most.
+LOG_STEP = 1e-4
+LINEAR_STEP = 1.0
+ELEVATION_BUCKET = 100
+CACHE_SIZE = 256
+
+
+def fft_convolve(a, b):
+    """
+    Linear convolution of two non-negative mass arrays through the FFT
+    >>> fft_convolve(np.array([0.5, 0.5]), np.array([0.25, 0.75])).round(4).tolist()
+    [0.125, 0.5, 0.375]
+    """
+    size = len(a) + len(b) - 1
+    n_fft = 1 << (size - 1).bit_length()
+    result = np.fft.irfft(np.fft.rfft(a, n_fft) * np.fft.rfft(b, n_fft), n_fft)[:size]
+    return np.maximum(result, 0)
+
+
+class GridMass:
+
+    def __init__(self, offset, mass):
+        """
+        Probability mass on a regular grid, bin i sits at (offset + i) * step
+        """
+        self.offset = offset
+        self.mass = mass
+
+    @classmethod
+    def from_values(cls, values, probabilities, step):
+        index = np.rint(np.asarray(values, dtype=np.float64) / step).astype(np.int64)
+        offset = int(index.min())
+        return cls(offset, np.bincount(index - offset, weights=np.broadcast_to(probabilities, index.shape)))
+
+    def convolve(self, other):
+        return GridMass(self.offset + other.offset, fft_convolve(self.mass, other.mass))
+
+    def mix(self, other, weight):
+        """
+        Mixture of self and other, other gets `weight`
+        """
+        offset = min(self.offset, other.offset)
+        size = max(self.offset + len(self.mass), other.offset + len(other.mass)) - offset
+        mass = np.zeros(size)
+        mass[self.offset - offset:self.offset - offset + len(self.mass)] += (1 - weight) * self.mass
+        mass[other.offset - offset:other.offset - offset + len(other.mass)] += weight * other.mass
+        return GridMass(offset, mass)
+
+
+def temp_values(category):
+    low, high = TEMPERATURE_RANGES[category]
+    return 1 + 0.05 * (np.arange(low, high + 1) - ISA_BASE) / 10, None
+
+
+def altitude_values(category):
+    low, high = ALTITUDE_RANGES[category]
+    return (0.035 * (np.arange(low, high + 1) / 1000)) + 1, None
+
+
+def wind_values(category):
+    """
+    Effect of every wind speed, crosswind only matters through whether the speed is zero
+    """
+    speeds = np.arange(WIND_MAX_SPEED[category] + 1)
+    if category == 0:
+        return (100 - 1.5 * speeds) / 100, None
+    if category == 1:
+        return np.where(speeds <= 5, 1.25, 1.55), None
+    return np.where(speeds * CROSSWIND_ANGLES.min() > 0, 0.85, 0), None
+
+
+def mixture_values(categories, weights, values_for):
+    """
+    The values of a factor with their probabilities, mixed over the allowed categories
+    """
+    probabilities = category_probabilities(weights)
+    values, masses = [], []
+    for category in categories:
+        category_values, category_masses = values_for(category)
+        if category_masses is None:
+            category_masses = np.full(len(category_values), 1 / len(category_values))
+        values.append(category_values)
+        masses.append(category_masses * probabilities[category] / probabilities[list(categories)].sum())
+    return np.concatenate(values), np.concatenate(masses)
+
+
+def log_grid_mass(values, masses):
+    return GridMass.from_values(np.log(values), masses, LOG_STEP)
+
+
+def runway_log_mass(categories, weights):
+    """
+    Log-grid mass of the runway surface multiplier, uniform on its range so the mass of every log bin is
+    (exp(upper) - exp(lower)) / (high - low)
+    """
+    probabilities = category_probabilities(weights)
+    total = probabilities[list(categories)].sum()
+    result = None
+    for category in categories:
+        low, high = RUNWAY_SURFACE_RANGES[category]
+        if low == high:
+            mass = GridMass.from_values([math.log(low)], [1.0], LOG_STEP)
+        else:
+            first = int(math.floor(math.log(low) / LOG_STEP + 0.5))
+            last = int(math.floor(math.log(high) / LOG_STEP + 0.5))
+            edges = (np.arange(first, last + 2) - 0.5) * LOG_STEP
+            edges = np.clip(np.exp(edges), low, high)
+            mass = GridMass(first, np.diff(edges) / (high - low))
+        weight = probabilities[category] / total
+        if result is None:
+            result, accumulated = mass, weight
+        else:
+            accumulated += weight
+            result = result.mix(mass, weight / accumulated)
+    return result
+
+
+def log_to_linear(log_mass, scale):
+    """
+    Moves mass from the log grid to the linear grid, multiplying every value by scale
+    """
+    values = np.exp((log_mass.offset + np.arange(len(log_mass.mass))) * LOG_STEP) * scale
+    return GridMass.from_values(values, log_mass.mass, LINEAR_STEP)
+
+
+def gross_weight_mass(category):
+    min_weight, max_weight, min_runway = GROSS_WEIGHT_RANGES[category]
+    flight_weight = np.arange(min_weight, max_weight + 1)
+    values = (flight_weight - min_weight) / min_weight * min_runway
+    return GridMass.from_values(values, 1 / len(values), LINEAR_STEP)
+
+
+class LandingDistanceDistribution:
+
+    def __init__(self, grid_mass):
+        """
+        The distribution of the landing distance on a grid of LINEAR_STEP feet
+        """
+        self.values = (grid_mass.offset + np.arange(len(grid_mass.mass))) * LINEAR_STEP
+        self.mass = grid_mass.mass / grid_mass.mass.sum()
+        self.cumulative = np.cumsum(self.mass)
+
+    @property
+    def mean(self):
+        return float(self.values @ self.mass)
+
+    def cdf(self, x):
+        """
+        P(landing distance <= x)
+        """
+        position = np.searchsorted(self.values, x, side='right')
+        return np.where(position > 0, self.cumulative[np.maximum(position - 1, 0)], 0.0)
+
+    def quantile(self, q):
+        position = np.searchsorted(self.cumulative, q, side='left')
+        return self.values[np.minimum(position, len(self.values) - 1)]
+
+
+def normalize_conditions(conditions):
+    """
+    Turns a conditions dictionary of category names into a hashable key of category indices
+    >>> normalize_conditions({'wind': 'headwind', 'temp': 18})
+    (('temp', 4), ('wind', 0))
+    """
+    return tuple(sorted((factor, category_index(factor, value)) for factor, value in (conditions or {}).items()
+                        if factor in CATEGORIES))
+
+
+def elevation_bucket(elevation):
+    return None if elevation is None else int(round(elevation / ELEVATION_BUCKET))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def cached_distribution(key, bucket, gradient, hypo_type, weights_key):
+    fixed = dict(key)
+    weights = dict(DEFAULT_WEIGHTS, **dict(weights_key))
+
+    def allowed(factor):
+        return [fixed[factor]] if factor in fixed else list(range(len(CATEGORIES[factor])))
+
+    temp = log_grid_mass(*mixture_values(allowed('temp'), weights['temp'], temp_values))
+    if bucket is None:
+        altitude = log_grid_mass(*mixture_values(allowed('altitude'), weights['altitude'],
+                                                 altitude_values))
+    else:
+        altitude = log_grid_mass([(0.035 * (bucket * ELEVATION_BUCKET / 1000)) + 1], [1.0])
+    wind_value, wind_mass = mixture_values(allowed('wind'), weights['wind'], wind_values)
+    zero_wind = float(wind_mass[wind_value == 0].sum())
+    multiplier = temp.convolve(altitude).convolve(runway_log_mass(allowed('runway_surface'),
+                                                                  weights['runway_surface']))
+    if zero_wind < 1:
+        multiplier = multiplier.convolve(log_grid_mass(wind_value[wind_value > 0],
+                                                       wind_mass[wind_value > 0] / (1 - zero_wind)))
+
+    # like mc_simulation, only hypothesis 1 adds the gradient effect
+    if hypo_type != '1':
+        gradient_mass = GridMass(0, np.ones(1))
+    elif gradient is not None:
+        gradient_mass = GridMass.from_values([gradient * 10], [1.0], LINEAR_STEP)
+    else:
+        gradient_mass = GridMass.from_values(np.arange(GRADIENT_RANGE[0], GRADIENT_RANGE[1] + 1) * 10,
+                                             1 / (GRADIENT_RANGE[1] - GRADIENT_RANGE[0] + 1), LINEAR_STEP)
+
+    weight_probabilities = category_probabilities(weights['gross_weight'])
+    weight_categories = allowed('gross_weight')
+    total = weight_probabilities[weight_categories].sum()
+    result, accumulated = None, 0
+    for category in weight_categories:
+        min_distance = 4800 if category == GROSS_WEIGHT_CATEGORIES.index('light') else 5800
+        product = GridMass(0, np.ones(1)) if zero_wind == 1 else log_to_linear(multiplier, min_distance)
+        if 0 < zero_wind < 1:
+            product = product.mix(GridMass(0, np.ones(1)), zero_wind)
+        mass = product.convolve(gross_weight_mass(category)).convolve(gradient_mass)
+        weight = weight_probabilities[category] / total
+        accumulated += weight
+        result = mass if result is None else result.mix(mass, weight / accumulated)
+    return LandingDistanceDistribution(result)
+
+
+def landing_distance_distribution(conditions=None, elevation=None, gradient=None, hypo_type='1', weights=None):
+    """
+    This function computes the distribution of the landing distance for a condition set without sampling.
+    Factors fixed in the conditions use their category, the others are mixed over their category weights, and
+    the per-factor densities are convolved, the multiplicative ones in log space. Results are kept in an LRU
+    cache keyed on the categories, the elevation bucket and the gradient.
+    :param conditions: dictionary of factor -> category name, like the attribute map mc_simulation takes
+    :param elevation: optional elevation in feet, replaces the altitude category by its exact effect. Per-airport
+                      results do not use it, they follow airport_conditions.
+    :param gradient: optional fixed runway gradient, otherwise drawn like GradientPredictor for hypothesis 1
+    :param hypo_type: the hypothesis the landing distance is calculated for
+    :param weights: optional dictionary overriding the category weights of some factors
+    :return: a LandingDistanceDistribution with cdf, quantile and mean
+    >>> distribution = landing_distance_distribution({'temp': 'pleasant', 'runway_surface': 'normal',
+    ...                                               'gross_weight': 'light', 'altitude': 'low', 'wind': 'tailwind'})
+    >>> round(float(distribution.cdf(4000)), 4), round(float(distribution.cdf(20000)), 4)
+    (0.0, 1.0)
+    """
+    weights_key = tuple(sorted((factor, tuple(value)) for factor, value in (weights or {}).items()))
+    return cached_distribution(normalize_conditions(conditions), elevation_bucket(elevation), gradient, hypo_type,
+                               weights_key)
+
+
+def airport_conditions(conditions=None):
+    """
+    The conditions an airport is evaluated under: the given ones, in the AIRPORT_ALTITUDE category when they leave
+    the altitude open
+    >>> airport_conditions({'wind': 'headwind'})
+    {'wind': 'headwind', 'altitude': 'high'}
+    """
+    conditions = dict(conditions or {})
+    conditions.setdefault('altitude', AIRPORT_ALTITUDE)
+    return conditions
+
+
+def accommodation_probability(airport_table, conditions=None, gradient=None, hypo_type='2', weights=None):
+    """
+    This function gives for every airport the probability that its usable runway exceeds the landing distance.
+    Airports are evaluated under airport_conditions, so all of them share one distribution.
+    :param airport_table: the parsed airport dataset
+    :return: an array of probabilities
+    """
+    distribution = landing_distance_distribution(airport_conditions(conditions), None, gradient, hypo_type, weights)
+    return distribution.cdf(np.nextafter(np.asarray(airport_table.usable_length, dtype=np.float64), 0))
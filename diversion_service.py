@@ -0,0 +1,498 @@
+import asyncio
+import collections
+import contextlib
+import json
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from batch_simulation import CATEGORIES
+from instrumentation import StageStats
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8597
+DEFAULT_PROFILE = 'diversion'
+DEFAULT_LEVEL = 0.5
+# Queries that arrive while a batch is being answered are always answered together with the next one. A
+# positive window also holds the first query of a batch back for that many seconds to gather more.
+BATCH_WINDOW = 0.0
+MAX_BATCH = 4096
+MAX_BODY = 2 ** 20
+# profiles of condition sets asked for by queries that are kept, the least recently used one is dropped first
+MAX_CONDITION_PROFILES = 64
+STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+          500: 'Internal Server Error'}
+
+
+def condition_profile(conditions):
+    """
+    The eligibility profile of a set of conditions given by category name, the factors it leaves out are mixed
+    over their category weights
+    :return: the profile name and the profile
+    >>> condition_profile({'wind': 'tailwind', 'runway_surface': 'wet'})[0]
+    'conditions_runway_surface-wet_wind-tailwind'
+    """
+    if not isinstance(conditions, dict):
+        raise ValueError('conditions are given as an object of factor -> category')
+    for factor, category in conditions.items():
+        if category not in CATEGORIES.get(factor, []):
+            raise ValueError('unknown condition {}={}'.format(factor, category))
+    name = 'conditions_' + '_'.join('{}-{}'.format(factor, conditions[factor]) for factor in sorted(conditions))
+    return name, {'conditions': dict(sorted(conditions.items())), 'hypo_type': '2'}
+
+
+def finite_or_none(value):
+    return float(value) if np.isfinite(value) else None
+
+
+class PayloadTooLarge(ValueError):
+    pass
+
+
+class DiversionService:
+
+    def __init__(self, airport_table, eligibility_table, batch_window=BATCH_WINDOW, max_batch=MAX_BATCH,
+                 max_profiles=MAX_CONDITION_PROFILES):
+        """
+        Answers "which is the nearest airport that accommodates the landing distance from here" over HTTP,
+        keeping the airport table, the per-profile airport indexes and the landing distance distributions in
+        memory between requests. Concurrent queries are queued and answered in batches with one nearest_bulk
+        call per profile and quantile level. All of the eligibility state is only touched by a single worker
+        thread, so the event loop keeps accepting requests while a batch is computed.
+        :param airport_table: the parsed airport dataset
+        :param eligibility_table: the EligibilityTable of the dataset, profiles for new condition sets are added
+                                  to it as they are asked for
+        :param batch_window: seconds the first query of a batch waits for others
+        :param max_batch: largest number of queries answered in one batch
+        :param max_profiles: number of condition set profiles kept, the named profiles of the table are always kept
+        """
+        self.airport_table = airport_table
+        self.eligibility = eligibility_table
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.max_profiles = max_profiles
+        # queries can only name the profiles the table started with, condition set profiles come and go
+        self.named_profiles = frozenset(eligibility_table.profiles)
+        self.condition_profiles = collections.OrderedDict()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.queue = None
+        self.batcher = None
+        self.started = time.perf_counter()
+        self.latency = StageStats()
+        self.lookup = StageStats()
+        self.counters = {'connections': 0, 'requests': 0, 'queries': 0, 'batches': 0, 'errors': 0,
+                         'max_batch_size': 0, 'evicted_profiles': 0}
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.batcher = asyncio.create_task(self.run_batches())
+
+    async def stop(self):
+        if self.batcher is not None:
+            self.batcher.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.batcher
+        self.executor.shutdown()
+
+    def parse_query(self, query):
+        """
+        Checks one query and turns it into the profile, level and position it asks for
+        """
+        if not isinstance(query, dict):
+            raise ValueError('a query is an object with lat, long and optionally conditions, profile and level')
+        try:
+            lat, long = float(query['lat']), float(query['long'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError('a query needs a numeric lat and long')
+        if not (-90 <= lat <= 90 and -180 <= long <= 180):
+            raise ValueError('lat {} long {} is not a position'.format(lat, long))
+        level = query.get('level', DEFAULT_LEVEL)
+        if level not in self.eligibility.levels:
+            raise ValueError('level must be one of {}'.format(self.eligibility.levels))
+        if 'conditions' in query:
+            name, profile = condition_profile(query['conditions'])
+        else:
+            name, profile = query.get('profile', DEFAULT_PROFILE), None
+            if name not in self.named_profiles:
+                raise ValueError('unknown profile {!r}'.format(name))
+        return name, profile, level, lat, long
+
+    def answer(self, batch):
+        """
+        Runs in the worker thread: answers a batch of parsed queries with one nearest_bulk call per profile and
+        level, a profile that was not asked for before is computed first. Afterwards the least recently used
+        condition set profiles beyond max_profiles are dropped.
+        :return: one result dictionary per query, or the exception that failed the profile and level of the query
+        """
+        start = time.perf_counter()
+        groups = {}
+        for position, (name, profile, level, lat, long) in enumerate(batch):
+            if profile is not None:
+                if name not in self.condition_profiles:
+                    self.eligibility.set_profile(name, profile)
+                    self.condition_profiles[name] = True
+                self.condition_profiles.move_to_end(name)
+            groups.setdefault((name, level), []).append(position)
+        results = [None] * len(batch)
+        table = self.airport_table
+        for (name, level), positions in groups.items():
+            try:
+                lats = np.array([batch[position][3] for position in positions])
+                longs = np.array([batch[position][4] for position in positions])
+                distances, airports = self.eligibility.nearest_bulk(lats, longs, name, level)
+                landing_distance = self.eligibility.quantile(name, level)
+                for position, distance, airport in zip(positions, distances.tolist(), airports.tolist()):
+                    if airport < 0:
+                        results[position] = {'profile': name, 'level': level, 'distance_km': None, 'airport': None}
+                        continue
+                    usable_length = float(table.usable_length[airport])
+                    results[position] = {
+                        'profile': name, 'level': level, 'distance_km': finite_or_none(distance),
+                        'airport': {'position': airport, 'name': str(table.name[airport]),
+                                    'city': str(table.city[airport]), 'country': str(table.country[airport]),
+                                    'lat': float(table.lat[airport]), 'long': float(table.long[airport]),
+                                    'usable_length': usable_length,
+                                    'landing_distance': landing_distance,
+                                    'margin': usable_length - landing_distance}}
+            except Exception as error:
+                for position in positions:
+                    results[position] = error
+        while len(self.condition_profiles) > self.max_profiles:
+            name, _ = self.condition_profiles.popitem(last=False)
+            self.eligibility.remove_profile(name)
+            self.counters['evicted_profiles'] += 1
+        self.lookup.add(time.perf_counter() - start)
+        return results
+
+    async def run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            if self.batch_window > 0:
+                await asyncio.sleep(self.batch_window)
+            while len(batch) < self.max_batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            self.counters['batches'] += 1
+            self.counters['max_batch_size'] = max(self.counters['max_batch_size'], len(batch))
+            try:
+                results = await loop.run_in_executor(self.executor, self.answer, [query for query, _ in batch])
+            except Exception as error:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    async def nearest(self, payload):
+        """
+        Answers a single query object, or {"queries": [...]} with a list of them
+        """
+        single = not (isinstance(payload, dict) and 'queries' in payload)
+        queries = [payload] if single else payload['queries']
+        if not isinstance(queries, list):
+            raise ValueError('queries is a list of query objects')
+        parsed = [self.parse_query(query) for query in queries]
+        loop = asyncio.get_running_loop()
+        futures = []
+        for query in parsed:
+            future = loop.create_future()
+            self.queue.put_nowait((query, future))
+            futures.append(future)
+        self.counters['queries'] += len(futures)
+        results = await asyncio.gather(*futures)
+        return results[0] if single else {'results': results}
+
+    def metrics(self):
+        uptime = time.perf_counter() - self.started
+        from distribution_engine import cached_distribution
+
+        return dict(self.counters, uptime_s=uptime, queries_per_s=self.counters['queries'] / uptime,
+                    mean_batch_size=self.counters['queries'] / self.counters['batches']
+                    if self.counters['batches'] else 0.0,
+                    latency_ms=self.timings(self.latency), lookup_ms=self.timings(self.lookup),
+                    profiles=sorted(self.eligibility.quantiles),
+                    distribution_cache=cached_distribution.cache_info()._asdict())
+
+    @staticmethod
+    def timings(stats):
+        return {'count': stats.calls, 'mean': stats.total / stats.calls * 1000 if stats.calls else 0.0,
+                'p50': stats.quantile(0.5) * 1000, 'p99': stats.quantile(0.99) * 1000}
+
+    async def route(self, method, path, body):
+        """
+        :return: the status and the JSON payload of the response
+        """
+        path = path.split('?')[0]
+        if path == '/nearest':
+            if method != 'POST':
+                return 405, {'error': 'POST a query to /nearest'}
+            try:
+                payload = json.loads(body or b'null')
+                return 200, await self.nearest(payload)
+            except ValueError as error:
+                return 400, {'error': str(error)}
+        if path in ('/metrics', '/health'):
+            if method != 'GET':
+                return 405, {'error': 'GET {}'.format(path)}
+            if path == '/health':
+                return 200, {'status': 'ok', 'airports': len(self.airport_table)}
+            return 200, self.metrics()
+        return 404, {'error': 'no endpoint {}'.format(path)}
+
+    async def handle(self, reader, writer):
+        """
+        Serves the HTTP/1.1 requests of one connection, which stays open until the client closes it
+        """
+        self.counters['connections'] += 1
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except ValueError as error:
+                    # the body of a rejected request is not read, so the connection cannot be reused
+                    self.counters['errors'] += 1
+                    await write_response(writer, 413 if isinstance(error, PayloadTooLarge) else 400,
+                                         {'error': str(error)}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, path, keep_alive, body = request
+                start = time.perf_counter()
+                self.counters['requests'] += 1
+                try:
+                    status, payload = await self.route(method, path, body)
+                except Exception as error:
+                    status, payload = 500, {'error': '{}: {}'.format(type(error).__name__, error)}
+                if status != 200:
+                    self.counters['errors'] += 1
+                await write_response(writer, status, payload, keep_alive)
+                if path.startswith('/nearest'):
+                    self.latency.add(time.perf_counter() - start)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # the server is shutting down, the stream callback logs handlers that end cancelled
+            pass
+        finally:
+            writer.close()
+
+
+async def read_request(reader):
+    """
+    Reads one HTTP request
+    :return: the method, path, whether to keep the connection open and the body, or None when the client
+             closed the connection
+    :raises PayloadTooLarge: when the body is longer than MAX_BODY
+    """
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    parts = request_line.decode('latin-1').split()
+    if len(parts) != 3:
+        raise ValueError('malformed request line')
+    method, path, version = parts
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise ValueError('malformed content-length')
+    if length < 0:
+        raise ValueError('malformed content-length')
+    if length > MAX_BODY:
+        raise PayloadTooLarge('request bodies are limited to {} bytes'.format(MAX_BODY))
+    body = await reader.readexactly(length) if length else b''
+    connection = headers.get('connection', '').lower()
+    keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+    return method, path, keep_alive, body
+
+
+async def write_response(writer, status, payload, keep_alive=True):
+    body = json.dumps(payload).encode()
+    writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n'
+                 .format(status, STATUS[status], len(body), 'keep-alive' if keep_alive else 'close').encode()
+                 + body)
+    await writer.drain()
+
+
+async def start_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None):
+    """
+    Starts the service and listens on host and port, or on a Unix socket when unix_path is given
+    :return: the asyncio server
+    """
+    await service.start()
+    if unix_path is not None:
+        return await asyncio.start_unix_server(service.handle, unix_path)
+    return await asyncio.start_server(service.handle, host, port)
+
+
+def serve(service, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None):
+    """
+    Runs the service until the process is interrupted
+    """
+    async def run():
+        server = await start_server(service, host, port, unix_path)
+        print('serving on {}'.format(unix_path or '{}:{}'.format(*server.sockets[0].getsockname()[:2])), flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await service.stop()
+
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(run())
+
+
+@contextlib.contextmanager
+def running_service(service, host=DEFAULT_HOST, port=0, unix_path=None):
+    """
+    Runs the service on an event loop in a background thread for the duration of a with block, port 0 picks a
+    free port
+    :return: the (host, port) the service listens on, or the unix_path
+    >>> from benchmarks import synthetic_airport_table
+    >>> from eligibility import EligibilityTable
+    >>> table = synthetic_airport_table(300)
+    >>> service = DiversionService(table, EligibilityTable(table))
+    >>> with running_service(service) as address, DiversionClient(*address) as client:
+    ...     answer = client.nearest(45.0, 10.0, conditions={'runway_surface': 'normal'})
+    ...     rejected = client.request('POST', '/nearest', {'lat': 45.0, 'long': 10.0, 'level': 0.3})
+    ...     metrics = client.metrics()
+    >>> answer['distance_km'] > 0, answer['airport']['margin'] > 0, rejected[0]
+    (True, True, 400)
+    >>> metrics['queries'], metrics['errors']
+    (1, 1)
+    """
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    state = {}
+
+    async def run():
+        state['server'] = await start_server(service, host, port, unix_path)
+        state['stop'] = asyncio.Event()
+        started.set()
+        await state['stop'].wait()
+        state['server'].close()
+        await state['server'].wait_closed()
+        # connections the clients left open are closed here, like asyncio.run does for serve
+        handlers = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in handlers:
+            task.cancel()
+        await asyncio.gather(*handlers, return_exceptions=True)
+        await service.stop()
+
+    def target():
+        try:
+            loop.run_until_complete(run())
+        finally:
+            started.set()
+            loop.close()
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    started.wait()
+    if 'server' not in state:
+        thread.join()
+        raise RuntimeError('the service did not start')
+    try:
+        yield unix_path or state['server'].sockets[0].getsockname()[:2]
+    finally:
+        loop.call_soon_threadsafe(state['stop'].set)
+        thread.join()
+
+
+class DiversionClient:
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None, timeout=60):
+        """
+        A blocking client of the service that keeps its connection open between requests
+        """
+        self.address = unix_path or (host, port)
+        self.timeout = timeout
+        self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection[0].close()
+            self.connection = None
+
+    def connect(self):
+        if isinstance(self.address, str):
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.settimeout(self.timeout)
+            connection.connect(self.address)
+        else:
+            connection = socket.create_connection(self.address, self.timeout)
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connection = (connection, connection.makefile('rb'))
+
+    def request(self, method, path, payload=None):
+        """
+        :return: the status and the decoded JSON response
+        """
+        if self.connection is None:
+            self.connect()
+        body = b'' if payload is None else json.dumps(payload).encode()
+        connection, response = self.connection
+        connection.sendall('{} {} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+                           'Content-Length: {}\r\n\r\n'.format(method, path, len(body)).encode() + body)
+        status_line = response.readline()
+        if not status_line:
+            self.close()
+            raise ConnectionError('the service closed the connection')
+        headers = {}
+        while True:
+            line = response.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        result = json.loads(response.read(int(headers.get('content-length', 0))))
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        return int(status_line.split()[1]), result
+
+    def nearest(self, lat, long, conditions=None, profile=None, level=DEFAULT_LEVEL):
+        """
+        The nearest airport whose usable runway exceeds the landing distance quantile at level, under the given
+        conditions or a named profile of the eligibility table
+        """
+        query = {'lat': lat, 'long': long, 'level': level}
+        if conditions is not None:
+            query['conditions'] = conditions
+        if profile is not None:
+            query['profile'] = profile
+        return self.checked('POST', '/nearest', query)
+
+    def nearest_many(self, queries):
+        return self.checked('POST', '/nearest', {'queries': queries})['results']
+
+    def metrics(self):
+        return self.checked('GET', '/metrics')
+
+    def checked(self, method, path, payload=None):
+        status, result = self.request(method, path, payload)
+        if status != 200:
+            raise ValueError('{} {}: {}'.format(status, STATUS.get(status, ''), result.get('error')))
+        return result
@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from airport_index import AirportIndex
+from airport_table import cache_directory
+from batch_simulation import DIVERSION_ATTRIBUTES
+from distribution_engine import airport_conditions, landing_distance_distribution
+
+# Named condition profiles the eligibility of every airport is precomputed for. 'diversion' is the attribute map
+# get_nearest_accommodating_airport simulates every airport with.
+PROFILES = {'diversion': {'conditions': DIVERSION_ATTRIBUTES, 'hypo_type': '2'}}
+QUANTILE_LEVELS = (0.5, 0.9, 0.95, 0.99, 0.999)
+ELIGIBILITY_VERSION = 3
+
+
+def profile_fingerprint(profile, levels):
+    """
+    A hash of everything the quantiles of a profile depend on besides the airports themselves
+    """
+    text = json.dumps({'profile': profile, 'levels': list(levels), 'version': ELIGIBILITY_VERSION},
+                      sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def landing_distance_quantiles(profile, levels):
+    """
+    This function computes the landing distance quantiles of a profile with the distribution engine. Airports are
+    evaluated under airport_conditions, so one row of quantiles holds for every airport.
+    :param profile: dictionary with the conditions, and optionally the weights, gradient and hypo_type
+    :param levels: the quantile levels
+    :return: an array of landing distances, one per level
+    """
+    distribution = landing_distance_distribution(airport_conditions(profile.get('conditions')),
+                                                 gradient=profile.get('gradient'),
+                                                 hypo_type=profile.get('hypo_type', '2'),
+                                                 weights=profile.get('weights'))
+    return distribution.quantile(np.asarray(levels))
+
+
+class EligibilityTable:
+
+    def __init__(self, airport_table, profiles=None, levels=QUANTILE_LEVELS, directory=None):
+        """
+        Landing distance quantiles of named condition profiles, with the usable runway of every airport they are
+        compared to. Nothing is computed until update is called.
+        :param airport_table: the parsed airport dataset
+        :param profiles: dictionary of profile name -> profile, defaults to PROFILES
+        :param levels: the quantile levels kept for every profile
+        :param directory: optional directory the table is stored in and loaded from, one file per profile
+        """
+        self.airport_table = airport_table
+        self.profiles = dict(PROFILES if profiles is None else profiles)
+        self.levels = tuple(levels)
+        self.directory = directory
+        self.quantiles = {}
+        self.indexes = {}
+
+    def path(self, name):
+        return os.path.join(self.directory, name + '.npz')
+
+    def read(self, name):
+        """
+        The stored state of a profile, or None when there is none or it was computed for another profile
+        """
+        try:
+            with np.load(self.path(name)) as stored:
+                stored = dict(stored)
+        except (OSError, ValueError):
+            return None
+        if str(stored['fingerprint']) != profile_fingerprint(self.profiles[name], self.levels):
+            return None
+        return stored
+
+    def write(self, name, state):
+        """
+        Writes the state of a profile next to the airport data, through a temporary file so a reader never sees
+        half of it
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = self.path(name) + '.tmp'
+        with open(temp_path, 'wb') as target:
+            np.savez(target, **state)
+        os.replace(temp_path, self.path(name))
+
+    def update(self, airport_table=None, names=None):
+        """
+        This function brings the quantiles up to date. They only depend on the profile, so a profile is computed
+        once and read back from the directory for as long as it is unchanged, while the margins follow the
+        airport table.
+        :param airport_table: optional new version of the airport dataset
+        :param names: optional profiles to update, the others and their indexes are left as they are
+        :return: a dictionary telling for every updated profile whether its quantiles were recomputed
+        """
+        if airport_table is not None:
+            self.airport_table = airport_table
+        recomputed = {}
+        for name in self.profiles if names is None else names:
+            profile = self.profiles[name]
+            fingerprint = profile_fingerprint(profile, self.levels)
+            stored = self.quantiles.get(name)
+            if stored is None and self.directory is not None:
+                stored = self.read(name)
+            recomputed[name] = stored is None or str(stored['fingerprint']) != fingerprint
+            if recomputed[name]:
+                stored = {'quantiles': landing_distance_quantiles(profile, self.levels), 'fingerprint': fingerprint}
+                if self.directory is not None:
+                    self.write(name, stored)
+            self.quantiles[name] = stored
+            self.indexes.pop(name, None)
+        return recomputed
+
+    def set_profile(self, name, profile):
+        """
+        Adds or replaces a profile, its quantiles are recomputed by the next update
+        """
+        self.profiles[name] = profile
+        self.quantiles.pop(name, None)
+        self.indexes.pop(name, None)
+
+    def remove_profile(self, name):
+        """
+        Drops a profile with its quantiles and indexes, a stored copy stays on disk for when it is added again
+        """
+        self.profiles.pop(name, None)
+        self.quantiles.pop(name, None)
+        self.indexes.pop(name, None)
+
+    def quantile(self, name, level):
+        """
+        The landing distance at one of the stored quantile levels, the same for every airport
+        """
+        if level not in self.levels:
+            raise ValueError('level must be one of {}'.format(self.levels))
+        if name not in self.quantiles:
+            self.update(names=[name])
+        return float(self.quantiles[name]['quantiles'][self.levels.index(level)])
+
+    def margin(self, name, level):
+        """
+        How much the usable runway of every airport exceeds the landing distance quantile
+        """
+        return np.asarray(self.airport_table.usable_length) - self.quantile(name, level)
+
+    def eligible(self, name, level):
+        return self.margin(name, level) > 0
+
+    def index(self, name, level):
+        """
+        An AirportIndex whose capacities are the margins of a profile, built once and reused for every level
+        """
+        margin = self.margin(name, level)
+        if name not in self.indexes:
+            table = self.airport_table
+            self.indexes[name] = [AirportIndex(table.lat, table.long, margin), level]
+        index, current_level = self.indexes[name]
+        if current_level != level:
+            index.set_capacity(margin)
+            self.indexes[name][1] = level
+        return index
+
+    def nearest(self, lat, long, name='diversion', level=0.5):
+        """
+        The nearest airport whose usable runway exceeds the landing distance quantile of the profile, the
+        lookup that replaces the per-airport simulations of get_nearest_accommodating_airport
+        :return: the distance in kilometers and the position of the airport, or (inf, -1) when none qualifies
+        """
+        return self.index(name, level).nearest(lat, long, 0)
+
+    def nearest_bulk(self, lats, longs, name='diversion', level=0.5):
+        return self.index(name, level).nearest_bulk(lats, longs, 0)
+
+
+def load_eligibility_table(airport_table, path='airport_info.xlsx', cache_dir=None, profiles=None,
+                           levels=QUANTILE_LEVELS):
+    """
+    This function loads the eligibility table stored with the cached airport data of the spreadsheet at path,
+    and updates whatever changed since it was stored
+    :param airport_table: the parsed airport dataset
+    :param path: path of the airport spreadsheet
+    :param cache_dir: directory of the airport cache, defaults to .airport_cache next to the spreadsheet
+    :return: an up to date EligibilityTable
+    """
+    directory = os.path.join(cache_directory(path, cache_dir), 'eligibility')
+    table = EligibilityTable(airport_table, profiles, levels, directory)
+    table.update()
+    return table
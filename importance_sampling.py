@@ -0,0 +1,171 @@
+import math
+
+import numpy as np
+
+from batch_simulation import CATEGORIES, DEFAULT_WEIGHTS, categories_from_uniforms, category_probabilities, \
+    simulate_from_uniforms
+from samplers import iid_uniforms
+
+# uniform streams whose draws are tilted towards one end, on top of the tilted category weights
+TILTED_STREAMS = ['temp_value', 'runway_surface_value', 'gross_weight_value', 'altitude_value', 'wind_value',
+                  'gradient']
+# keeps every category possible under the tilt and the fitted exponents in a range the power draw handles
+MIN_PROBABILITY = 1e-3
+MAX_EXPONENT = 50
+# Share of the trials drawn from the untilted distribution. A power tilt with a positive exponent has a density
+# that goes to zero at u = 0, so the plain likelihood ratio is unbounded. Sampling from the defensive mixture
+# share * nominal + (1 - share) * tilt instead bounds every likelihood ratio by 1 / share.
+DEFENSIVE_SHARE = 0.1
+
+
+def default_tilt(weights=None):
+    """
+    The untilted distribution: the category probabilities of the predictors and uniform within-category draws.
+    A tilt is a dictionary with the category probabilities of every factor and, for every tilted stream, the
+    exponent a of the density (a + 1) * u ** a its uniforms are drawn from.
+    """
+    weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+    return {'probabilities': {factor: category_probabilities(weights[factor]) for factor in CATEGORIES},
+            'exponents': {stream: 0.0 for stream in TILTED_STREAMS}}
+
+
+def sample_tilted(n_trials, tilt, rng, weights=None, defensive_share=DEFENSIVE_SHARE):
+    """
+    This function draws n_trials independent trials from the defensive mixture of the untilted distribution and
+    a tilted one. The first defensive_share of the trials come from the untilted distribution and the rest from
+    the tilt, and every trial is weighted against the mixture density, so no likelihood ratio exceeds
+    1 / defensive_share.
+    :return: the uniforms, the category index arrays and the log likelihood ratio of every trial
+    """
+    nominal = default_tilt(weights)
+    n_nominal = int(round(defensive_share * n_trials))
+    uniforms = iid_uniforms(n_trials, rng)
+    # log of tilted density / untilted density at every trial, whichever component drew it
+    log_tilt_ratio = np.zeros(n_trials)
+    categories = {}
+    for factor in CATEGORIES:
+        p, q = nominal['probabilities'][factor], tilt['probabilities'][factor]
+        categories[factor] = np.concatenate([categories_from_uniforms(uniforms[factor][:n_nominal], p),
+                                             categories_from_uniforms(uniforms[factor][n_nominal:], q)])
+        log_tilt_ratio += np.log(q[categories[factor]]) - np.log(p[categories[factor]])
+    for stream in TILTED_STREAMS:
+        exponent = tilt['exponents'][stream]
+        # 1 - u keeps the draw in (0, 1], so the log below stays finite
+        uniforms[stream] = 1 - uniforms[stream]
+        uniforms[stream][n_nominal:] **= 1 / (exponent + 1)
+        log_tilt_ratio += math.log(exponent + 1) + exponent * np.log(uniforms[stream])
+        # the engine expects draws on [0, 1), the tilted draw only touches 1 with probability zero
+        uniforms[stream] = np.minimum(uniforms[stream], np.nextafter(1, 0))
+    if n_nominal == n_trials:
+        log_ratio = np.zeros(n_trials)
+    elif n_nominal:
+        log_ratio = -np.logaddexp(math.log(defensive_share), math.log(1 - defensive_share) + log_tilt_ratio)
+    else:
+        log_ratio = -log_tilt_ratio
+    return uniforms, categories, log_ratio
+
+
+def tilted_landing_distance(n_trials, tilt, rng, hypo_type='1', weights=None):
+    """
+    Landing distances drawn under the tilt together with their likelihood ratios
+    """
+    uniforms, categories, log_ratio = sample_tilted(n_trials, tilt, rng, weights)
+    result = simulate_from_uniforms(uniforms, hypo_type, weights, categories=categories)
+    return result, np.exp(log_ratio)
+
+
+def update_tilt(tilt, result, uniforms_weight, smoothing):
+    """
+    Cross-entropy update: the tilt that maximizes the likelihood-ratio weighted log density of the elite trials.
+    Category probabilities become the weighted category frequencies, and the power exponent has the closed form
+    a + 1 = -sum(w) / sum(w * log u).
+    """
+    elite, weight, uniforms = uniforms_weight
+    new_tilt = {'probabilities': {}, 'exponents': {}}
+    total = weight[elite].sum()
+    for factor, q in tilt['probabilities'].items():
+        frequencies = np.bincount(result[factor][elite], weights=weight[elite], minlength=len(q)) / total
+        frequencies = smoothing * frequencies + (1 - smoothing) * q
+        frequencies = np.maximum(frequencies, MIN_PROBABILITY)
+        new_tilt['probabilities'][factor] = frequencies / frequencies.sum()
+    for stream, exponent in tilt['exponents'].items():
+        log_u = np.log(np.maximum(uniforms[stream][elite], 1e-300))
+        fitted = -total / (weight[elite] @ log_u) - 1
+        fitted = smoothing * fitted + (1 - smoothing) * exponent
+        new_tilt['exponents'][stream] = float(np.clip(fitted, -0.9, MAX_EXPONENT))
+    return new_tilt
+
+
+def cross_entropy_tilt(threshold, n_trials=20000, rho=0.1, smoothing=0.7, max_iterations=30, rng=None, seed=None,
+                       hypo_type='1', weights=None):
+    """
+    This function tunes the tilt with the multilevel cross-entropy method. Every iteration raises the level to
+    the (1 - rho) quantile of the landing distance under the current tilt, until it reaches the threshold, and
+    refits the tilt to the trials above the level.
+    :param threshold: the landing distance whose exceedance is estimated
+    :param n_trials: trials per iteration
+    :param rho: share of elite trials
+    :param smoothing: weight of the new fit against the previous tilt
+    :param max_iterations: maximum number of iterations
+    :return: the tuned tilt and a trace with the level of every iteration
+    """
+    if rng is None:
+        rng = np.random.default_rng(seed)
+    tilt = default_tilt(weights)
+    trace = []
+    for iteration in range(max_iterations):
+        uniforms, categories, log_ratio = sample_tilted(n_trials, tilt, rng, weights)
+        result = simulate_from_uniforms(uniforms, hypo_type, weights, categories=categories)
+        ld = result['landing_distance']
+        level = min(threshold, float(np.quantile(ld, 1 - rho)))
+        elite = ld >= level
+        trace.append({'iteration': iteration, 'level': level, 'elite': int(elite.sum())})
+        tilt = update_tilt(tilt, result, (elite, np.exp(log_ratio), uniforms), smoothing)
+        if level >= threshold:
+            break
+    return tilt, trace
+
+
+def importance_estimate(threshold, n_trials, tilt, rng=None, seed=None, hypo_type='1', weights=None):
+    """
+    Estimates P(landing distance > threshold) as the mean of likelihood ratio * indicator under the tilt
+    :return: a dictionary with the probability, its standard error, the relative error, the effective
+             sample size of the weights of the exceeding trials and the largest likelihood ratio
+    """
+    if rng is None:
+        rng = np.random.default_rng(seed)
+    result, ratio = tilted_landing_distance(n_trials, tilt, rng, hypo_type, weights)
+    weighted = ratio * (result['landing_distance'] > threshold)
+    probability = float(weighted.mean())
+    standard_error = float(weighted.std(ddof=1) / math.sqrt(n_trials))
+    hits = weighted[weighted > 0]
+    effective = float(hits.sum() ** 2 / (hits @ hits)) if len(hits) else 0.0
+    return {'probability': probability, 'standard_error': standard_error,
+            'relative_error': standard_error / probability if probability else math.inf,
+            'exceeding_trials': len(hits), 'effective_sample_size': effective, 'max_weight': float(ratio.max()),
+            'trials': n_trials}
+
+
+def exceedance_probability(threshold, n_trials=200000, seed=None, hypo_type='1', weights=None, tilt=None,
+                           ce_trials=20000):
+    """
+    This function estimates the probability that the landing distance exceeds a threshold, such as the usable
+    runway at an airport. Without a tilt one is tuned with cross_entropy_tilt first.
+    >>> result = exceedance_probability(55000, seed=1)
+    >>> 0 < result['probability'] < 1e-4 and result['relative_error'] < 0.1
+    True
+    """
+    rng = np.random.default_rng(seed)
+    trace = None
+    if tilt is None:
+        tilt, trace = cross_entropy_tilt(threshold, ce_trials, rng=rng, hypo_type=hypo_type, weights=weights)
+    result = importance_estimate(threshold, n_trials, tilt, rng=rng, hypo_type=hypo_type, weights=weights)
+    result.update({'threshold': threshold, 'tilt': tilt, 'cross_entropy_trace': trace})
+    return result
+
+
+def airport_exceedance_probability(airport_table, position, **kwargs):
+    """
+    The probability that the landing distance exceeds the usable runway of the airport at `position`
+    """
+    return exceedance_probability(float(airport_table.usable_length[position]), **kwargs)
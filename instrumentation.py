@@ -0,0 +1,231 @@
+import contextlib
+import functools
+import json
+import time
+import tracemalloc
+
+# durations are kept as they come until there are this many, then folded into a t-digest for the p99
+DURATION_BUFFER = 10000
+PROFILERS = ['cprofile', 'pyinstrument']
+
+# the Instrumentation collecting the current run, None while instrumentation is disabled
+active = None
+NULL_STAGE = contextlib.nullcontext()
+
+
+class StageStats:
+
+    def __init__(self):
+        """
+        Calls, time and allocations of one pipeline stage
+        """
+        self.calls = 0
+        self.total = 0.0
+        self.durations = []
+        self.digest = None
+        self.allocated = 0
+
+    def add(self, duration, allocated=0):
+        self.calls += 1
+        self.total += duration
+        self.allocated += allocated
+        self.durations.append(duration)
+        if len(self.durations) >= DURATION_BUFFER:
+            self.flush()
+
+    def flush(self):
+        from streaming_stats import QuantileDigest
+
+        if self.durations:
+            if self.digest is None:
+                self.digest = QuantileDigest()
+            self.digest.update(self.durations)
+            self.durations = []
+
+    def quantile(self, q):
+        if self.digest is None:
+            durations = sorted(self.durations)
+            return durations[min(len(durations) - 1, int(q * len(durations)))] if durations else float('nan')
+        self.flush()
+        return float(self.digest.quantile(q))
+
+    def as_dict(self):
+        return {'calls': self.calls, 'total_s': self.total, 'mean_s': self.total / self.calls if self.calls else 0.0,
+                'p99_s': self.quantile(0.99), 'allocated_mb': self.allocated / 2 ** 20}
+
+
+class Stage:
+
+    def __init__(self, stats, memory):
+        self.stats = stats
+        self.memory = memory
+
+    def __enter__(self):
+        if self.memory:
+            self.memory_start = tracemalloc.get_traced_memory()[0]
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.start
+        allocated = tracemalloc.get_traced_memory()[0] - self.memory_start if self.memory else 0
+        self.stats.add(duration, allocated)
+        return False
+
+
+class Instrumentation:
+
+    def __init__(self, memory=False):
+        """
+        Per-stage timers and counters of one run
+        :param memory: also track the memory every stage leaves allocated through tracemalloc, which slows the
+                       run down considerably
+        """
+        self.memory = memory
+        self.stages = {}
+        self.counters = {}
+        self.peak_memory = None
+        self.start = time.perf_counter()
+
+    def stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = StageStats()
+        return Stage(self.stages[name], self.memory)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self):
+        """
+        The statistics of every stage and counter as a dictionary
+        """
+        report = {'wall_time_s': time.perf_counter() - self.start,
+                  'stages': {name: stats.as_dict() for name, stats in self.stages.items()},
+                  'counters': dict(self.counters)}
+        if self.memory:
+            peak = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else self.peak_memory
+            report['peak_memory_mb'] = peak / 2 ** 20
+        return report
+
+
+def enable(memory=False):
+    """
+    Starts collecting statistics for every stage, replacing what was collected before
+    :return: the Instrumentation collecting them
+    """
+    global active
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    active = Instrumentation(memory)
+    return active
+
+
+def disable():
+    """
+    Stops collecting statistics
+    :return: the Instrumentation of the run that just ended, or None
+    """
+    global active
+    finished, active = active, None
+    if finished is not None and finished.memory and tracemalloc.is_tracing():
+        finished.peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return finished
+
+
+@contextlib.contextmanager
+def instrument(memory=False):
+    """
+    Collects statistics for the duration of a with block
+    >>> with instrument() as run:
+    ...     for _ in range(3):
+    ...         with stage('sleep'):
+    ...             count('naps')
+    >>> run.report()['stages']['sleep']['calls'], run.report()['counters']
+    (3, {'naps': 3})
+    """
+    run = enable(memory)
+    try:
+        yield run
+    finally:
+        if active is run:
+            disable()
+
+
+def stage(name):
+    """
+    A context manager timing one stage of the pipeline, a shared no-op while instrumentation is disabled
+    """
+    if active is None:
+        return NULL_STAGE
+    return active.stage(name)
+
+
+def count(name, n=1):
+    if active is not None:
+        active.count(name, n)
+
+
+def instrumented(name):
+    """
+    Decorator timing every call of a function as the stage `name`
+    """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if active is None:
+                return function(*args, **kwargs)
+            with active.stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def format_report(report):
+    """
+    The report as a table with one line per stage, slowest first
+    """
+    lines = ['{:28} {:>10} {:>11} {:>11} {:>11} {:>12}'.format('stage', 'calls', 'total s', 'mean ms', 'p99 ms',
+                                                                'alloc MB')]
+    for name, row in sorted(report['stages'].items(), key=lambda item: -item[1]['total_s']):
+        lines.append('{:28} {calls:10d} {total_s:11.3f} {:11.4f} {:11.4f} {allocated_mb:12.2f}'.format(
+            name, row['mean_s'] * 1000, row['p99_s'] * 1000, **row))
+    for name, value in sorted(report['counters'].items()):
+        lines.append('{:28} {:10d}'.format(name, value))
+    lines.append('wall time {:.3f} s'.format(report['wall_time_s']))
+    if 'peak_memory_mb' in report:
+        lines.append('peak traced memory {:.1f} MB'.format(report['peak_memory_mb']))
+    return '\n'.join(lines)
+
+
+def write_report(report, path):
+    with open(path, 'w') as output:
+        json.dump(report, output, indent=2)
+
+
+def run_profiled(function, path, profiler='cprofile'):
+    """
+    Runs function under a profiler and dumps the profile to path: pstats data for cProfile, an HTML page for
+    pyinstrument
+    :return: whatever function returns
+    """
+    if profiler not in PROFILERS:
+        raise ValueError('profiler must be one of {}'.format(PROFILERS))
+    if profiler == 'cprofile':
+        import cProfile
+
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(function)
+        finally:
+            profile.dump_stats(path)
+    from pyinstrument import Profiler
+
+    profile = Profiler()
+    profile.start()
+    try:
+        return function()
+    finally:
+        profile.stop()
+        with open(path, 'w') as output:
+            output.write(profile.output_html())
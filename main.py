@@ -1,8 +1,20 @@
+import argparse
 import math
 import random
-import pandas as pd
 from geographiclib.geodesic import Geodesic
-import matplotlib.pyplot as plt
+import numpy as np
+
+from airport_index import AirportIndex
+from airport_table import load_airport_table
+from batch_simulation import (TEMPERATURE_CATEGORIES, TEMPERATURE_WEIGHTS, RUNWAY_SURFACE_CATEGORIES,
+                              RUNWAY_SURFACE_WEIGHTS, GROSS_WEIGHT_CATEGORIES, GROSS_WEIGHT_WEIGHTS,
+                              ALTITUDE_CATEGORIES, ALTITUDE_WEIGHTS, WIND_CATEGORIES, WIND_WEIGHTS, GRADIENT_RANGE,
+                              DIVERSION_ATTRIBUTES, simulate_batch)
+from instrumentation import (PROFILERS, disable, enable, format_report, instrumented, run_profiled, stage,
+                             write_report)
+from pair_sampler import PairSampler
+from results_buffer import ResultsBuffer
+from runway_index import RunwayIndex
 
 geod = Geodesic.WGS84
 
@@ -23,8 +35,7 @@ class TemperaturePredictor:
     def __init__(self):
         # https://www.washingtonpost.com/news/capital-weather-gang/wp/2018/07/27/sometimes-its-too-hot-for-airplanes-to-fly-heres-why/#:~:text=Every%20plane%20has%20a%20different,at%20more%20than%20174%2C200%20pounds.
         # https://www.cntraveler.com/stories/2016-06-20/its-so-hot-some-planes-cant-fly-heres-why
-        self.temperature = random.choices(['freezing', 'cold', 'pleasant', 'hot', 'extreme'], weights=(20, 80, 120, 60,
-                                                                                                       20), k=1)
+        self.temperature = random.choices(TEMPERATURE_CATEGORIES, weights=TEMPERATURE_WEIGHTS, k=1)
         self.change_count = 0
 
     def random_temperature(self):
@@ -32,16 +43,14 @@ class TemperaturePredictor:
         This function randomizes the temperature category using random choices based on the weights assigned
         to them
         """
-        self.temperature = random.choices(['freezing', 'cold', 'pleasant', 'hot', 'extreme'], weights=(5, 60, 120, 60,
-                                                                                                       20), k=1)
+        self.temperature = random.choices(TEMPERATURE_CATEGORIES, weights=TEMPERATURE_WEIGHTS, k=1)
         return self.temperature[0]
 
 
 class RunwaySurfacePredictor:
 
     def __init__(self):
-        self.runway_surface = random.choices(['normal', 'wet', 'standing_water', 'snow', 'icy'], weights=(80, 60, 40,
-                                                                                                          30, 22), k=1)
+        self.runway_surface = random.choices(RUNWAY_SURFACE_CATEGORIES, weights=RUNWAY_SURFACE_WEIGHTS, k=1)
         self.change_count = 0
 
     def random_runway_surface(self):
@@ -50,8 +59,7 @@ class RunwaySurfacePredictor:
         based on the weights assigned to them
         """
         if self.change_count % 10 == 0:
-            self.runway_surface = random.choices(['normal', 'wet', 'standing_water', 'snow', 'icy'],
-                                                 weights=(80, 60, 40, 30, 22), k=1)
+            self.runway_surface = random.choices(RUNWAY_SURFACE_CATEGORIES, weights=RUNWAY_SURFACE_WEIGHTS, k=1)
 
         self.change_count += 1
         return self.runway_surface[0]
@@ -63,7 +71,7 @@ class GrossWeightPredictor:
     # Boeing 737-800 is the most widely used hence the max weightage -
     # https://en.wikipedia.org/wiki/Boeing_737#:~:text=The%20%2D800%20replaced%20directly%20the,primarily%20with%20the%20Airbus%20A320.
     def __init__(self):
-        self.gross_weight = random.choices(['light', 'medium', 'heavy', 'super'], weights=(40, 50, 30, 20), k=1)
+        self.gross_weight = random.choices(GROSS_WEIGHT_CATEGORIES, weights=GROSS_WEIGHT_WEIGHTS, k=1)
         self.change_count = 0
 
     def random_gross_weight(self):
@@ -72,7 +80,7 @@ class GrossWeightPredictor:
         based on the weights assigned to them
         """
         if self.change_count % 3 == 0:
-            self.gross_weight = random.choices(['light', 'medium', 'heavy', 'super'], weights=(40, 50, 30, 20), k=1)
+            self.gross_weight = random.choices(GROSS_WEIGHT_CATEGORIES, weights=GROSS_WEIGHT_WEIGHTS, k=1)
 
         self.change_count += 1
         return self.gross_weight[0]
@@ -81,7 +89,7 @@ class GrossWeightPredictor:
 class AltitudePredictor:
     # Choosing altitude distribution as per our dataset and the mean value of all the rows
     def __init__(self):
-        self.altitude = random.choices(['low', 'normal', 'high'], weights=(7, 100, 5), k=1)
+        self.altitude = random.choices(ALTITUDE_CATEGORIES, weights=ALTITUDE_WEIGHTS, k=1)
         self.change_count = 0
 
     def random_altitude(self):
@@ -89,7 +97,7 @@ class AltitudePredictor:
         This function randomizes the altitude category using random choices based on the weights assigned to them
         """
         if self.change_count % 1 == 0:
-            self.altitude = random.choices(['low', 'normal', 'high'], weights=(7, 100, 5), k=1)
+            self.altitude = random.choices(ALTITUDE_CATEGORIES, weights=ALTITUDE_WEIGHTS, k=1)
 
         self.change_count += 1
         return self.altitude[0]
@@ -103,7 +111,7 @@ class WindPredictor:
         """
         This function randomizes the wind type using random choices based on the weights assigned to them
         """
-        self.wind = random.choices(['headwind', 'tailwind', 'crosswind'], weights=(80, 40, 10), k=1)
+        self.wind = random.choices(WIND_CATEGORIES, weights=WIND_WEIGHTS, k=1)
         return self.wind[0]
 
 
@@ -118,7 +126,7 @@ class GradientPredictor:
         This function randomizes the gradient after every 10 iterations using randint
         """
         if self.change_count % 10 == 0:
-            self.gradient = random.randint(50, 100)
+            self.gradient = random.randint(*GRADIENT_RANGE)
 
         self.change_count += 1
         return self.gradient
@@ -323,30 +331,7 @@ def random_direction():
             round(random.uniform(-180, 180), 5))
 
 
-def get_sign(direction):
-    """
-    A simple functions that returns a boolean based on the direction
-    :param direction: a symbol for the direction
-    :return: returns a boolean based on the direction
-    >>> get_sign('N')
-    1
-    """
-    if direction == 'W' or direction == 'S':
-        return -1
-    return 1
-
-
-def create_lat_long(lat_long):
-    lat_long = lat_long.split(' ')
-    direction_lat = lat_long[0][-1]
-    direction_long = lat_long[1][-1]
-    lat = lat_long[0][:-1]
-    long = lat_long[1][:-1]
-    float_lat = float(lat[:2] + '.' + lat[2:])
-    float_long = float(long[:2] + '.' + long[2:])
-    return float_lat * get_sign(direction_lat), float_long * get_sign(direction_long)
-
-
+@instrumented('effect_sampling')
 def mc_simulation(randomAttributeMap, hypo_type):
     """
     This function runs our simulation for the one of the two hypotheses based on the current selection
@@ -372,25 +357,23 @@ def mc_simulation(randomAttributeMap, hypo_type):
     return ld, randomAttributeMap
 
 
+@instrumented('airport_scan')
 def get_nearest_accommodating_airport(curr_pos_lat, curr_pos_long):
     """
     This function iterates through the airport dataset and finds the closest airport that can accomodate
-    the current flight's landing distance
-    location
+    the current flight's landing distance. It is kept as the reference scan, hypothesis 2 uses
+    get_nearest_accommodating_airports.
     :param curr_pos_lat: the latitude of the current position
     :param curr_pos_long: the longitude of the current position
     :return: it returns the nearest airport that can accommodate the flight
     """
     nearest_airport = float('inf')
 
-    for index, row in airport_df.iterrows():
-        airport_loc = row['Geographic Location']
-        airport_altitude = row['Elevation (ft)']
-        runway_length = row['Length (ft)']
-
-        airport_lat, airport_long = create_lat_long(airport_loc)
-
-        geoAns = geod.Inverse(airport_lat, airport_long, curr_pos_lat, curr_pos_long)
+    for airport_lat, airport_long, airport_altitude, runway_length in zip(airport_table.lat, airport_table.long,
+                                                                          airport_table.elevation,
+                                                                          airport_table.length):
+        with stage('geod_inverse'):
+            geoAns = geod.Inverse(airport_lat, airport_long, curr_pos_lat, curr_pos_long)
         dist_btw_currpos_and_airport = float(geoAns['s12']) / 1000
 
         random_attribute_map = {'temp': random.randint(15, 20), 'runway_surface': 'normal', 'gross_weight': 'medium',
@@ -404,40 +387,66 @@ def get_nearest_accommodating_airport(curr_pos_lat, curr_pos_long):
     return nearest_airport
 
 
-def get_flight_path(airport_df):
+def build_airport_index(airport_table):
+    """
+    This function builds a spatial index over the airport dataset that answers which is the nearest airport
+    whose usable runway (60% of its length) exceeds a given landing distance
+    :param airport_table: the parsed airport dataset
+    :return: an AirportIndex over the airports, in the same order as the dataset
+    """
+    return AirportIndex(airport_table.lat, airport_table.long, airport_table.usable_length)
+
+
+def get_nearest_accommodating_airports(airport_index, lats, longs):
     """
-    This function iterates through the airport dataset and checks if the distance between those airports
-    is less than 6570, if yes, we return the location coordinates of those two airports
-    :param airport_df: the airport information dataset
+    This function finds for every position along a route the closest airport that can accommodate the flight's
+    landing distance. The landing distance at every airport is drawn like get_nearest_accommodating_airport
+    draws it, but once per route with the batch engine, and the spatial index answers all positions at once.
+    :param airport_index: the AirportIndex of the airport dataset, its capacities are set to the runway margins
+    :param lats: the latitudes of the positions
+    :param longs: the longitudes of the positions
+    :return: an array with the distance to the nearest accommodating airport of every position
+    """
+    # seeded from the random module like get_flight_path, so random.seed fixes the whole route
+    rng = np.random.default_rng(random.getrandbits(64))
+    ld = simulate_batch(len(airport_index.lat), '2', rng=rng, fixed=DIVERSION_ATTRIBUTES)['landing_distance']
+    airport_index.set_capacity(airport_table.usable_length - ld)
+    return airport_index.nearest_bulk(lats, longs, 0)[0]
+
+
+def get_flight_path(pair_sampler, aircraft='default'):
+    """
+    This function picks two airports of the dataset whose distance is within the range of the aircraft,
+    6570 km by default, every such pair being equally likely
+    :param pair_sampler: the PairSampler built for the airport dataset
+    :param aircraft: the aircraft type whose range limits the distance between the airports
     :return: returns the latitude and longitude of the two airports
     """
-    while True:
-        two_airports = airport_df.sample(n=2)
-        two_airports = two_airports.reset_index()
-        airport1 = two_airports.iloc[0]['Geographic Location']
-        airport2 = two_airports.iloc[1]['Geographic Location']
-        lat1, long1 = create_lat_long(airport1)
-        lat2, long2 = create_lat_long(airport2)
-        geoAns = geod.Inverse(lat1, long1, lat2, long2)
-        dist_btw_airports = float(geoAns['s12']) / 1000
-        if dist_btw_airports <= 6570:
-            break
-
-    return lat1, long1, lat2, long2
-
-
-def plot_hypo2(min, max, mean):
+    # seeded from the random module, so random.seed also fixes the flight path
+    rng = np.random.default_rng(random.getrandbits(64))
+    lat1, long1, lat2, long2 = pair_sampler.sample_coordinates(1, rng, aircraft=aircraft)
+    return float(lat1[0]), float(long1[0]), float(lat2[0]), float(long2[0])
+
+
+def plot_hypo2(min, max, mean, path='hypo2_plot.png'):
     """
     This function creates a plot that shows us the minimum, maximum and mean distance to the nearest airport.
+    The plot is saved to a file through the non-interactive Agg backend, so it never waits for a display.
     :param min: minimum distance to the nearest airport
     :param max: maximum distance to the nearest airport
     :param mean: mean distance to the nearest airport
+    :param path: the image file the plot is saved to
     """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
     # https://www.geeksforgeeks.org/adding-value-labels-on-a-matplotlib-bar-chart/
     x = [1, 2, 3]
     y = [min, mean, max]
 
     tick_label = ['Min', 'Mean', 'Max']
+    plt.figure()
     plt.bar(x, y, tick_label=tick_label,
             width=0.8, color=['green', 'blue', 'orange'])
 
@@ -448,14 +457,18 @@ def plot_hypo2(min, max, mean):
     plt.ylabel('Distance')
 
     plt.title('The Minimum, Mean & Maximum Distance to the Nearest Airport.')
-    plt.show()
-
+    plt.savefig(path)
+    plt.close()
 
-if __name__ == '__main__':
-
-    # imported Df
-    airport_df = pd.read_excel("airport_info.xlsx")
 
+def run_hypo1(runway_index, n_trials=1000):
+    """
+    This function runs hypothesis 1 with the predictor classes, one landing distance per trial, and counts
+    the airports that accommodate it
+    :param runway_index: the RunwayIndex of the airport dataset
+    :param n_trials: number of trials
+    :return: the DataFrame of the trials and the average % of accommodating airports
+    """
     # classes called
     temp = TemperaturePredictor()
     runway_surface = RunwaySurfacePredictor()
@@ -464,59 +477,116 @@ if __name__ == '__main__':
     wind = WindPredictor()
     gradient = GradientPredictor()
 
-    # Hypothesis 1
-    hypo1_header = ['temperature', 'runway_surface', 'gross_weight', 'altitude', 'wind', 'gradient',
-                    'accommodating_airports', '% of accommodating airports']
-    df_for_hypo1 = pd.DataFrame(columns=hypo1_header)
+    hypo1_header = {'temperature': 'U16', 'runway_surface': 'U16', 'gross_weight': 'U16', 'altitude': 'U16',
+                    'wind': 'U16', 'gradient': 'int64', 'accommodating_airports': 'int64',
+                    '% of accommodating airports': 'float64'}
+    results_for_hypo1 = ResultsBuffer(hypo1_header)
 
-    for times in range(1, 1001):
+    for times in range(1, n_trials + 1):
         random_selector = RandomAttributeSelector(temp, runway_surface, gross_weight, altitude, wind, gradient)
         random_attribute_map = random_selector.__dict__
         ld, random_attribute_map = mc_simulation(random_attribute_map, '1')
-        accommodating_airports = airport_df[airport_df['Length (ft)'] * 0.6 >= ld].shape[0]
-        total_airports = airport_df.shape[0]
+        accommodating_airports = int(runway_index.count(ld))
+        total_airports = len(runway_index)
         percent_of_accommodating_airport = (accommodating_airports / total_airports) * 100
         df_data = [random_attribute_map['temp'], random_attribute_map['runway_surface'], random_attribute_map['gross_weight'],
                    random_attribute_map['altitude'],
                    random_attribute_map['wind'], random_attribute_map['gradient'], accommodating_airports,
                    percent_of_accommodating_airport]
-        columns = pd.Series(df_data, index=df_for_hypo1.columns)
-        df_for_hypo1 = df_for_hypo1.append(columns, ignore_index=True)
+        results_for_hypo1.append(df_data)
 
-    df_for_hypo1.to_csv('hypo1.csv')
+    df_for_hypo1 = results_for_hypo1.to_frame()
     hypo_1_result = sum(df_for_hypo1['% of accommodating airports']) / len(df_for_hypo1['% of accommodating airports'])
-    print("Considering all given situation,an average of {}% of airports can accommodate the various types of flights.".
-          format(round(hypo_1_result, 2)))
+    return df_for_hypo1, hypo_1_result
 
-    # Hypothesis 2
-    hypo2_header = ['arrival_lat', 'arrival_long', 'destination_lat', 'destination_long', 'curr_lat', 'curr_long',
-                    'nearest_airport_distance']
 
-    df_for_hypo2 = pd.DataFrame(columns=hypo2_header)
+def run_hypo2(pair_sampler, airport_index, ds=100e3):
+    """
+    This function picks a flight path and finds the distance to the nearest accommodating airport every ds
+    meters along it
+    :param pair_sampler: the PairSampler of the airport dataset
+    :param airport_index: the AirportIndex of the airport dataset
+    :param ds: step size along the route in meters
+    :return: the DataFrame of the route points
+    """
+    hypo2_header = {'arrival_lat': 'float64', 'arrival_long': 'float64', 'destination_lat': 'float64',
+                    'destination_long': 'float64', 'curr_lat': 'float64', 'curr_long': 'float64',
+                    'nearest_airport_distance': 'float64'}
+    results_for_hypo2 = ResultsBuffer(hypo2_header)
 
-    takeoff_lat, takeoff_long, destination_lat, destination_long = get_flight_path(airport_df)
+    takeoff_lat, takeoff_long, destination_lat, destination_long = get_flight_path(pair_sampler)
     l = geod.InverseLine(takeoff_lat, takeoff_long, destination_lat, destination_long)
-    ds = 100e3;
     n = int(math.ceil(l.s13 / ds))
+    curr_pos_lat = np.empty(n + 1)
+    curr_pos_long = np.empty(n + 1)
     for i in range(n + 1):
-        if i == 0:
-            pass
         s = min(ds * i, l.s13)
         g = l.Position(s, Geodesic.STANDARD | Geodesic.LONG_UNROLL)
-        curr_pos_lat = g['lat2']
-        curr_pos_long = g['lon2']
-        # print(curr_pos_lat, curr_pos_long)
-        distance_to_nearest_airport = get_nearest_accommodating_airport(curr_pos_lat, curr_pos_long)
-        df_data = [takeoff_lat, takeoff_long, destination_lat, destination_long, curr_pos_lat, curr_pos_long,
-                   distance_to_nearest_airport]
-        columns = pd.Series(df_data, index=df_for_hypo2.columns)
-        df_for_hypo2 = df_for_hypo2.append(columns, ignore_index=True)
-
-    df_for_hypo2.to_csv('hypo2.csv')
-    hypo2_description = df_for_hypo2.describe()
-    minimum_distance = round(hypo2_description['nearest_airport_distance']['min'], 2)
-    maximum_distance = round(hypo2_description['nearest_airport_distance']['max'], 2)
-    mean_distance = round(hypo2_description['nearest_airport_distance']['mean'], 2)
-    plot_hypo2(minimum_distance, maximum_distance, mean_distance)
-    print(f"A flight from {takeoff_lat, takeoff_long} to {destination_lat, destination_long}, will encounter a \nminimum distance of {minimum_distance} kms, \nmean distance of {mean_distance} kms and \nmaximum distance of {maximum_distance} kms \nto the nearest airport along the entire route for an emergency landing that could accommodate the landing distance required by it.")
+        curr_pos_lat[i] = g['lat2']
+        curr_pos_long[i] = g['lon2']
+    distance_to_nearest_airport = get_nearest_accommodating_airports(airport_index, curr_pos_lat, curr_pos_long)
+    results_for_hypo2.extend({'arrival_lat': np.full(n + 1, takeoff_lat),
+                              'arrival_long': np.full(n + 1, takeoff_long),
+                              'destination_lat': np.full(n + 1, destination_lat),
+                              'destination_long': np.full(n + 1, destination_long),
+                              'curr_lat': curr_pos_lat, 'curr_long': curr_pos_long,
+                              'nearest_airport_distance': distance_to_nearest_airport})
+
+    return results_for_hypo2.to_frame()
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Monte Carlo simulation of the landing distance of a flight')
+    parser.add_argument('--hypothesis', choices=['1', '2', 'all'], default='all', help='hypothesis to run')
+    parser.add_argument('--trials', type=int, default=1000, help='number of trials of hypothesis 1')
+    parser.add_argument('--plot', default='hypo2_plot.png', help='image file the hypothesis 2 plot is saved to')
+    parser.add_argument('--instrument', action='store_true', help='print per-stage timings at the end of the run')
+    parser.add_argument('--memory', action='store_true', help='also track allocations per stage with tracemalloc')
+    parser.add_argument('--report', help='write the per-stage timings as JSON to this file')
+    parser.add_argument('--profile', help='profile the run and dump the profile to this file')
+    parser.add_argument('--profiler', choices=PROFILERS, default='cprofile')
+    return parser.parse_args(argv)
+
+
+def run(args):
+    global airport_table
+
+    # imported Df, parsed once and cached next to the spreadsheet
+    airport_table = load_airport_table("airport_info.xlsx")
+
+    # Hypothesis 1
+    if args.hypothesis in ('1', 'all'):
+        runway_index = RunwayIndex.from_table(airport_table)
+        df_for_hypo1, hypo_1_result = run_hypo1(runway_index, args.trials)
+        df_for_hypo1.to_csv('hypo1.csv')
+        print("Considering all given situation,an average of {}% of airports can accommodate the various types of flights.".
+              format(round(hypo_1_result, 2)))
+
+    # Hypothesis 2
+    if args.hypothesis in ('2', 'all'):
+        pair_sampler = PairSampler.from_table(airport_table)
+        df_for_hypo2 = run_hypo2(pair_sampler, build_airport_index(airport_table))
+        df_for_hypo2.to_csv('hypo2.csv')
+        takeoff_lat, takeoff_long, destination_lat, destination_long = df_for_hypo2.iloc[0, :4]
+        hypo2_description = df_for_hypo2.describe()
+        minimum_distance = round(hypo2_description['nearest_airport_distance']['min'], 2)
+        maximum_distance = round(hypo2_description['nearest_airport_distance']['max'], 2)
+        mean_distance = round(hypo2_description['nearest_airport_distance']['mean'], 2)
+        plot_hypo2(minimum_distance, maximum_distance, mean_distance, args.plot)
+        print(f"A flight from {takeoff_lat, takeoff_long} to {destination_lat, destination_long}, will encounter a \nminimum distance of {minimum_distance} kms, \nmean distance of {mean_distance} kms and \nmaximum distance of {maximum_distance} kms \nto the nearest airport along the entire route for an emergency landing that could accommodate the landing distance required by it.")
+
 
+if __name__ == '__main__':
+    args = parse_arguments()
+    if args.instrument or args.memory or args.report:
+        enable(memory=args.memory)
+    if args.profile:
+        run_profiled(lambda: run(args), args.profile, args.profiler)
+    else:
+        run(args)
+    finished = disable()
+    if finished is not None:
+        report = finished.report()
+        print(format_report(report))
+        if args.report:
+            write_report(report, args.report)
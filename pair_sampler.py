@@ -0,0 +1,332 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from airport_index import AirportIndex, geod, geodesic_km
+from route_corridor import auxiliary_vectors, reduced_latitude
+
+# The longest route get_flight_path accepts. Other aircraft types can be added here or passed to PairSampler,
+# a range is either a maximum distance or a (minimum, maximum) tuple in kilometers.
+MAX_ROUTE_KM = 6570
+AIRCRAFT_RANGES_KM = {'default': MAX_ROUTE_KM}
+
+DEFAULT_TILE_SIZE = 128
+# entries kept in the per-tile cache, tile ids and destinations of the partial tiles, about 128 MB of int32
+DEFAULT_CACHE_SIZE = 2 ** 25
+
+# The WGS84 distance of two points lies between b and a times their central angle on the auxiliary sphere, so a
+# dot product of their auxiliary vectors settles every pair except those within about 0.34% of a range limit.
+# Andoyer-Lambert distances are within about 11 m of geod.Inverse below 8000 km, they settle the pairs in that band
+# except the ones within LAMBERT_SLACK_KM of a limit, which are decided with geod.Inverse.
+SIGMA_MARGIN = 1e-4
+LAMBERT_SLACK_KM = 0.03
+# The straight line between two points is never longer than the geodesic, and the geodesic is never longer than
+# the arc with that chord on a sphere of the smallest radius of curvature of the ellipsoid, b^2 / a. Tiles are
+# classified with these two bounds, the relative margin keeps the upper one safe from rounding.
+MIN_CURVATURE_KM = geod.a * (1 - geod.f) ** 2 / 1000
+ARC_MARGIN = 1e-3
+
+
+def parse_range(limit):
+    """
+    (minimum, maximum) in kilometers for a range given as a maximum or a tuple
+    >>> parse_range(6570), parse_range((500, 3000))
+    ((0.0, 6570.0), (500.0, 3000.0))
+    """
+    if np.ndim(limit) == 0:
+        return 0.0, float(limit)
+    low, high = limit
+    return float(low), float(high)
+
+
+def arc_upper_bound(chord):
+    """
+    An upper bound of the WGS84 distance between two points whose straight-line distance is chord kilometers
+    """
+    ratio = np.minimum(np.asarray(chord) / (2 * MIN_CURVATURE_KM), 1)
+    return 2 * MIN_CURVATURE_KM * np.arcsin(ratio) * (1 + ARC_MARGIN)
+
+
+def angle_cosines(distance):
+    """
+    Cosines of the central angles on the auxiliary sphere above which a pair is surely within distance kilometers
+    and below which it is surely farther
+    """
+    a, b = geod.a / 1000, geod.a * (1 - geod.f) / 1000
+    return (np.cos(min(distance / (a * (1 + SIGMA_MARGIN)), np.pi)),
+            np.cos(min(distance / (b * (1 - SIGMA_MARGIN)), np.pi)))
+
+
+def lambert_km(beta1, long1, beta2, long2):
+    """
+    Andoyer-Lambert approximation of the WGS84 distance for arrays of reduced latitudes and longitudes in
+    radians. Coincident points give 0, nearly antipodal ones nan.
+    """
+    a, f = geod.a / 1000, geod.f
+    h = np.sin((beta2 - beta1) / 2) ** 2 + np.cos(beta1) * np.cos(beta2) * np.sin((long2 - long1) / 2) ** 2
+    sigma = 2 * np.arcsin(np.sqrt(np.clip(h, 0, 1)))
+    p, q = (beta1 + beta2) / 2, (beta2 - beta1) / 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = (sigma - np.sin(sigma)) * np.sin(p) ** 2 * np.cos(q) ** 2 / np.cos(sigma / 2) ** 2
+        y = (sigma + np.sin(sigma)) * np.cos(p) ** 2 * np.sin(q) ** 2 / np.sin(sigma / 2) ** 2
+        distance = a * (sigma - f / 2 * (x + y))
+    return np.where(sigma == 0, 0.0, distance)
+
+
+def cache_entries(destinations):
+    """
+    The number of ids and counts a cached tile of tile_destinations holds
+    """
+    full_tiles, _, _, partial_count, indices = destinations
+    return len(full_tiles) + partial_count.size + (0 if indices is None else len(indices))
+
+
+class PairSampler:
+
+    def __init__(self, lat, long, ranges=None, tile_size=DEFAULT_TILE_SIZE, cache_size=DEFAULT_CACHE_SIZE):
+        """
+        This samples ordered (origin, destination) pairs of distinct airports uniformly among the pairs whose
+        WGS84 distance is within the range of an aircraft type, the same pairs get_flight_path accepts.
+        The airports are grouped into spatially compact tiles by the leaves of a k-d tree. For every pair of
+        tiles the straight-line distance between their bounding boxes tells whether all, none or only some of
+        their airport pairs are in range, and only the last kind is checked pair by pair. Nothing of size N x N
+        is ever stored: the number of valid destinations of every airport is computed once per aircraft type,
+        and the destinations of a tile are built when a sample needs them and kept in an LRU cache of bounded
+        size. Tiles entirely in range are kept as tile ids, only the partial ones as lists of airports.
+        :param lat: array of airport latitudes in degrees
+        :param long: array of airport longitudes in degrees
+        :param ranges: dictionary of aircraft type -> range, added to AIRCRAFT_RANGES_KM
+        :param tile_size: largest number of airports in a tile
+        :param cache_size: number of tile ids and destinations kept in the cache
+        """
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.long = np.asarray(long, dtype=np.float64)
+        self.ranges = {aircraft: parse_range(limit) for aircraft, limit in
+                       dict(AIRCRAFT_RANGES_KM, **(ranges or {})).items()}
+        self.cache_size = cache_size
+        self.cached = 0
+        self.beta = reduced_latitude(self.lat)
+        self.radians = np.radians(self.long)
+        self.vectors = auxiliary_vectors(self.lat, self.long)
+
+        tree = AirportIndex(self.lat, self.long, np.zeros(len(self.lat)), leaf_size=tile_size)
+        leaves = [node for node, children in enumerate(tree.node_children) if children is None]
+        self.order = tree.order
+        self.tile_start = np.array([tree.node_start[node] for node in leaves], dtype=np.int64)
+        self.tile_end = np.array([tree.node_end[node] for node in leaves], dtype=np.int64)
+        self.tile_of = np.empty(len(self.lat), dtype=np.int64)
+        for tile, (start, end) in enumerate(zip(self.tile_start, self.tile_end)):
+            self.tile_of[self.order[start:end]] = tile
+        self.position_in_tile = np.empty(len(self.lat), dtype=np.int64)
+        self.position_in_tile[self.order] = np.arange(len(self.lat)) - self.tile_start[self.tile_of[self.order]]
+
+        lower, upper = tree.node_lower[leaves], tree.node_upper[leaves]
+        gap = np.maximum(np.maximum(lower[:, None] - upper[None], lower[None] - upper[:, None]), 0)
+        spread = np.maximum(np.abs(upper[None] - lower[:, None]), np.abs(upper[:, None] - lower[None]))
+        self.tile_min_chord = np.sqrt((gap ** 2).sum(axis=2))
+        self.tile_max_distance = arc_upper_bound(np.sqrt((spread ** 2).sum(axis=2)))
+        self.statuses = {}
+        self.degrees = {}
+        self.destinations = {}
+
+    @classmethod
+    def from_table(cls, airport_table, **kwargs):
+        return cls(airport_table.lat, airport_table.long, **kwargs)
+
+    def tile_status(self, aircraft):
+        """
+        For every pair of tiles 1 when all of their pairs are in range, 0 when none are and -1 when they have
+        to be checked pair by pair
+        """
+        if aircraft in self.statuses:
+            return self.statuses[aircraft]
+        low, high = self.ranges[aircraft]
+        status = np.full(self.tile_min_chord.shape, -1, dtype=np.int8)
+        status[(self.tile_min_chord > high) | (self.tile_max_distance < low)] = 0
+        status[(self.tile_max_distance <= high) & (self.tile_min_chord >= low)] = 1
+        self.statuses[aircraft] = status
+        return status
+
+    def in_range(self, rows, columns, aircraft):
+        """
+        Tells which (row, column) airport pairs are in range, the diagonal of a tile with itself included. rows
+        and columns are broadcast against each other, so a column of rows and a row of columns give a matrix.
+        Every pair is decided elementwise, the same pair gets the same answer whatever shape it is asked in.
+        """
+        low, high = self.ranges[aircraft]
+        row_vectors, column_vectors = self.vectors[rows], self.vectors[columns]
+        cosine = (row_vectors[..., 0] * column_vectors[..., 0] + row_vectors[..., 1] * column_vectors[..., 1] +
+                  row_vectors[..., 2] * column_vectors[..., 2])
+        rows, columns = np.broadcast_arrays(rows, columns)
+        within_high, beyond_high = angle_cosines(high)
+        valid = cosine >= within_high
+        uncertain = (cosine < within_high) & (cosine >= beyond_high)
+        if low > 0:
+            below_low, above_low = angle_cosines(low)
+            valid &= cosine <= above_low
+            uncertain |= (cosine > above_low) & (cosine <= below_low)
+        pairs = np.nonzero(uncertain)
+        origin, destination = rows[pairs], columns[pairs]
+        distance = lambert_km(self.beta[origin], self.radians[origin], self.beta[destination],
+                              self.radians[destination])
+        valid[pairs] = (distance >= low) & (distance <= high)
+        near_limit = np.isnan(distance) | (np.abs(distance - high) <= LAMBERT_SLACK_KM)
+        if low > 0:
+            near_limit |= np.abs(distance - low) <= LAMBERT_SLACK_KM
+        for pair, i, j in zip(np.flatnonzero(near_limit).tolist(), origin[near_limit].tolist(),
+                              destination[near_limit].tolist()):
+            exact = geodesic_km(self.lat[i], self.long[i], self.lat[j], self.long[j])
+            valid[tuple(axis[pair] for axis in pairs)] = low <= exact <= high
+        return valid
+
+    def tile_airports(self, tile):
+        return self.order[self.tile_start[tile]:self.tile_end[tile]]
+
+    def valid_degrees(self, aircraft='default'):
+        """
+        Number of valid destinations of every airport, computed once per aircraft type from the same destination
+        lists sample draws from, so the two always agree
+        """
+        if aircraft in self.degrees:
+            return self.degrees[aircraft]
+        degrees = np.zeros(len(self.lat), dtype=np.int64)
+        for tile in range(len(self.tile_start)):
+            _, full_count, _, partial_count, _ = self.tile_destinations(tile, aircraft)
+            degrees[self.tile_airports(tile)] = full_count[-1] + partial_count[:, -1]
+        self.degrees[aircraft] = degrees
+        return degrees
+
+    def tile_destinations(self, tile, aircraft):
+        """
+        The valid destinations of the airports of a tile, stored per tile of destinations so the cache grows with
+        the number of tiles and not of airports. The tiles entirely in range are valid for every airport of the
+        tile and are kept as tile ids with the running count of their airports. The tiles checked pair by pair
+        are kept as tile ids with, for every airport of the tile, the running count of its valid destinations
+        in them: partial_count[i, k] destinations of the i-th airport lie in the first k partial tiles. The tile
+        itself is always checked pair by pair, which leaves out every airport as its own destination.
+        When the destinations in partial tiles of every tile would fit in the cache together, they are also kept
+        as a list, in the order the counts give them, so a draw does not have to check its tile again.
+        :return: the ids of the tiles in range, the running count of their airports starting at 0, the ids of
+                 the partial tiles, the running counts of every airport in them and the list or None
+        """
+        cache = self.destinations.setdefault(aircraft, OrderedDict())
+        if tile in cache:
+            cache.move_to_end(tile)
+            return cache[tile]
+        status = self.tile_status(aircraft)[tile].copy()
+        if status[tile] == 1:
+            status[tile] = -1
+        full_tiles = np.flatnonzero(status == 1)
+        full_count = np.concatenate([[0], np.cumsum(self.tile_end[full_tiles] - self.tile_start[full_tiles])])
+        partial_tiles = np.flatnonzero(status == -1)
+        partial_sizes = self.tile_end[partial_tiles] - self.tile_start[partial_tiles]
+        rows = self.tile_airports(tile)
+        columns = np.concatenate([self.tile_airports(other) for other in partial_tiles])
+        valid = self.in_range(rows[:, None], columns[None, :], aircraft) & (rows[:, None] != columns[None, :])
+        per_tile = np.add.reduceat(valid, np.cumsum(partial_sizes) - partial_sizes, axis=1, dtype=np.int64)
+        index_type = np.int32 if len(self.lat) < 2 ** 31 else np.int64
+        partial_count = np.zeros((len(rows), len(partial_tiles) + 1), dtype=index_type)
+        partial_count[:, 1:] = np.cumsum(per_tile, axis=1)
+        indices = columns[np.nonzero(valid)[1]].astype(index_type)
+        if len(indices) * len(self.tile_start) > self.cache_size:
+            indices = None
+        cache[tile] = (full_tiles.astype(index_type), full_count, partial_tiles.astype(index_type), partial_count,
+                       indices)
+        self.cached += cache_entries(cache[tile])
+        # the least recently used tiles go first, the one just built always stays
+        while self.cached > self.cache_size and len(cache) > 1:
+            self.cached -= cache_entries(cache.popitem(last=False)[1])
+        return cache[tile]
+
+    def shared_destinations(self, full_tiles, full_count, offset):
+        """
+        The airports at the given offsets of the concatenated airports of the tiles in range
+        """
+        k = np.searchsorted(full_count, offset, side='right') - 1
+        return self.order[self.tile_start[full_tiles[k]] + offset - full_count[k]]
+
+    def partial_destinations(self, origin, partial_tiles, partial_count, offset, aircraft):
+        """
+        The offset-th valid destination of every origin among the airports of the partial tiles. The partial
+        tile is found from the running counts and its airports are checked again with in_range, which decides
+        every pair the same way as when the counts were made.
+        """
+        if not len(origin):
+            return np.empty(0, dtype=np.int64)
+        counts = partial_count[self.position_in_tile[origin]]
+        k = (counts <= offset[:, None]).sum(axis=1) - 1
+        within = offset - counts[np.arange(len(origin)), k]
+        tiles = partial_tiles[k]
+        size = self.tile_end[tiles] - self.tile_start[tiles]
+        slots = np.arange(size.max())
+        filled = slots[None, :] < size[:, None]
+        candidates = self.order[np.where(filled, self.tile_start[tiles][:, None] + slots[None, :], 0)]
+        valid = self.in_range(origin[:, None], candidates, aircraft) & filled & (candidates != origin[:, None])
+        return candidates[np.arange(len(origin)), (np.cumsum(valid, axis=1) > within[:, None]).argmax(axis=1)]
+
+    def sample(self, n_pairs, rng=None, seed=None, aircraft='default'):
+        """
+        This function draws n_pairs independent (origin, destination) pairs, every ordered pair of distinct
+        airports in range having the same probability. One integer below the number of valid pairs is drawn per
+        pair: it selects the origin through the cumulative destination counts and the destination among the
+        valid destinations of that origin, in the tiles in range first and then in the partial tiles.
+        :param n_pairs: number of pairs
+        :param rng: a numpy.random.Generator, created from seed when not given
+        :param seed: seed for a new generator when rng is not given
+        :param aircraft: the aircraft type whose range the pairs have to be in
+        :return: an array of origin positions and an array of destination positions
+        """
+        if aircraft not in self.ranges:
+            raise ValueError('unknown aircraft type {!r}, known types are {}'.format(aircraft, list(self.ranges)))
+        if rng is None:
+            rng = np.random.default_rng(seed)
+        degrees = self.valid_degrees(aircraft)
+        cumulative = np.cumsum(degrees)
+        if not len(cumulative) or cumulative[-1] == 0:
+            raise ValueError('no pair of airports is within the range of {!r}'.format(aircraft))
+        draws = rng.integers(0, cumulative[-1], size=n_pairs)
+        origin = np.searchsorted(cumulative, draws, side='right')
+        offset = draws - (cumulative[origin] - degrees[origin])
+        destination = np.empty(n_pairs, dtype=np.int64)
+        tiles = self.tile_of[origin]
+        for tile in np.unique(tiles):
+            selected = np.flatnonzero(tiles == tile)
+            full_tiles, full_count, partial_tiles, partial_count, indices = self.tile_destinations(tile, aircraft)
+            n_shared = full_count[-1]
+            shared = selected[offset[selected] < n_shared]
+            destination[shared] = self.shared_destinations(full_tiles, full_count, offset[shared])
+            rest = selected[offset[selected] >= n_shared]
+            if indices is None:
+                destination[rest] = self.partial_destinations(origin[rest], partial_tiles, partial_count,
+                                                              offset[rest] - n_shared, aircraft)
+            else:
+                indptr = np.cumsum(partial_count[:, -1]) - partial_count[:, -1]
+                destination[rest] = indices[indptr[self.position_in_tile[origin[rest]]] + offset[rest] - n_shared]
+        return origin, destination
+
+    def sample_coordinates(self, n_pairs, rng=None, seed=None, aircraft='default'):
+        """
+        Like sample, but returns the takeoff and destination latitudes and longitudes the way get_flight_path does
+        """
+        origin, destination = self.sample(n_pairs, rng, seed, aircraft)
+        return self.lat[origin], self.long[origin], self.lat[destination], self.long[destination]
+
+
+def brute_force_pairs(lat, long, max_km=MAX_ROUTE_KM, min_km=0):
+    """
+    The reference the sampler has to reproduce: every ordered pair of distinct airports in range, checked with
+    geod.Inverse
+    >>> rng = np.random.default_rng(5)
+    >>> lat, long = rng.uniform(-60, 70, 120), rng.uniform(-180, 180, 120)
+    >>> sampler = PairSampler(lat, long, tile_size=8)
+    >>> pairs = brute_force_pairs(lat, long)
+    >>> bool((np.bincount(pairs[:, 0], minlength=120) == sampler.valid_degrees()).all())
+    True
+    >>> origin, destination = sampler.sample(2000, seed=1)
+    >>> valid = set(map(tuple, pairs.tolist()))
+    >>> all((o, d) in valid for o, d in zip(origin.tolist(), destination.tolist()))
+    True
+    """
+    pairs = [(i, j) for i in range(len(lat)) for j in range(len(lat))
+             if i != j and min_km <= geodesic_km(lat[i], long[i], lat[j], long[j]) <= max_km]
+    return np.array(pairs, dtype=np.int64).reshape(-1, 2)
@@ -0,0 +1,279 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from batch_simulation import CATEGORIES, DIVERSION_ATTRIBUTES, simulate_batch
+from runway_index import USABLE_SHARE, RunwayIndex
+from streaming_stats import RunningStats
+
+# Chunks are the unit of seeding, so the chunk layout (and with it the result) depends only on the trial count
+# and never on the number of workers. A multiple of 30 keeps the 10 and 3 iteration holds of the predictors
+# aligned across chunk boundaries.
+DEFAULT_CHUNK_SIZE = 30000
+ROUTE_STEP_M = 100e3
+# columns of the route points hypo2_rows returns, in the order of the hypo2.csv of main.py
+HYPO2_COLUMNS = ['route', 'arrival_lat', 'arrival_long', 'destination_lat', 'destination_long', 'curr_lat',
+                 'curr_long', 'nearest_airport_distance']
+
+# airport columns handed to every worker once by init_worker, and the structures built from them on first use
+worker_airports = {}
+
+
+def init_worker(lat, long, elevation, length):
+    """
+    Stores the airport columns in the worker process, so they are not sent along with every task. The runway
+    index, the airport index and the pair sampler are only built by the first task that needs them.
+    """
+    worker_airports.clear()
+    worker_airports['lat'] = np.asarray(lat)
+    worker_airports['long'] = np.asarray(long)
+    worker_airports['elevation'] = np.asarray(elevation)
+    worker_airports['usable_length'] = np.asarray(length) * USABLE_SHARE
+
+
+def worker_structure(name):
+    """
+    The 'runway_index', 'index' or 'pair_sampler' of the worker's airports, built the first time it is asked for
+    """
+    if name not in worker_airports:
+        lat, long, usable_length = worker_airports['lat'], worker_airports['long'], worker_airports['usable_length']
+        if name == 'runway_index':
+            worker_airports[name] = RunwayIndex(usable_length)
+        elif name == 'index':
+            from airport_index import AirportIndex
+
+            worker_airports[name] = AirportIndex(lat, long, usable_length)
+        elif name == 'pair_sampler':
+            from pair_sampler import PairSampler
+
+            worker_airports[name] = PairSampler(lat, long)
+        else:
+            raise ValueError('unknown worker structure {!r}'.format(name))
+    return worker_airports[name]
+
+
+def split_trials(n_trials, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Splits n_trials into chunks of chunk_size, the last chunk takes the remainder
+    >>> split_trials(70000)
+    [30000, 30000, 10000]
+    """
+    return [min(chunk_size, n_trials - start) for start in range(0, n_trials, chunk_size)]
+
+
+def summarize(values):
+    """
+    Reduces an array to the count, mean, sum of squared deviations and range of a RunningStats, so chunks can be
+    merged later
+    """
+    stats = RunningStats()
+    stats.update(values)
+    return stats_summary(stats)
+
+
+def stats_summary(stats):
+    return {'count': stats.count, 'mean': stats.mean, 'm2': stats.m2, 'min': stats.min, 'max': stats.max}
+
+
+def running_stats(summary):
+    stats = RunningStats()
+    stats.count, stats.mean, stats.m2 = summary['count'], summary['mean'], summary['m2']
+    stats.min, stats.max = summary['min'], summary['max']
+    return stats
+
+
+def merge_summaries(left, right):
+    """
+    Combines two summaries with the update of Chan et al. that RunningStats.merge implements, merging always
+    happens in chunk order so the result does not depend on which worker finished first
+    """
+    stats = running_stats(left)
+    stats.merge(running_stats(right))
+    return stats_summary(stats)
+
+
+def finalize_summary(summary):
+    """
+    Adds the sample standard deviation to a merged summary
+    >>> finalize_summary(merge_summaries(summarize([1e9 + 1, 1e9 + 2]), summarize([1e9 + 3])))['std']
+    1.0
+    """
+    stats = running_stats(summary)
+    return dict(summary, mean=stats.mean if stats.count else math.nan, std=stats.std)
+
+
+def hypo1_chunk(task):
+    """
+    Runs one chunk of hypothesis 1 and returns only its summaries
+    :param task: a (SeedSequence, number of trials) tuple
+    """
+    seed_sequence, n_trials = task
+    rng = np.random.default_rng(seed_sequence)
+    ld = simulate_batch(n_trials, '1', rng=rng)['landing_distance']
+    percent_of_accommodating_airport = worker_structure('runway_index').percent(ld)
+    return {'landing_distance': summarize(ld), 'percent': summarize(percent_of_accommodating_airport)}
+
+
+def hypo1_rows(task):
+    """
+    Runs one chunk of hypothesis 1 like hypo1_chunk, but returns every trial as columns: the category indices,
+    the gradient, the landing distance and the accommodating airports
+    :param task: a (SeedSequence, number of trials) tuple
+    """
+    seed_sequence, n_trials = task
+    rng = np.random.default_rng(seed_sequence)
+    result = simulate_batch(n_trials, '1', rng=rng)
+    rows = {factor: result[factor].astype(np.int8) for factor in CATEGORIES}
+    rows['gradient'] = result['gradient']
+    rows['landing_distance'] = result['landing_distance']
+    rows['accommodating_airports'] = worker_structure('runway_index').count(result['landing_distance'])
+    rows['percent'] = worker_structure('runway_index').percent(result['landing_distance'])
+    return rows
+
+
+def sample_flight_path(rng, aircraft='default'):
+    """
+    Draws one airport pair within the range of the aircraft type, uniformly like get_flight_path but from rng
+    """
+    takeoff_lat, takeoff_long, destination_lat, destination_long = worker_structure('pair_sampler').sample_coordinates(
+        1, rng, aircraft=aircraft)
+    return takeoff_lat[0], takeoff_long[0], destination_lat[0], destination_long[0]
+
+
+def route_waypoints(takeoff_lat, takeoff_long, destination_lat, destination_long, ds=ROUTE_STEP_M):
+    """
+    Walks the geodesic between two airports in steps of ds meters, the same way hypothesis 2 does
+    :return: arrays with the latitudes and longitudes of the waypoints
+    """
+    from geographiclib.geodesic import Geodesic
+
+    l = Geodesic.WGS84.InverseLine(takeoff_lat, takeoff_long, destination_lat, destination_long)
+    n = int(math.ceil(l.s13 / ds))
+    positions = [l.Position(min(ds * i, l.s13), Geodesic.STANDARD | Geodesic.LONG_UNROLL) for i in range(n + 1)]
+    return np.array([g['lat2'] for g in positions]), np.array([g['lon2'] for g in positions])
+
+
+def nearest_diversions(rng, lats, longs):
+    """
+    Vectorized get_nearest_accommodating_airport for all the waypoints of a route: one landing distance per
+    airport is drawn for the route, the capacities of the index are set once to the runway margins and
+    nearest_bulk answers which airport with a positive margin is closest to every waypoint
+    :return: an array of distances in kilometers, inf where no airport accommodates the landing distance
+    """
+    index = worker_structure('index')
+    ld = simulate_batch(len(index.lat), '2', rng=rng, fixed=DIVERSION_ATTRIBUTES)['landing_distance']
+    index.set_capacity(worker_airports['usable_length'] - ld)
+    return index.nearest_bulk(lats, longs, 0)[0]
+
+
+def hypo2_route(task):
+    """
+    Samples and walks one route of hypothesis 2, returning the route and its nearest airport distances
+    :param task: a (SeedSequence, step size in meters) tuple
+    """
+    seed_sequence, ds = task
+    rng = np.random.default_rng(seed_sequence)
+    route = sample_flight_path(rng)
+    lats, longs = route_waypoints(*route, ds=ds)
+    distances = nearest_diversions(rng, lats, longs)
+    return {'route': route, 'lat': lats, 'long': longs, 'nearest_airport_distance': distances,
+            'summary': summarize(distances)}
+
+
+def hypo2_rows(task):
+    """
+    Walks several routes of hypothesis 2 like hypo2_route and returns every route point as columns
+    :param task: a (number of the first route, list of SeedSequences, step size in meters) tuple
+    """
+    first_route, seed_sequences, ds = task
+    columns = {name: [] for name in HYPO2_COLUMNS}
+    for number, seed_sequence in enumerate(seed_sequences, start=first_route):
+        route = hypo2_route((seed_sequence, ds))
+        n_points = len(route['lat'])
+        columns['route'].append(np.full(n_points, number, dtype=np.int64))
+        for name, value in zip(HYPO2_COLUMNS[1:5], route['route']):
+            columns[name].append(np.full(n_points, value, dtype=np.float64))
+        columns['curr_lat'].append(route['lat'])
+        columns['curr_long'].append(route['long'])
+        columns['nearest_airport_distance'].append(route['nearest_airport_distance'])
+    return {name: np.concatenate(arrays) for name, arrays in columns.items()}
+
+
+def iter_chunks(function, tasks, airport_table, workers=None):
+    """
+    This generator maps tasks over a process pool and yields the results in task order as soon as they are
+    done, whatever the number of workers. With workers=1 everything runs in the current process.
+    :param function: a module level function taking one task
+    :param tasks: the list of tasks
+    :param airport_table: the AirportTable every worker gets a copy of
+    :param workers: number of processes, defaults to the number of cores
+    """
+    if not tasks:
+        return
+    initargs = (np.asarray(airport_table.lat), np.asarray(airport_table.long),
+                np.asarray(airport_table.elevation), np.asarray(airport_table.length))
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    if workers == 1:
+        init_worker(*initargs)
+        for task in tasks:
+            yield function(task)
+        return
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=initargs)
+    try:
+        yield from executor.map(function, tasks, chunksize=max(1, len(tasks) // (workers * 4)))
+    finally:
+        # when the caller stops early the queued tasks are dropped instead of being run to the end
+        executor.shutdown(cancel_futures=True)
+
+
+def run_chunks(function, tasks, airport_table, workers=None):
+    """
+    Maps tasks over a process pool like iter_chunks
+    :return: the list of results
+    """
+    return list(iter_chunks(function, tasks, airport_table, workers))
+
+
+def run_hypo1_parallel(airport_table, n_trials, seed=None, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    This function runs hypothesis 1 over several processes. Every chunk gets its own child of the master
+    SeedSequence, so for a given seed the result is bit-identical for any number of workers.
+    :param airport_table: the parsed airport dataset
+    :param n_trials: number of trials
+    :param seed: the master seed
+    :param workers: number of processes, defaults to the number of cores
+    :param chunk_size: number of trials per chunk
+    :return: a dictionary with the finalized summaries of the landing distance and % of accommodating airports
+    """
+    if n_trials < 1:
+        raise ValueError('n_trials must be at least 1, not {}'.format(n_trials))
+    chunks = split_trials(n_trials, chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    results = run_chunks(hypo1_chunk, list(zip(seeds, chunks)), airport_table, workers)
+    merged = results[0]
+    for result in results[1:]:
+        merged = {key: merge_summaries(merged[key], result[key]) for key in merged}
+    return {key: finalize_summary(summary) for key, summary in merged.items()}
+
+
+def run_hypo2_parallel(airport_table, n_routes, seed=None, workers=None, ds=ROUTE_STEP_M):
+    """
+    This function samples and walks n_routes routes of hypothesis 2 over several processes, seeded the same
+    way as run_hypo1_parallel
+    :param airport_table: the parsed airport dataset
+    :param n_routes: number of routes
+    :param seed: the master seed
+    :param workers: number of processes, defaults to the number of cores
+    :param ds: step size along the route in meters
+    :return: a dictionary with the per-route results and the finalized summary over all route points
+    """
+    if n_routes < 1:
+        raise ValueError('n_routes must be at least 1, not {}'.format(n_routes))
+    seeds = np.random.SeedSequence(seed).spawn(n_routes)
+    routes = run_chunks(hypo2_route, [(seed_sequence, ds) for seed_sequence in seeds], airport_table, workers)
+    summary = routes[0]['summary']
+    for route in routes[1:]:
+        summary = merge_summaries(summary, route['summary'])
+    return {'routes': routes, 'nearest_airport_distance': finalize_summary(summary)}
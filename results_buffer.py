@@ -0,0 +1,84 @@
+import numpy as np
+
+from instrumentation import instrumented
+
+DEFAULT_CHUNK_SIZE = 4096
+
+
+class ResultsBuffer:
+
+    def __init__(self, columns, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Collects simulation results in typed NumPy chunks. A full chunk is kept as it is and a new one is
+        allocated, so appending never copies earlier rows and the DataFrame is only built once at the end.
+        :param columns: dictionary of column name -> NumPy dtype, in the order of the final DataFrame
+        :param chunk_size: number of rows per chunk
+        """
+        self.columns = {name: np.dtype(dtype) for name, dtype in columns.items()}
+        self.chunk_size = chunk_size
+        self.chunks = {name: [] for name in self.columns}
+        self.filled = 0
+        self.total = 0
+        self._new_chunk()
+
+    def _new_chunk(self):
+        for name, dtype in self.columns.items():
+            self.chunks[name].append(np.empty(self.chunk_size, dtype=dtype))
+        self.filled = 0
+
+    def __len__(self):
+        return self.total
+
+    @instrumented('results_append')
+    def append(self, row):
+        """
+        Adds one row, given as a sequence in column order or as a dictionary keyed by column name
+        """
+        if self.filled == self.chunk_size:
+            self._new_chunk()
+        if not isinstance(row, dict):
+            row = dict(zip(self.columns, row))
+        for name in self.columns:
+            self.chunks[name][-1][self.filled] = row[name]
+        self.filled += 1
+        self.total += 1
+
+    @instrumented('results_append')
+    def extend(self, arrays):
+        """
+        Adds a whole batch of rows at once
+        :param arrays: dictionary of column name -> array, all of the same length
+        """
+        n_rows = len(next(iter(arrays.values())))
+        start = 0
+        while start < n_rows:
+            if self.filled == self.chunk_size:
+                self._new_chunk()
+            stop = min(n_rows, start + self.chunk_size - self.filled)
+            for name in self.columns:
+                self.chunks[name][-1][self.filled:self.filled + stop - start] = arrays[name][start:stop]
+            self.filled += stop - start
+            self.total += stop - start
+            start = stop
+
+    def column(self, name):
+        """
+        Returns one column as a single contiguous array
+        >>> buffer = ResultsBuffer({'wind': 'U16', 'gradient': 'int64'}, chunk_size=2)
+        >>> for row in [('headwind', 50), ('tailwind', 60), ('crosswind', 70)]:
+        ...     buffer.append(row)
+        >>> buffer.extend({'wind': np.array(['headwind']), 'gradient': np.array([80])})
+        >>> buffer.column('gradient').tolist(), len(buffer)
+        ([50, 60, 70, 80], 4)
+        """
+        chunks = self.chunks[name]
+        return np.concatenate(chunks[:-1] + [chunks[-1][:self.filled]])
+
+    @instrumented('to_frame')
+    def to_frame(self):
+        """
+        Builds the DataFrame with every column concatenated exactly once
+        """
+        import pandas as pd
+
+        return pd.DataFrame({name: self.column(name) for name in self.columns})
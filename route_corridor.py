@@ -0,0 +1,172 @@
+import math
+
+import numpy as np
+
+from airport_index import AirportIndex, geod
+
+ROUTE_STEP_M = 100e3
+ANCHOR_SPACING_M = 1000e3
+DEFAULT_GAP_KM = 500
+
+
+def reduced_latitude(lat):
+    """
+    Latitude on the auxiliary sphere of the WGS84 ellipsoid, on which geodesics are great circles
+    """
+    return np.arctan((1 - geod.f) * np.tan(np.radians(lat)))
+
+
+def geodetic_latitude(beta):
+    return np.degrees(np.arctan(np.tan(beta) / (1 - geod.f)))
+
+
+def auxiliary_vectors(lat, long):
+    beta, long = reduced_latitude(lat), np.radians(long)
+    return np.stack([np.cos(beta) * np.cos(long), np.cos(beta) * np.sin(long), np.sin(beta)], axis=-1)
+
+
+def route_anchors(takeoff_lat, takeoff_long, destination_lat, destination_long, anchor_spacing):
+    """
+    Exact points every anchor_spacing meters along every route, from one geod.InverseLine per route
+    :return: the route length in meters, and for every anchor its route, distance along the route and position
+    """
+    from geographiclib.geodesic import Geodesic
+
+    lengths, route, along, lat, long = [], [], [], [], []
+    for i, (lat1, long1, lat2, long2) in enumerate(zip(takeoff_lat, takeoff_long, destination_lat, destination_long)):
+        line = geod.InverseLine(lat1, long1, lat2, long2)
+        lengths.append(line.s13)
+        for k in range(int(math.ceil(line.s13 / anchor_spacing)) + 1):
+            s = min(k * anchor_spacing, line.s13)
+            g = line.Position(s, Geodesic.STANDARD | Geodesic.LONG_UNROLL)
+            route.append(i)
+            along.append(s)
+            lat.append(g['lat2'])
+            long.append(g['lon2'])
+    return np.array(lengths), np.array(route, dtype=np.int64), np.array(along), np.array(lat), np.array(long)
+
+
+def route_waypoints(takeoff_lat, takeoff_long, destination_lat, destination_long, ds=ROUTE_STEP_M,
+                    anchor_spacing=ANCHOR_SPACING_M):
+    """
+    This function generates the waypoints of many routes at once. Like hypothesis 2 every route is walked in
+    steps of ds meters and ends on its destination. Exact points are only computed every anchor_spacing meters,
+    the waypoints in between are interpolated along the great circle of the auxiliary sphere, on which WGS84
+    geodesics are great circles, so with the default anchor_spacing they stay within 70 m of geod.InverseLine.
+    :param takeoff_lat: array of origin latitudes
+    :param takeoff_long: array of origin longitudes
+    :param destination_lat: array of destination latitudes
+    :param destination_long: array of destination longitudes
+    :param ds: step size along the route in meters
+    :param anchor_spacing: distance between two exactly computed points in meters
+    :return: a dictionary with the route of every waypoint, its distance along the route in km, its latitude
+             and longitude, and the length of every route in km
+    """
+    takeoff_lat, takeoff_long, destination_lat, destination_long = (
+        np.atleast_1d(np.asarray(values, dtype=np.float64)) for values in
+        (takeoff_lat, takeoff_long, destination_lat, destination_long))
+    lengths, anchor_route, anchor_along, anchor_lat, anchor_long = route_anchors(
+        takeoff_lat, takeoff_long, destination_lat, destination_long, anchor_spacing)
+    anchor_first = np.searchsorted(anchor_route, np.arange(len(lengths)))
+    anchors = auxiliary_vectors(anchor_lat, anchor_long)
+
+    steps = np.ceil(lengths / ds).astype(np.int64) + 1
+    route = np.repeat(np.arange(len(lengths)), steps)
+    first = np.cumsum(steps) - steps
+    along = np.minimum((np.arange(len(route)) - first[route]) * ds, lengths[route])
+
+    # interpolate between the anchor at or before every waypoint and the next one
+    last_anchor = np.searchsorted(anchor_route, np.arange(len(lengths)), side='right') - 1
+    segment = np.minimum(anchor_first[route] + np.floor(along / anchor_spacing).astype(np.int64),
+                         np.maximum(last_anchor[route] - 1, anchor_first[route]))
+    following = np.minimum(segment + 1, last_anchor[route])
+    span = anchor_along[following] - anchor_along[segment]
+    fraction = np.divide(along - anchor_along[segment], span, out=np.zeros(len(route)), where=span > 0)
+    start, end = anchors[segment], anchors[following]
+    angle = np.arccos(np.clip(np.einsum('ij,ij->i', start, end), -1, 1))
+    sin_angle = np.sin(angle)
+    safe = sin_angle > 1e-12
+    weight_start = np.where(safe, np.sin((1 - fraction) * angle) / np.where(safe, sin_angle, 1), 1 - fraction)
+    weight_end = np.where(safe, np.sin(fraction * angle) / np.where(safe, sin_angle, 1), fraction)
+    points = weight_start[:, None] * start + weight_end[:, None] * end
+
+    lat = geodetic_latitude(np.arctan2(points[:, 2], np.hypot(points[:, 0], points[:, 1])))
+    long = np.degrees(np.arctan2(points[:, 1], points[:, 0]))
+    return {'route': route, 'along_km': along / 1000, 'lat': lat, 'long': long, 'length_km': lengths / 1000}
+
+
+def gap_segments(route, along_km, distance, gap_km):
+    """
+    Finds the stretches of consecutive waypoints whose nearest accommodating airport is farther than gap_km
+    >>> gap_segments(np.array([0, 0, 0, 0, 1]), np.array([0., 100, 200, 300, 0]),
+    ...              np.array([600., 700, 100, 800, 900]), 500)
+    [(0, 0.0, 100.0), (0, 300.0, 300.0), (1, 0.0, 0.0)]
+    """
+    in_gap = distance > gap_km
+    # a gap starts where the previous waypoint was not in a gap or belonged to another route
+    starts_gap = in_gap & ~np.concatenate([[False], in_gap[:-1] & (route[1:] == route[:-1])])
+    ends_gap = in_gap & ~np.concatenate([in_gap[1:] & (route[1:] == route[:-1]), [False]])
+    return [(int(route[start]), float(along_km[start]), float(along_km[end]))
+            for start, end in zip(np.flatnonzero(starts_gap), np.flatnonzero(ends_gap))]
+
+
+def evaluate_routes(airport_index, takeoff_lat, takeoff_long, destination_lat, destination_long, landing_distance,
+                    ds=ROUTE_STEP_M, gap_km=DEFAULT_GAP_KM):
+    """
+    This function evaluates the diversion coverage of many routes at once: it generates every waypoint, finds
+    the nearest airport that accommodates the landing distance for all of them in bulk, and summarizes the
+    distances per route
+    :param airport_index: an AirportIndex built once for the airport dataset
+    :param landing_distance: the landing distance the diversion airport has to accommodate
+    :param ds: step size along the routes in meters
+    :param gap_km: waypoints with no accommodating airport within gap_km are reported as gaps
+    :return: a dictionary with the waypoints and their nearest airport, per-route min/mean/max distance and the
+             gap segments as (route, start km, end km) tuples
+    """
+    waypoints = route_waypoints(takeoff_lat, takeoff_long, destination_lat, destination_long, ds)
+    distance, airport = airport_index.nearest_bulk(waypoints['lat'], waypoints['long'], landing_distance)
+    route = waypoints['route']
+    n_routes = len(waypoints['length_km'])
+    counts = np.bincount(route, minlength=n_routes)
+    minimum = np.full(n_routes, np.inf)
+    maximum = np.full(n_routes, -np.inf)
+    np.minimum.at(minimum, route, distance)
+    np.maximum.at(maximum, route, distance)
+    with np.errstate(invalid='ignore'):
+        mean = np.bincount(route, weights=distance, minlength=n_routes) / counts
+    return dict(waypoints, nearest_airport_distance=distance, nearest_airport=airport,
+                min_distance=minimum, mean_distance=mean, max_distance=maximum,
+                gaps=gap_segments(route, waypoints['along_km'], distance, gap_km))
+
+
+def evaluate_airport_pairs(airport_table, pairs, landing_distance, ds=ROUTE_STEP_M, gap_km=DEFAULT_GAP_KM,
+                           airport_index=None):
+    """
+    Runs evaluate_routes for (origin, destination) pairs of airport positions in the airport table
+    """
+    if airport_index is None:
+        airport_index = AirportIndex(airport_table.lat, airport_table.long, airport_table.usable_length)
+    pairs = np.asarray(pairs).reshape(-1, 2)
+    lat, long = np.asarray(airport_table.lat), np.asarray(airport_table.long)
+    return evaluate_routes(airport_index, lat[pairs[:, 0]], long[pairs[:, 0]], lat[pairs[:, 1]], long[pairs[:, 1]],
+                           landing_distance, ds, gap_km)
+
+
+def max_waypoint_error_km(takeoff_lat, takeoff_long, destination_lat, destination_long, ds=ROUTE_STEP_M):
+    """
+    Largest distance between the interpolated waypoints of one route and the points geod.InverseLine gives,
+    NaN as soon as any waypoint could not be compared
+    """
+    from geographiclib.geodesic import Geodesic
+
+    waypoints = route_waypoints(takeoff_lat, takeoff_long, destination_lat, destination_long, ds)
+    line = geod.InverseLine(takeoff_lat, takeoff_long, destination_lat, destination_long)
+    error = 0.0
+    for along, lat, long in zip(waypoints['along_km'], waypoints['lat'], waypoints['long']):
+        g = line.Position(along * 1000, Geodesic.STANDARD | Geodesic.LONG_UNROLL)
+        distance = geod.Inverse(g['lat2'], g['lon2'], lat, long)['s12'] / 1000
+        # max() keeps whichever argument comes first when the other is NaN, so NaN is checked explicitly
+        if math.isnan(distance):
+            return math.nan
+        error = max(error, distance)
+    return error
@@ -0,0 +1,98 @@
+import numpy as np
+
+# share of the runway length a flight may use for landing
+USABLE_SHARE = 0.6
+
+
+def accommodating_counts(sorted_usable_length, ld):
+    """
+    Counts for every landing distance the airports whose usable runway is at least that long
+    >>> accommodating_counts(np.array([3000., 5000., 7000.]), np.array([4000., 7000., 8000.])).tolist()
+    [2, 1, 0]
+    """
+    return len(sorted_usable_length) - np.searchsorted(sorted_usable_length, ld, side='left')
+
+
+class RunwayIndex:
+
+    def __init__(self, usable_length, columns=None):
+        """
+        Sorted arrays of usable runway lengths, so counting the airports that accommodate a landing distance
+        is a binary search. Every filter combination gets its own sorted array, built the first time it is
+        used (or up front with precompute) and kept afterwards.
+        :param usable_length: array with the usable runway length of every airport
+        :param columns: optional dictionary of per-airport arrays the counts can be filtered on, such as
+                        'country', 'region', 'elevation', 'lat' and 'long'
+        """
+        self.usable_length = np.asarray(usable_length, dtype=np.float64)
+        self.columns = {name: np.asarray(values) for name, values in (columns or {}).items()}
+        self.sorted_arrays = {(): np.sort(self.usable_length)}
+
+    @classmethod
+    def from_table(cls, airport_table, regions=None):
+        """
+        Builds the index over an AirportTable with its country, elevation and location as filter columns
+        :param airport_table: the parsed airport dataset
+        :param regions: optional array with a region label for every airport
+        """
+        columns = {'country': airport_table.country, 'elevation': airport_table.elevation,
+                   'lat': airport_table.lat, 'long': airport_table.long}
+        if regions is not None:
+            columns['region'] = regions
+        return cls(airport_table.length * USABLE_SHARE, columns)
+
+    def __len__(self):
+        return len(self.usable_length)
+
+    def mask(self, filters):
+        """
+        Selects the airports matching the filters. A filter on a column selects one label, min_elevation
+        selects the airports at or above that elevation and within=(lat_min, lat_max, long_min, long_max)
+        selects a bounding box.
+        """
+        selected = np.ones(len(self.usable_length), dtype=bool)
+        for name, value in filters:
+            if name == 'min_elevation':
+                selected &= self.columns['elevation'] >= value
+            elif name == 'within':
+                lat_min, lat_max, long_min, long_max = value
+                lat, long = self.columns['lat'], self.columns['long']
+                selected &= (lat >= lat_min) & (lat <= lat_max) & (long >= long_min) & (long <= long_max)
+            else:
+                selected &= self.columns[name] == value
+        return selected
+
+    def sorted_usable_length(self, **filters):
+        """
+        Returns the sorted usable runway lengths of the airports matching the filters
+        """
+        key = tuple(sorted(filters.items()))
+        if key not in self.sorted_arrays:
+            self.sorted_arrays[key] = np.sort(self.usable_length[self.mask(key)])
+        return self.sorted_arrays[key]
+
+    def precompute(self, name):
+        """
+        Builds the sorted arrays for every label of a column at once
+        """
+        for value in np.unique(self.columns[name]):
+            self.sorted_usable_length(**{name: value})
+
+    def count(self, ld, **filters):
+        """
+        Counts the airports matching the filters that accommodate the landing distance, ld can be a single
+        value or a whole batch
+        >>> index = RunwayIndex([3000., 7000., 5000.], {'country': ['CANADA', 'INDIA', 'INDIA']})
+        >>> index.count(np.array([4000., 6000.])).tolist(), int(index.count(4000., country='INDIA'))
+        ([2, 1], 2)
+        """
+        return accommodating_counts(self.sorted_usable_length(**filters), ld)
+
+    def percent(self, ld, **filters):
+        """
+        The share of the airports matching the filters that accommodate the landing distance, in percent
+        """
+        sorted_usable_length = self.sorted_usable_length(**filters)
+        if not len(sorted_usable_length):
+            return np.full(np.shape(ld), np.nan)
+        return accommodating_counts(sorted_usable_length, ld) / len(sorted_usable_length) * 100
@@ -0,0 +1,192 @@
+import math
+
+import numpy as np
+
+from adaptive import block_means
+from batch_simulation import (CATEGORIES, DEFAULT_WEIGHTS, UNIFORM_STREAMS, category_probabilities, sample_uniforms,
+                              simulate_from_uniforms)
+
+SAMPLERS = ['plain', 'iid', 'latin_hypercube', 'antithetic', 'stratified']
+# the within-category draws, the streams latin hypercube sampling spreads out
+VALUE_STREAMS = ['temp_value', 'runway_surface_value', 'gross_weight_value', 'altitude_value', 'wind_value',
+                 'crosswind_angle']
+DEFAULT_REPLICATES = 10
+
+# The variance-reduction samplers estimate the mean over the distribution of a single trial. Holding a draw for
+# several iterations does not change that distribution, it only correlates neighbouring trials, so they sample
+# every trial independently. 'plain' is the current approach with the holds and is the baseline.
+
+
+def iid_uniforms(n_trials, rng):
+    """
+    Every stream drawn independently for every trial
+    """
+    return {stream: rng.random(n_trials) for stream in UNIFORM_STREAMS}
+
+
+def latin_hypercube(n_trials, rng):
+    """
+    One dimension of a latin hypercube: exactly one draw in each of the n_trials equal slices of [0, 1),
+    in random order
+    >>> sorted(np.floor(latin_hypercube(5, np.random.default_rng(0)) * 5).tolist())
+    [0.0, 1.0, 2.0, 3.0, 4.0]
+    """
+    return (rng.permutation(n_trials) + rng.random(n_trials)) / n_trials
+
+
+def latin_hypercube_uniforms(n_trials, rng):
+    """
+    Independent category draws with the within-category values spread out by latin hypercube sampling. For this
+    model it is no better than iid: the variance of a trial comes almost entirely from its categories, which
+    stay independent, and 600 repeated estimates at 10k trials gave the same variance as iid within noise.
+    Antithetic and stratified sampling are the ones that reduce it.
+    """
+    uniforms = iid_uniforms(n_trials, rng)
+    for stream in VALUE_STREAMS:
+        uniforms[stream] = latin_hypercube(n_trials, rng)
+    return uniforms
+
+
+def antithetic_uniforms(n_trials, rng):
+    """
+    Pairs of trials, the second trial of every pair uses 1 - u for every stream of the first
+    """
+    half = iid_uniforms(-(-n_trials // 2), rng)
+    return {stream: np.stack([u, 1 - u], axis=1).ravel()[:n_trials] for stream, u in half.items()}
+
+
+def strata_probabilities(factors, weights=None):
+    """
+    The probability of every combination of the categories of the given factors, in ravel order
+    """
+    weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+    probabilities = np.ones(1)
+    for factor in factors:
+        probabilities = np.multiply.outer(probabilities, category_probabilities(weights[factor])).ravel()
+    return probabilities
+
+
+def proportional_allocation(probabilities, n_trials, min_per_stratum=2):
+    """
+    Splits the trials over the strata in proportion to their probability, every stratum gets at least
+    min_per_stratum trials so its variance can be estimated
+    >>> proportional_allocation(np.array([0.7, 0.299, 0.001]), 100).tolist()
+    [70, 29, 2]
+    """
+    return np.maximum(np.floor(probabilities * n_trials).astype(np.int64), min_per_stratum)
+
+
+def stratified_categories(n_trials, factors=None, weights=None):
+    """
+    Assigns the categories of the given factors stratum by stratum
+    :return: a dictionary of category index arrays, the stratum of every trial and the stratum probabilities
+    """
+    factors = list(CATEGORIES) if factors is None else factors
+    probabilities = strata_probabilities(factors, weights)
+    allocation = proportional_allocation(probabilities, n_trials)
+    strata = np.repeat(np.arange(len(probabilities)), allocation)
+    shape = tuple(len(CATEGORIES[factor]) for factor in factors)
+    categories = dict(zip(factors, np.unravel_index(strata, shape)))
+    return categories, strata, probabilities
+
+
+def stratified_estimate(values, strata, probabilities):
+    """
+    Combines the stratum means with the stratum probabilities, the estimate and its standard error are the
+    usual sum of p_h * mean_h and sqrt(sum of p_h^2 * s_h^2 / n_h)
+    """
+    n_strata = len(probabilities)
+    counts = np.bincount(strata, minlength=n_strata)
+    sums = np.bincount(strata, weights=values, minlength=n_strata)
+    means = sums / counts
+    squares = np.bincount(strata, weights=(values - means[strata]) ** 2, minlength=n_strata)
+    variances = squares / (counts - 1)
+    return float(probabilities @ means), math.sqrt(float((probabilities ** 2 * variances / counts).sum()))
+
+
+def mean_and_error(samples):
+    """
+    Mean of independent samples and the standard error of that mean
+    """
+    return float(samples.mean()), float(samples.std(ddof=1) / math.sqrt(len(samples)))
+
+
+def estimate_mean(n_trials, sampler='stratified', rng=None, seed=None, hypo_type='1', transform=None,
+                  replicates=DEFAULT_REPLICATES, factors=None):
+    """
+    This function estimates the mean landing distance, or the mean of transform(landing distance), with one
+    of the samplers
+    1. plain : the current approach, with the predictors holding on to their draws
+    2. iid : every trial drawn independently
+    3. latin_hypercube : latin hypercube sampling of the within-category values, in independent replicates
+    4. antithetic : pairs of trials using u and 1 - u
+    5. stratified : proportional allocation over the category combinations, reweighted by their probability
+    :param n_trials: number of trials, stratified sampling may use a few more to cover every stratum
+    :param sampler: one of SAMPLERS
+    :param rng: a numpy.random.Generator, created from seed when not given
+    :param seed: seed for a new generator when rng is not given
+    :param hypo_type: the hypothesis the landing distance is calculated for
+    :param transform: optional function applied to the landing distances, such as the % of accommodating airports
+    :param replicates: number of independent latin hypercubes
+    :param factors: the factors stratified sampling stratifies over, defaults to all categorical factors
+    :return: a dictionary with the estimate, its standard error and the number of trials used
+    """
+    if sampler not in SAMPLERS:
+        raise ValueError('sampler must be one of {}'.format(SAMPLERS))
+    if rng is None:
+        rng = np.random.default_rng(seed)
+    transform = transform or (lambda ld: ld)
+
+    def values_for(uniforms, categories=None):
+        return np.asarray(transform(simulate_from_uniforms(uniforms, hypo_type, categories=categories)[
+            'landing_distance']), dtype=np.float64)
+
+    if sampler == 'plain':
+        values = values_for(sample_uniforms(n_trials, rng))
+        estimate, standard_error = float(values.mean()), mean_and_error(block_means(values))[1]
+    elif sampler == 'iid':
+        values = values_for(iid_uniforms(n_trials, rng))
+        estimate, standard_error = mean_and_error(values)
+    elif sampler == 'latin_hypercube':
+        per_replicate = n_trials // replicates
+        values = [values_for(latin_hypercube_uniforms(per_replicate, rng)) for _ in range(replicates)]
+        estimate, standard_error = mean_and_error(np.array([replicate.mean() for replicate in values]))
+        values = np.concatenate(values)
+    elif sampler == 'antithetic':
+        values = values_for(antithetic_uniforms(n_trials - n_trials % 2, rng))
+        estimate, standard_error = mean_and_error(values.reshape(-1, 2).mean(axis=1))
+    else:
+        categories, strata, probabilities = stratified_categories(n_trials, factors)
+        values = values_for(iid_uniforms(len(strata), rng), categories)
+        estimate, standard_error = stratified_estimate(values, strata, probabilities)
+    return {'sampler': sampler, 'estimate': estimate, 'standard_error': standard_error, 'trials': len(values)}
+
+
+def variance_reduction_benchmark(n_trials=30000, repeats=50, seed=None, transform=None, samplers=SAMPLERS):
+    """
+    This function runs every sampler `repeats` times and compares the spread of its estimates with the plain
+    sampler. The variance-reduction factor is var(plain) * trials(plain) / (var(sampler) * trials(sampler)),
+    so a factor of 4 means the sampler reaches the same confidence interval with a quarter of the trials.
+    :return: a dictionary keyed by sampler with the mean estimate, the empirical and the mean reported standard
+             error, the trials per run and the variance-reduction factor
+    """
+    seeds = np.random.SeedSequence(seed).spawn(len(samplers))
+    report = {}
+    for sampler, sampler_seed in zip(samplers, seeds):
+        rng = np.random.default_rng(sampler_seed)
+        runs = [estimate_mean(n_trials, sampler, rng=rng, transform=transform) for _ in range(repeats)]
+        estimates = np.array([run['estimate'] for run in runs])
+        report[sampler] = {'estimate': float(estimates.mean()), 'empirical_error': float(estimates.std(ddof=1)),
+                           'reported_error': float(np.mean([run['standard_error'] for run in runs])),
+                           'trials': runs[0]['trials']}
+    if 'plain' in report:
+        baseline = report['plain']['empirical_error'] ** 2 * report['plain']['trials']
+        for row in report.values():
+            row['variance_reduction'] = baseline / (row['empirical_error'] ** 2 * row['trials'])
+    return report
+
+
+if __name__ == '__main__':
+    for name, row in variance_reduction_benchmark(seed=0).items():
+        print('{:16} estimate {estimate:10.2f}  error {empirical_error:8.3f} (reported {reported_error:8.3f})  '
+              'trials {trials:6d}  variance reduction {variance_reduction:6.2f}'.format(name, **row))
@@ -0,0 +1,332 @@
+import csv
+import math
+import os
+
+import numpy as np
+
+from batch_simulation import CATEGORIES, category_names, simulate_batch
+
+DEFAULT_BATCH_SIZE = 30000
+DEFAULT_QUANTILES = (0.05, 0.5, 0.95)
+# landing distances go from roughly 3000 ft up to about 65000 ft on an icy runway with a tailwind
+DEFAULT_HISTOGRAM_EDGES = np.arange(0, 80001, 500)
+HISTOGRAM_FACTORS = list(CATEGORIES)
+
+
+class RunningStats:
+
+    def __init__(self):
+        """
+        Count, mean, variance, minimum and maximum of a stream, updated with Welford's method. Whole batches
+        are folded in with the pairwise update of Chan et al., so updating costs the same as one NumPy pass.
+        """
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if not len(values):
+            return
+        batch_mean = float(values.mean())
+        self._combine(len(values), batch_mean, float(((values - batch_mean) ** 2).sum()), float(values.min()),
+                      float(values.max()))
+
+    def merge(self, other):
+        if other.count:
+            self._combine(other.count, other.mean, other.m2, other.min, other.max)
+
+    def _combine(self, count, mean, m2, minimum, maximum):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+        self.min = min(self.min, minimum)
+        self.max = max(self.max, maximum)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else math.nan
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance) if self.count > 1 else math.nan
+
+    def as_dict(self):
+        """
+        >>> stats = RunningStats()
+        >>> stats.update([1, 2, 3]); stats.update([4])
+        >>> stats.as_dict()
+        {'count': 4, 'mean': 2.5, 'std': 1.2909944487358056, 'min': 1.0, 'max': 4.0}
+        """
+        return {'count': self.count, 'mean': self.mean, 'std': self.std, 'min': self.min, 'max': self.max}
+
+
+class QuantileDigest:
+
+    def __init__(self, compression=200, buffer_size=50000):
+        """
+        A merging t-digest. Values are buffered and every so often merged into at most `compression`
+        centroids, small ones in the tails and large ones around the median, so the memory use is fixed and
+        tail quantiles stay accurate.
+        :param compression: the number of centroids the digest is compressed to
+        :param buffer_size: number of buffered values that triggers a compression
+        """
+        self.compression = compression
+        self.buffer_size = buffer_size
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.buffer = []
+        self.buffered = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def update(self, values, weights=None):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if not len(values):
+            return
+        weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype=np.float64).ravel()
+        self.buffer.append((values, weights))
+        self.buffered += len(values)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        if self.buffered >= self.buffer_size:
+            self.compress()
+
+    def merge(self, other):
+        other.compress()
+        self.update(other.means, other.weights)
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def compress(self):
+        if not self.buffer:
+            return
+        means = np.concatenate([self.means] + [values for values, weights in self.buffer])
+        weights = np.concatenate([self.weights] + [weights for values, weights in self.buffer])
+        self.buffer = []
+        self.buffered = 0
+
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        cumulative = np.cumsum(weights)
+        q_left = (cumulative - weights) / cumulative[-1]
+        # k1 scale function, every centroid covers at most one unit of k
+        k = np.floor(self.compression / math.pi * (np.arcsin(2 * q_left - 1) + math.pi / 2))
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(k)) + 1])
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
+
+    @property
+    def count(self):
+        return float(self.weights.sum()) + sum(float(weights.sum()) for values, weights in self.buffer)
+
+    def quantile(self, q):
+        """
+        Estimates the q-quantiles by interpolating between the centroids
+        >>> digest = QuantileDigest()
+        >>> digest.update(np.arange(1, 100001))
+        >>> [round(float(x)) for x in digest.quantile([0, 0.01, 0.5, 1])]
+        [1, 1000, 50000, 100000]
+        """
+        self.compress()
+        if not len(self.means):
+            return np.full(np.shape(q), math.nan)
+        cumulative = np.cumsum(self.weights)
+        midpoints = np.concatenate([[0], cumulative - self.weights / 2, [cumulative[-1]]])
+        means = np.concatenate([[self.min], self.means, [self.max]])
+        return np.interp(np.asarray(q) * cumulative[-1], midpoints, means)
+
+
+class CategoryHistograms:
+
+    def __init__(self, edges=DEFAULT_HISTOGRAM_EDGES, factors=HISTOGRAM_FACTORS):
+        """
+        One landing distance histogram for every combination of the categories of the given factors. The
+        first and last bins catch values below and above the edges.
+        """
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.factors = list(factors)
+        self.shape = tuple(len(CATEGORIES[factor]) for factor in self.factors)
+        self.n_bins = len(self.edges) + 1
+        self.counts = np.zeros((int(np.prod(self.shape)), self.n_bins), dtype=np.int64)
+
+    def update(self, result):
+        """
+        :param result: a dictionary of simulate_batch with the category indices and the landing distance
+        """
+        combination = np.ravel_multi_index([result[factor] for factor in self.factors], self.shape)
+        bins = np.searchsorted(self.edges, result['landing_distance'], side='right')
+        self.counts += np.bincount(combination * self.n_bins + bins,
+                                   minlength=self.counts.size).reshape(self.counts.shape)
+
+    def merge(self, other):
+        self.counts += other.counts
+
+    def to_frame(self):
+        """
+        Long format DataFrame with one row per non-empty (category combination, bin)
+        """
+        import pandas as pd
+
+        combination, bins = np.nonzero(self.counts)
+        categories = np.unravel_index(combination, self.shape)
+        lower = np.concatenate([[-np.inf], self.edges])
+        upper = np.concatenate([self.edges, [np.inf]])
+        frame = {factor: category_names(factor, indices) for factor, indices in zip(self.factors, categories)}
+        frame.update({'bin_lower': lower[bins], 'bin_upper': upper[bins], 'count': self.counts[combination, bins]})
+        return pd.DataFrame(frame)
+
+
+class SnapshotWriter:
+
+    def __init__(self, path, every):
+        """
+        Writes a summary row every `every` trials, so long runs can be followed while they are running. Rows
+        are appended to a CSV file, a .parquet path is a directory that gets one part file per snapshot, which
+        pandas.read_parquet reads back as one frame. Nothing is kept in memory.
+        """
+        self.path = path
+        self.every = every
+        self.next_snapshot = every
+        self.parts = 0
+        if path.endswith('.parquet'):
+            os.makedirs(path, exist_ok=True)
+            for name in os.listdir(path):
+                if name.startswith('part-') and name.endswith('.parquet'):
+                    os.remove(os.path.join(path, name))
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def maybe_write(self, trials, snapshot):
+        if trials < self.next_snapshot:
+            return
+        self.next_snapshot = (trials // self.every + 1) * self.every
+        self.write(dict(trials=trials, **snapshot))
+
+    def write(self, row):
+        if self.path.endswith('.parquet'):
+            import pandas as pd
+
+            # readers of the directory skip dot files, so they never see a part that is still being written
+            name = 'part-{:06d}.parquet'.format(self.parts)
+            temp_path = os.path.join(self.path, '.' + name + '.tmp')
+            pd.DataFrame([row]).to_parquet(temp_path)
+            os.replace(temp_path, os.path.join(self.path, name))
+            self.parts += 1
+            return
+        new_file = not os.path.exists(self.path)
+        with open(self.path, 'a', newline='') as snapshot_file:
+            writer = csv.DictWriter(snapshot_file, fieldnames=list(row))
+            if new_file:
+                writer.writeheader()
+            writer.writerow(row)
+
+
+class StreamingAggregator:
+
+    def __init__(self, quantiles=DEFAULT_QUANTILES, histogram_edges=DEFAULT_HISTOGRAM_EDGES):
+        """
+        Keeps running statistics of named streams without storing their values
+        """
+        self.quantiles = quantiles
+        self.histogram_edges = histogram_edges
+        self.stats = {}
+        self.digests = {}
+        self.histograms = None
+
+    def update(self, name, values):
+        if name not in self.stats:
+            self.stats[name] = RunningStats()
+            self.digests[name] = QuantileDigest()
+        self.stats[name].update(values)
+        self.digests[name].update(values)
+
+    def update_histograms(self, result):
+        if self.histograms is None:
+            self.histograms = CategoryHistograms(self.histogram_edges)
+        self.histograms.update(result)
+
+    def merge(self, other):
+        for name in other.stats:
+            if name not in self.stats:
+                self.stats[name] = RunningStats()
+                self.digests[name] = QuantileDigest()
+            self.stats[name].merge(other.stats[name])
+            self.digests[name].merge(other.digests[name])
+        if other.histograms is not None:
+            if self.histograms is None:
+                self.histograms = CategoryHistograms(self.histogram_edges)
+            self.histograms.merge(other.histograms)
+
+    def snapshot(self):
+        """
+        Flattens the statistics of every stream into a single row
+        """
+        row = {}
+        for name, stats in self.stats.items():
+            for key, value in stats.as_dict().items():
+                row[name + '_' + key] = value
+            for q, value in zip(self.quantiles, self.digests[name].quantile(self.quantiles)):
+                row['{}_p{:g}'.format(name, q * 100)] = float(value)
+        return row
+
+
+def run_hypo1_streaming(airport_table, n_trials, seed=None, batch_size=DEFAULT_BATCH_SIZE, snapshot_path=None,
+                        snapshot_every=None):
+    """
+    This function runs hypothesis 1 in batches and only keeps running statistics of the landing distance and
+    the % of accommodating airports, so the memory use does not grow with the number of trials
+    :param airport_table: the parsed airport dataset
+    :param n_trials: number of trials
+    :param seed: seed of the random generator
+    :param batch_size: number of trials simulated at once, a multiple of 30 keeps the predictor holds aligned
+    :param snapshot_path: optional CSV file or Parquet directory the statistics are written to while running
+    :param snapshot_every: number of trials between two snapshots, defaults to every batch
+    :return: the StreamingAggregator with the statistics of the run
+    """
+    from runway_index import RunwayIndex
+
+    rng = np.random.default_rng(seed)
+    runway_index = RunwayIndex.from_table(airport_table)
+    aggregator = StreamingAggregator()
+    writer = SnapshotWriter(snapshot_path, snapshot_every or batch_size) if snapshot_path else None
+    trials = 0
+    while trials < n_trials:
+        result = simulate_batch(min(batch_size, n_trials - trials), '1', rng=rng)
+        ld = result['landing_distance']
+        percent_of_accommodating_airport = runway_index.percent(ld)
+        aggregator.update('landing_distance', ld)
+        aggregator.update('percent', percent_of_accommodating_airport)
+        aggregator.update_histograms(result)
+        trials += len(ld)
+        if writer:
+            writer.maybe_write(trials, aggregator.snapshot())
+    return aggregator
+
+
+def run_hypo2_streaming(airport_table, n_routes, seed=None, snapshot_path=None, snapshot_every=1):
+    """
+    This function walks n_routes routes of hypothesis 2 and only keeps running statistics of the distance to
+    the nearest accommodating airport
+    :param airport_table: the parsed airport dataset
+    :param n_routes: number of routes
+    :param seed: the master seed, every route gets its own child like in run_hypo2_parallel
+    :param snapshot_path: optional CSV file or Parquet directory the statistics are written to while running
+    :param snapshot_every: number of routes between two snapshots
+    :return: the StreamingAggregator with the statistics of the run
+    """
+    from parallel_runner import ROUTE_STEP_M, hypo2_route, init_worker
+
+    init_worker(airport_table.lat, airport_table.long, airport_table.elevation, airport_table.length)
+    aggregator = StreamingAggregator()
+    writer = SnapshotWriter(snapshot_path, snapshot_every) if snapshot_path else None
+    for routes, seed_sequence in enumerate(np.random.SeedSequence(seed).spawn(n_routes), start=1):
+        aggregator.update('nearest_airport_distance',
+                          hypo2_route((seed_sequence, ROUTE_STEP_M))['nearest_airport_distance'])
+        if writer:
+            writer.maybe_write(routes, aggregator.snapshot())
+    return aggregator
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from airport_index import AirportIndex, brute_force_nearest
+
+N_AIRPORTS = 300
+N_POINTS = 200
+
+
+@pytest.fixture(scope='module')
+def airports():
+    rng = np.random.default_rng(597)
+    # a uniform spread plus a tight cluster, so neighbouring airports are often only meters apart
+    lat = np.concatenate([np.degrees(np.arcsin(rng.uniform(-1, 1, N_AIRPORTS - 100))), rng.normal(45, 0.05, 100)])
+    long = np.concatenate([rng.uniform(-180, 180, N_AIRPORTS - 100), rng.normal(-75, 0.05, 100)])
+    capacity = rng.uniform(1000, 9000, N_AIRPORTS)
+    return lat, long, capacity
+
+
+@pytest.fixture(scope='module')
+def points():
+    rng = np.random.default_rng(1597)
+    lat = np.concatenate([np.degrees(np.arcsin(rng.uniform(-1, 1, N_POINTS - 50))), rng.normal(45, 0.1, 50)])
+    long = np.concatenate([rng.uniform(-180, 180, N_POINTS - 50), rng.normal(-75, 0.1, 50)])
+    return lat, long
+
+
+def brute_force_many(lats, longs, airports, min_capacity):
+    answers = [brute_force_nearest(lat, long, *airports, min_capacity) for lat, long in zip(lats, longs)]
+    return np.array([distance for distance, _ in answers]), np.array([position for _, position in answers])
+
+
+@pytest.mark.parametrize('min_capacity', [0, 5000, 8500])
+def test_matches_brute_force(airports, points, min_capacity):
+    index = AirportIndex(*airports, leaf_size=8)
+    expected_distances, expected_positions = brute_force_many(*points, airports, min_capacity)
+    for lat, long, distance, position in zip(*points, expected_distances, expected_positions):
+        assert index.nearest(lat, long, min_capacity) == (distance, position)
+    # a small block forces several position blocks
+    distances, positions = index.nearest_bulk(*points, min_capacity, block_elements=10000)
+    np.testing.assert_array_equal(distances, expected_distances)
+    np.testing.assert_array_equal(positions, expected_positions)
+
+
+def test_set_capacity_matches_brute_force(airports, points):
+    lat, long, capacity = airports
+    index = AirportIndex(lat, long, capacity)
+    margins = np.random.default_rng(2).uniform(-3000, 3000, len(lat))
+    index.set_capacity(margins)
+    expected_distances, expected_positions = brute_force_many(*points, (lat, long, margins), 0)
+    distances, positions = index.nearest_bulk(*points, 0)
+    np.testing.assert_array_equal(distances, expected_distances)
+    np.testing.assert_array_equal(positions, expected_positions)
+    distances, positions = index.nearest_many(*points, 0)
+    np.testing.assert_array_equal(distances, expected_distances)
+    np.testing.assert_array_equal(positions, expected_positions)
+
+
+def test_no_eligible_airport(airports, points):
+    index = AirportIndex(*airports)
+    min_capacity = airports[2].max()
+    assert brute_force_nearest(45, -75, *airports, min_capacity) == (float('inf'), -1)
+    assert index.nearest(45, -75, min_capacity) == (float('inf'), -1)
+    distances, positions = index.nearest_bulk(*points, min_capacity)
+    assert np.all(np.isinf(distances))
+    assert np.all(positions == -1)
+    index.set_capacity(np.zeros(len(airports[0])))
+    assert index.nearest(45, -75, 0) == (float('inf'), -1)
+    assert np.all(index.nearest_bulk(*points, 0)[1] == -1)
@@ -0,0 +1,38 @@
+import os
+
+import numpy as np
+
+from airport_table import AirportTable, file_fingerprint, read_cache, write_cache
+
+
+def table(offset):
+    names = np.array(['a', 'b', 'c'])
+    return AirportTable(np.arange(3.0) + offset, np.arange(3.0) - offset, np.array([0, 10, 20]) + offset,
+                        np.array([8000, 9000, 10000]) + offset, names, names, names)
+
+
+def test_rewriting_the_cache_keeps_mapped_columns_intact(tmp_path):
+    source = tmp_path / 'airports.xlsx'
+    source.write_bytes(b'first')
+    directory = str(tmp_path / 'cache')
+    write_cache(directory, table(0), file_fingerprint(source))
+    mapped = read_cache(directory, source)
+    np.testing.assert_array_equal(mapped.lat, [0, 1, 2])
+
+    source.write_bytes(b'second')
+    assert read_cache(directory, source) is None
+    write_cache(directory, table(100), file_fingerprint(source))
+    # the old mapping still reads the columns it was opened on, the new read gets the new ones
+    np.testing.assert_array_equal(mapped.lat, [0, 1, 2])
+    np.testing.assert_array_equal(read_cache(directory, source).lat, [100, 101, 102])
+    assert len([name for name in os.listdir(directory) if name.endswith('.npy')]) == 7
+    assert not [name for name in os.listdir(directory) if name.endswith('.tmp')]
+
+
+def test_columns_without_meta_are_not_a_cache(tmp_path):
+    source = tmp_path / 'airports.xlsx'
+    source.write_bytes(b'first')
+    directory = str(tmp_path / 'cache')
+    write_cache(directory, table(0), file_fingerprint(source))
+    os.remove(os.path.join(directory, 'meta.json'))
+    assert read_cache(directory, source) is None
@@ -0,0 +1,44 @@
+import random
+
+import numpy as np
+import pytest
+
+import main
+from batch_simulation import CATEGORIES, category_names, simulate_batch
+
+N_TRIALS = 20000
+
+
+@pytest.fixture(scope='module')
+def scalar_trials():
+    """
+    Landing distances and attribute maps of hypothesis 1 from the predictor classes and mc_simulation of main.py
+    """
+    random.seed(2)
+    predictors = (main.TemperaturePredictor(), main.RunwaySurfacePredictor(), main.GrossWeightPredictor(),
+                  main.AltitudePredictor(), main.WindPredictor(), main.GradientPredictor())
+    landing_distances, attribute_maps = [], []
+    for _ in range(N_TRIALS):
+        ld, attribute_map = main.mc_simulation(dict(main.RandomAttributeSelector(*predictors).__dict__), '1')
+        landing_distances.append(ld)
+        attribute_maps.append(attribute_map)
+    return np.array(landing_distances), attribute_maps
+
+
+def test_landing_distance_quantiles_match_mc_simulation(scalar_trials):
+    scalar, _ = scalar_trials
+    batch = simulate_batch(N_TRIALS, '1', seed=2)['landing_distance']
+    levels = [0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+    np.testing.assert_allclose(np.quantile(batch, levels), np.quantile(scalar, levels), rtol=0.03)
+
+
+def test_category_frequencies_match_mc_simulation(scalar_trials):
+    _, attribute_maps = scalar_trials
+    batch = simulate_batch(N_TRIALS, '1', seed=2)
+    for factor in CATEGORIES:
+        batch_names = category_names(factor, batch[factor])
+        scalar_names = np.array([attribute_map[factor] for attribute_map in attribute_maps])
+        for category in CATEGORIES[factor]:
+            # the held predictors change every 10 trials at most, which leaves about 2000 independent draws
+            assert np.mean(batch_names == category) == pytest.approx(np.mean(scalar_names == category), abs=0.04)
+    assert batch['gradient'].mean() == pytest.approx(np.mean([m['gradient'] for m in attribute_maps]), rel=0.03)
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+import checkpoint_runner
+from benchmarks import synthetic_airport_table
+from checkpoint_runner import ChunkedResults, run_hypo1_checkpointed
+
+
+class Killed(Exception):
+    pass
+
+
+@pytest.fixture(scope='module')
+def airport_table():
+    return synthetic_airport_table(200)
+
+
+def test_a_resumed_run_matches_an_uninterrupted_one(airport_table, tmp_path, monkeypatch):
+    full = run_hypo1_checkpointed(airport_table, 5000, str(tmp_path / 'full'), seed=11, workers=1, chunk_size=1000,
+                                  chunk_format='npz')
+
+    write_chunk = checkpoint_runner.write_chunk
+    written = []
+
+    def killed_after_two_chunks(path, columns):
+        if len(written) == 2:
+            raise Killed
+        write_chunk(path, columns)
+        written.append(path)
+
+    monkeypatch.setattr(checkpoint_runner, 'write_chunk', killed_after_two_chunks)
+    with pytest.raises(Killed):
+        run_hypo1_checkpointed(airport_table, 5000, str(tmp_path / 'resumed'), seed=11, workers=1, chunk_size=1000,
+                               chunk_format='npz')
+    stopped = ChunkedResults(str(tmp_path / 'resumed'))
+    assert not stopped.complete and len(stopped) == 2000
+
+    monkeypatch.setattr(checkpoint_runner, 'write_chunk', write_chunk)
+    # the seed is read back from the checkpoint, and the remaining chunks can run on another number of workers
+    resumed = run_hypo1_checkpointed(airport_table, 5000, str(tmp_path / 'resumed'), workers=2, chunk_size=1000)
+    assert resumed.complete and len(resumed) == len(full) == 5000
+    for full_chunk, resumed_chunk in zip(full.chunks(), resumed.chunks()):
+        assert full_chunk.keys() == resumed_chunk.keys()
+        for name in full_chunk:
+            np.testing.assert_array_equal(full_chunk[name], resumed_chunk[name])
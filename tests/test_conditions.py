@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from airport_table import AirportTable
+from conditions import ConditionProfile, airport_positions, network_feasibility
+from distribution_engine import accommodation_probability
+
+
+@pytest.fixture
+def airport_table():
+    n_airports = 50
+    names = np.array(['airport {}'.format(i) for i in range(n_airports)])
+    return AirportTable(np.zeros(n_airports), np.zeros(n_airports), np.zeros(n_airports),
+                        np.linspace(8000, 30000, n_airports), names, names, names)
+
+
+def test_chunked_feasibility_matches_one_batch(airport_table):
+    profile = ConditionProfile(overrides={'runway_surface': {'icy': [3, 30]}})
+    one_batch = network_feasibility(airport_table, profile, 4000, seed=5, batch_trials=10 ** 9)
+    for batch_trials in [1, 4000, 4000 * 7 + 1]:
+        chunked = network_feasibility(airport_table, profile, 4000, seed=5, batch_trials=batch_trials)
+        np.testing.assert_array_equal(chunked, one_batch)
+
+
+def test_feasibility_agrees_with_the_distribution_engine(airport_table):
+    # both evaluate airports in the high altitude category, 4000 trials give a standard error below 0.008
+    feasibility = network_feasibility(airport_table, ConditionProfile(), 4000, seed=5)
+    assert np.abs(feasibility - accommodation_probability(airport_table)).max() < 0.04
+
+
+def test_unknown_airports_are_named(airport_table):
+    assert airport_positions(airport_table, ['airport 7', 2]) == [7, 2]
+    with pytest.raises(ValueError, match="'Nowhere International'"):
+        airport_positions(airport_table, ['Nowhere International'])
+    with pytest.raises(ValueError, match='50'):
+        airport_positions(airport_table, [50])
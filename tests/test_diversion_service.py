@@ -0,0 +1,154 @@
+import socket
+import threading
+
+import numpy as np
+import pytest
+
+from benchmarks import synthetic_airport_table
+from diversion_service import MAX_BODY, DiversionClient, DiversionService, running_service
+from eligibility import EligibilityTable
+
+
+@pytest.fixture(scope='module')
+def airport_table():
+    return synthetic_airport_table(300)
+
+
+def start(airport_table, **kwargs):
+    service = DiversionService(airport_table, EligibilityTable(airport_table), **kwargs)
+    return service, running_service(service)
+
+
+def test_concurrent_queries_are_answered_in_batches(airport_table):
+    service, running = start(airport_table, batch_window=0.2)
+    rng = np.random.default_rng(8)
+    positions = list(zip(rng.uniform(-50, 60, 16).tolist(), rng.uniform(-180, 180, 16).tolist()))
+    barrier = threading.Barrier(len(positions))
+    answers = [None] * len(positions)
+    with running as address:
+        def query(i):
+            with DiversionClient(*address) as client:
+                barrier.wait()
+                answers[i] = client.nearest(*positions[i])
+
+        threads = [threading.Thread(target=query, args=(i,)) for i in range(len(positions))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with DiversionClient(*address) as client:
+            metrics = client.metrics()
+    assert metrics['queries'] == len(positions)
+    assert metrics['max_batch_size'] > 1
+    assert metrics['batches'] < len(positions)
+    for (lat, long), answer in zip(positions, answers):
+        distance, airport = service.eligibility.nearest(lat, long)
+        assert answer['distance_km'] == distance
+        assert answer['airport']['position'] == airport
+
+
+@pytest.mark.parametrize('query', [
+    {'lat': 45.0, 'long': 10.0, 'level': 0.3},
+    {'lat': 45.0, 'long': 10.0, 'profile': 'no such profile'},
+    {'lat': 45.0, 'long': 10.0, 'conditions': {'runway_surface': 'lava'}},
+    {'lat': 45.0, 'long': 10.0, 'conditions': {'visibility': 'poor'}},
+    {'lat': 45.0, 'long': 10.0, 'conditions': ['wet']},
+    {'lat': 95.0, 'long': 10.0},
+    {'long': 10.0},
+    [45.0, 10.0],
+])
+def test_bad_queries_are_rejected(airport_table, query):
+    _, running = start(airport_table)
+    with running as address, DiversionClient(*address) as client:
+        status, result = client.request('POST', '/nearest', query)
+        assert status == 400
+        assert result['error']
+        # the connection is still usable after a rejected query
+        assert client.nearest(45.0, 10.0)['distance_km'] > 0
+
+
+def test_unknown_paths_and_methods(airport_table):
+    _, running = start(airport_table)
+    with running as address, DiversionClient(*address) as client:
+        assert client.request('GET', '/nowhere')[0] == 404
+        assert client.request('GET', '/nearest')[0] == 405
+        assert client.request('POST', '/metrics', {})[0] == 405
+        assert client.request('GET', '/health')[0] == 200
+        assert client.metrics()['errors'] == 3
+
+
+def test_oversized_bodies_are_rejected(airport_table):
+    _, running = start(airport_table)
+    with running as (host, port):
+        with socket.create_connection((host, port), timeout=10) as connection:
+            connection.sendall('POST /nearest HTTP/1.1\r\nHost: localhost\r\nContent-Length: {}\r\n\r\n'
+                               .format(MAX_BODY + 1).encode())
+            response = connection.makefile('rb').read()
+        assert response.startswith(b'HTTP/1.1 413 ')
+        assert b'Connection: close' in response
+        with DiversionClient(host, port) as client:
+            status, result = client.request('POST', '/nearest', {'lat': 45.0, 'long': 10.0, 'pad': 'x' * MAX_BODY})
+            assert status == 413
+
+
+def test_keep_alive_reuses_the_connection(airport_table):
+    _, running = start(airport_table)
+    with running as address, DiversionClient(*address) as client:
+        client.nearest(45.0, 10.0)
+        connection = client.connection
+        client.nearest(-30.0, 140.0, conditions={'wind': 'tailwind'})
+        metrics = client.metrics()
+        assert client.connection is connection
+    assert metrics['connections'] == 1
+    assert metrics['requests'] == 3
+
+
+def test_condition_profiles_are_evicted(airport_table):
+    service, running = start(airport_table, max_profiles=2)
+    conditions = [{'runway_surface': 'wet'}, {'runway_surface': 'icy'}, {'wind': 'tailwind'}]
+    with running as address, DiversionClient(*address) as client:
+        first = client.nearest(45.0, 10.0, conditions=conditions[0])
+        for condition in conditions[1:]:
+            client.nearest(45.0, 10.0, conditions=condition)
+        metrics = client.metrics()
+        assert metrics['evicted_profiles'] == 1
+        assert first['profile'] not in metrics['profiles']
+        assert len(service.eligibility.profiles) == 3
+        # an evicted profile is computed again when it is asked for, and a condition profile cannot be named
+        assert client.nearest(45.0, 10.0, conditions=conditions[0]) == first
+        assert client.request('POST', '/nearest', {'lat': 45.0, 'long': 10.0, 'profile': first['profile']})[0] == 400
+
+
+class UnwritableEligibilityTable(EligibilityTable):
+
+    def write(self, name, state):
+        if name != 'diversion':
+            raise OSError('disk full')
+        super().write(name, state)
+
+
+def test_a_failing_profile_only_fails_its_own_queries(airport_table, tmp_path):
+    service = DiversionService(airport_table, UnwritableEligibilityTable(airport_table, directory=str(tmp_path)),
+                               batch_window=0.2)
+    queries = [{'lat': 45.0, 'long': 10.0}, {'lat': 45.0, 'long': 10.0, 'conditions': {'runway_surface': 'wet'}},
+               {'lat': -30.0, 'long': 140.0}]
+    barrier = threading.Barrier(len(queries))
+    responses = [None] * len(queries)
+    with running_service(service) as address:
+        def query(i):
+            with DiversionClient(*address) as client:
+                barrier.wait()
+                responses[i] = client.request('POST', '/nearest', queries[i])
+
+        threads = [threading.Thread(target=query, args=(i,)) for i in range(len(queries))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with DiversionClient(*address) as client:
+            metrics = client.metrics()
+    assert metrics['batches'] == 1
+    assert [status for status, _ in responses] == [200, 500, 200]
+    assert 'disk full' in responses[1][1]['error']
+    for query, (_, result) in zip(queries[::2], responses[::2]):
+        assert result['airport']['position'] == service.eligibility.nearest(query['lat'], query['long'])[1]
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from airport_table import AirportTable
+from distribution_engine import accommodation_probability, landing_distance_distribution
+from eligibility import EligibilityTable
+
+
+@pytest.fixture
+def airport_table():
+    return AirportTable(np.array([10.0, 20.0, 30.0]), np.array([5.0, 15.0, 25.0]), np.array([0, 5871, 13000]),
+                        np.array([11000, 9000, 15000]), np.array(['A', 'B', 'C']),
+                        np.array(['ALPHA', 'BRAVO', 'CHARLIE']), np.array(['X', 'Y', 'Z']))
+
+
+def test_airports_use_the_high_altitude_category_whatever_their_elevation(airport_table):
+    conditions = {'runway_surface': 'wet', 'wind': 'tailwind'}
+    high = landing_distance_distribution(dict(conditions, altitude='high'), hypo_type='2')
+    np.testing.assert_array_equal(accommodation_probability(airport_table, conditions),
+                                  high.cdf(np.nextafter(np.asarray(airport_table.usable_length), 0)))
+
+    eligibility = EligibilityTable(airport_table, profiles={'wet': {'conditions': conditions}})
+    eligibility.update()
+    np.testing.assert_array_equal(eligibility.quantiles['wet']['quantiles'],
+                                  high.quantile(np.asarray(eligibility.levels)))
+    np.testing.assert_array_equal(eligibility.margin('wet', 0.5),
+                                  np.asarray(airport_table.usable_length) - high.quantile(0.5))
+
+
+def test_profiles_are_only_recomputed_when_they_change(airport_table, tmp_path):
+    eligibility = EligibilityTable(airport_table, profiles={'any': {'conditions': {}}}, directory=str(tmp_path))
+    assert eligibility.update() == {'any': True}
+    assert eligibility.update() == {'any': False}
+    stored = EligibilityTable(airport_table, profiles={'any': {'conditions': {}}}, directory=str(tmp_path))
+    assert stored.update() == {'any': False}
+    stored.set_profile('any', {'conditions': {'runway_surface': 'wet'}})
+    assert stored.update() == {'any': True}
@@ -0,0 +1,44 @@
+import math
+
+import numpy as np
+
+from importance_sampling import (DEFENSIVE_SHARE, MAX_EXPONENT, MIN_PROBABILITY, default_tilt, exceedance_probability,
+                                 sample_tilted)
+
+
+def extreme_tilt():
+    """
+    The most aggressive tilt update_tilt can produce: every stream at the largest exponent and all the mass on the
+    last category of every factor
+    """
+    tilt = default_tilt()
+    for factor, p in tilt['probabilities'].items():
+        q = np.full(len(p), MIN_PROBABILITY)
+        q[-1] = 1 - MIN_PROBABILITY * (len(p) - 1)
+        tilt['probabilities'][factor] = q
+    tilt['exponents'] = {stream: float(MAX_EXPONENT) for stream in tilt['exponents']}
+    return tilt
+
+
+def test_likelihood_ratio_is_bounded_under_extreme_tilt():
+    _, _, log_ratio = sample_tilted(200000, extreme_tilt(), np.random.default_rng(0))
+    assert np.all(np.isfinite(log_ratio))
+    assert log_ratio.max() <= -math.log(DEFENSIVE_SHARE) + 1e-12
+
+
+def test_likelihood_ratio_has_mean_one():
+    _, _, log_ratio = sample_tilted(400000, extreme_tilt(), np.random.default_rng(1))
+    ratio = np.exp(log_ratio)
+    assert abs(ratio.mean() - 1) < 5 * ratio.std() / math.sqrt(len(ratio))
+
+
+def test_untilted_sampling_has_unit_weights():
+    _, _, log_ratio = sample_tilted(1000, default_tilt(), np.random.default_rng(2))
+    np.testing.assert_allclose(log_ratio, 0, atol=1e-12)
+
+
+def test_exceedance_weights_stay_small():
+    result = exceedance_probability(55000, n_trials=50000, seed=3, ce_trials=10000)
+    assert math.isfinite(result['max_weight'])
+    assert result['max_weight'] <= 1 / DEFENSIVE_SHARE + 1e-9
+    assert 0 < result['probability'] < 1e-4
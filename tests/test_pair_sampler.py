@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from pair_sampler import PairSampler, brute_force_pairs
+
+
+@pytest.fixture(scope='module')
+def airports():
+    rng = np.random.default_rng(13)
+    return rng.uniform(-60, 70, 150), rng.uniform(-180, 180, 150)
+
+
+@pytest.mark.parametrize('limit', [6570, (500, 3000)])
+def test_samples_only_valid_pairs_with_the_right_degrees(airports, limit):
+    lat, long = airports
+    pairs = brute_force_pairs(lat, long, *((limit,) if np.ndim(limit) == 0 else limit[::-1]))
+    sampler = PairSampler(lat, long, ranges={'test': limit}, tile_size=8)
+    np.testing.assert_array_equal(sampler.valid_degrees('test'), np.bincount(pairs[:, 0], minlength=len(lat)))
+    origin, destination = sampler.sample(20000, seed=2, aircraft='test')
+    valid = set(map(tuple, pairs.tolist()))
+    assert all((o, d) in valid for o, d in zip(origin.tolist(), destination.tolist()))
+    # every valid pair is equally likely, so with ~20 draws per pair nearly all of them show up
+    assert len(set(zip(origin.tolist(), destination.tolist()))) > 0.9 * len(valid)
+
+
+def test_evicting_the_cache_does_not_change_the_samples(airports):
+    lat, long = airports
+    cached = PairSampler(lat, long, tile_size=8)
+    # a cache of one entry also keeps only the counts of the partial tiles, never the destination lists
+    evicting = PairSampler(lat, long, tile_size=8, cache_size=1)
+    for seed in range(3):
+        for expected, sampled in zip(cached.sample(3000, seed=seed), evicting.sample(3000, seed=seed)):
+            np.testing.assert_array_equal(sampled, expected)
+    assert len(evicting.destinations['default']) == 1
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from benchmarks import synthetic_airport_table
+from parallel_runner import finalize_summary, merge_summaries, run_hypo1_parallel, run_hypo2_parallel, summarize
+
+
+@pytest.fixture(scope='module')
+def airport_table():
+    return synthetic_airport_table(200)
+
+
+def test_results_do_not_depend_on_the_number_of_workers(airport_table):
+    assert (run_hypo1_parallel(airport_table, 5000, seed=3, workers=1, chunk_size=1000) ==
+            run_hypo1_parallel(airport_table, 5000, seed=3, workers=2, chunk_size=1000))
+    one, two = (run_hypo2_parallel(airport_table, 4, seed=3, workers=workers) for workers in [1, 2])
+    assert one['nearest_airport_distance'] == two['nearest_airport_distance']
+    for route_one, route_two in zip(one['routes'], two['routes']):
+        assert route_one.keys() == route_two.keys()
+        for key in route_one:
+            np.testing.assert_array_equal(route_one[key], route_two[key])
+
+
+def test_merged_summaries_keep_the_variance_of_large_values():
+    values = np.random.default_rng(0).normal(1e9, 1, 10000)
+    merged = summarize(values[:3000])
+    for start in range(3000, len(values), 2500):
+        merged = merge_summaries(merged, summarize(values[start:start + 2500]))
+    summary = finalize_summary(merged)
+    assert summary['count'] == len(values)
+    assert summary['mean'] == pytest.approx(values.mean(), rel=1e-15)
+    assert summary['std'] == pytest.approx(values.std(ddof=1), rel=1e-6)
@@ -0,0 +1,26 @@
+import math
+
+import numpy as np
+
+import route_corridor
+from route_corridor import max_waypoint_error_km
+
+
+def test_waypoints_stay_within_70_m_of_the_geodesic():
+    rng = np.random.default_rng(12)
+    for lat1, long1, lat2, long2 in zip(rng.uniform(-80, 80, 5), rng.uniform(-180, 180, 5), rng.uniform(-80, 80, 5),
+                                        rng.uniform(-180, 180, 5)):
+        assert max_waypoint_error_km(lat1, long1, lat2, long2) < 0.07
+
+
+def test_nan_waypoint_is_reported(monkeypatch):
+    route_waypoints = route_corridor.route_waypoints
+
+    def with_nan(*args):
+        waypoints = route_waypoints(*args)
+        waypoints['lat'] = np.array(waypoints['lat'], dtype=np.float64)
+        waypoints['lat'][len(waypoints['lat']) // 2] = np.nan
+        return waypoints
+
+    monkeypatch.setattr(route_corridor, 'route_waypoints', with_nan)
+    assert math.isnan(max_waypoint_error_km(40, -75, 51, 0))